@@ -16,6 +16,8 @@ import os, sys, six, pimms
 from ..freesurfer                   import (subject, add_subject_path)
 from ..vision                       import (register_retinotopy, retinotopy_model, clean_retinotopy,
                                             empirical_retinotopy_data)
+from ..java                         import java_executor
+from ..util                         import config
 
 info = '''
 The register_retinotopy command can be used to register a subject's
@@ -463,6 +465,15 @@ def calc_registrations(note, error, cortices, model, model_sym,
                                          yield_imap=True)
         except Exception: #error('Exception caught while setting-up register_retinotopy (%s)' % h)
             raise
+    # The registrations are lazy; if there is more than one JVM (see the java_gateway_count config
+    # item), we run them concurrently on the JVM pool (see java_executor) and wait for them to
+    # finish; otherwise they run one at a time as they are requested
+    if config['java_gateway_count'] > 1:
+        futs = {h: java_executor().submit(lambda imap: imap['registered_map'], imap)
+                for (h,imap) in six.iteritems(res)}
+        for (h,fut) in six.iteritems(futs):
+            note('Running %s Registration...' % h.upper())
+            fut.result()
     return {'registrations': pyr.pmap(res)}
 @pimms.calc('surface_files')
 def save_surface_files(note, error, registrations, subject,
@@ -2,7 +2,7 @@
 # neuropythy/freesurfer/__init__.py
 # This file defines the FreeSurfer tools that are available as part of neuropythy.
 
-from .core import (Subject, subject, forget_subject, forget_all, tkr_vox2ras,
+from .core import (Subject, subject, forget_subject, forget_all, subject_cache, tkr_vox2ras,
                    find_subject_path, subject_paths, add_subject_path, clear_subject_paths,
-                   to_mgh)
+                   to_mgh, load_mgh_memmap)
 
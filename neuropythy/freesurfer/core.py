@@ -8,14 +8,14 @@ import nibabel                      as nib
 import nibabel.freesurfer.io        as fsio
 import nibabel.freesurfer.mghformat as fsmgh
 import pyrsistent                   as pyr
-import os, warnings, six, pimms
+import os, gzip, shutil, warnings, weakref, threading, six, pimms
 
 from .. import geometry as geo
 from .. import mri      as mri
 from .. import io       as nyio
 #import ..io as nyio
 
-from ..util import (config, library_path)
+from ..util import (config, library_path, array_digest)
 
 ####################################################################################################
 # Subject Directory and where to find Subjects
@@ -129,11 +129,92 @@ def find_subject_path(sub, check_path=True):
                  if os.path.isdir(p)),
                 sub)
 
+# MGH images are loaded as memory-maps of their files; compressed (.mgz) files can only be mapped if
+# the config item mgz_cache_path is set, in which case they are decompressed once into that
+# directory and mapped from there; otherwise they are read into memory.
+config.declare_dir('mgz_cache_path')
+def _is_mgz(filename):
+    flnm = filename.lower()
+    return flnm.endswith('.mgz') or flnm.endswith('.gz')
+def _mgz_cache_file(filename):
+    '''
+    _mgz_cache_file(filename) yields the name of an uncompressed copy of the given compressed mgz
+      file in the mgz cache directory (config['mgz_cache_path']), creating it if necessary.
+    '''
+    st = os.stat(filename)
+    key = array_digest(os.path.abspath(filename), int(st.st_size), float(st.st_mtime))
+    flnm = os.path.join(config['mgz_cache_path'], 'mgz_%s.mgh' % key)
+    if os.path.isfile(flnm): return flnm
+    # write to a temporary file first so that readers never see a partial file
+    tmp = flnm[:-4] + '.%d.%d.tmp.mgh' % (os.getpid(), threading.current_thread().ident)
+    try:
+        with gzip.open(filename, 'rb') as fin, open(tmp, 'wb') as fout:
+            shutil.copyfileobj(fin, fout, 2**20)
+        os.rename(tmp, flnm)
+    finally:
+        if os.path.isfile(tmp): os.remove(tmp)
+    return flnm
+def load_mgh_memmap(filename, mode='r'):
+    '''
+    load_mgh_memmap(filename) yields an MGHImage object for the given mgh or mgz file whose data is
+      a read-only numpy memmap of the file's data. Compressed (mgz) files are mapped only if the
+      directory neuropythy.config['mgz_cache_path'] is set: they are decompressed once into it and
+      are mapped from there, and the decompressed files persist and are shared across processes.
+      Otherwise, the data of compressed files are read into memory (and are also read-only).
+    load_mgh_memmap(filename, mode) uses the given numpy memmap mode; e.g., 'c' yields a
+      copy-on-write array that can be modified without changing the file.
+
+    If the file cannot be memory-mapped, then its data are loaded into memory instead.
+    '''
+    (flnm, img) = (filename, None)
+    if _is_mgz(filename):
+        try: flnm = None if config['mgz_cache_path'] is None else _mgz_cache_file(filename)
+        except Exception: flnm = None
+    if flnm is not None:
+        try:
+            img = fsmgh.load(flnm, mmap=mode)
+            arr = np.asanyarray(img.dataobj)
+        except Exception: img = None
+    if img is None:
+        img = fsmgh.load(filename)
+        arr = np.asanyarray(img.dataobj)
+    if mode == 'r' and arr.flags.writeable: arr.setflags(write=False)
+    return fsmgh.MGHImage(arr, img.affine, img.header)
 # Used to load immutable-like mgh objects
 def _load_imm_mgh(flnm):
-    img = fsmgh.load(flnm)
-    img.get_data().setflags(write=False)
-    return img
+    return load_mgh_memmap(flnm, 'r')
+
+# The ribbon image is classified into its tissue classes in a single pass, and the result is kept
+# for as long as the ribbon image itself is alive; the masks and voxel indices of a subject are all
+# derived from this classification.
+_ribbon_labels = pyr.pmap({'lh_gray': 3, 'lh_white': 2, 'rh_gray': 42, 'rh_white': 41})
+_ribbon_class_cache = weakref.WeakKeyDictionary()
+_ribbon_class_lock = threading.Lock()
+def _ribbon_classes(ribbon):
+    '''
+    _ribbon_classes(ribbon) yields a persistent map whose keys are 'lh_gray', 'lh_white', 'rh_gray',
+      'rh_white', and 'brain', and whose values are the sorted flat (C-order) indices of the voxels
+      in the given ribbon image that belong to each class ('brain' being all non-zero voxels).
+    '''
+    # the lock only guards the cache itself, so that different ribbons are classified in parallel;
+    # two threads classifying the same ribbon at once both do the work, and the first result wins
+    with _ribbon_class_lock:
+        r = _ribbon_class_cache.get(ribbon)
+    if r is not None: return r
+    arr = np.asarray(ribbon.dataobj).ravel()
+    brain = np.flatnonzero(arr)
+    labs = arr[brain]
+    # a stable sort keeps each class's indices in order
+    ii = np.argsort(labs, kind='mergesort')
+    labs = labs[ii]
+    r = {'brain': brain}
+    for (k,v) in six.iteritems(_ribbon_labels):
+        (i0, i1) = np.searchsorted(labs, [v, v+1])
+        r[k] = brain[ii[i0:i1]]
+    for u in six.itervalues(r): u.setflags(write=False)
+    r = pyr.pmap(r)
+    with _ribbon_class_lock:
+        return _ribbon_class_cache.setdefault(ribbon, r)
 
 # A freesurfer.Subject is much like an mri.Subject, but its dependency structure all comes from the
 # path rather than data provided to the constructor:
@@ -153,7 +234,8 @@ class Subject(mri.Subject):
         self.path = path
         self.meta_data = meta_data
         self.hemis = Subject.load_hemis(name, path)
-        self.images = Subject.load_images(name, path)
+        self.mgh_images = Subject.load_mgh_images(name, path)
+        self.images = Subject.load_images(name, path, mgh_images=self.mgh_images)
         # these are the only actually required data for the constructor; the rest is values
 
     # This [private] function and this variable set up automatic properties from the FS directory
@@ -227,7 +309,7 @@ class Subject(mri.Subject):
             return _load_fn
         def _make_mghprop_loader(flnm):
             def _load_fn():
-                p = fsmgh.load(flnm).get_data().flatten()
+                p = np.asanyarray(fsmgh.load(flnm).dataobj).flatten()
                 p.setflags(write=False)
                 return p
             return _load_fn
@@ -297,15 +379,18 @@ class Subject(mri.Subject):
         '''
         surf_path = os.path.join(path, 'surf')
         # basically, we want to create a lh and rh hemisphere object with automatically-loaded
-        # properties based on the above auto-property data
+        # properties based on the above auto-property data; the hemispheres are loaded lazily, so
+        # no surface is read until a hemisphere is first requested
+        def _make_cortex_loader(h, xh, spath):
+            return lambda:Subject._cortex_from_path(name, h, xh, spath, surf_path)
         ctcs = {}
         for h in ['lh', 'rh']:
-            ctcs[h] = Subject._cortex_from_path(name, h, h, surf_path, surf_path)
+            ctcs[h] = _make_cortex_loader(h, h, surf_path)
         # we also want to check for the xhemi subject
         xpath = os.path.join(path, 'xhemi', 'surf')
         if os.path.isdir(xpath):
             for (h,xh) in zip(['lh', 'rh'], ['rhx', 'lhx']):
-                ctcs[xh] = Subject._cortex_from_path(name, h, xh, xpath, surf_path)
+                ctcs[xh] = _make_cortex_loader(h, xh, xpath)
         # that's all!
         return pimms.lazy_map(ctcs)
     @staticmethod
@@ -330,26 +415,30 @@ class Subject(mri.Subject):
             return _loader
         return pimms.lazy_map({os.path.split(flnm)[-1][:-4]: _make_loader(flnm) for flnm in fls})
     @staticmethod
-    def load_images(name, path):
+    def load_images(name, path, mgh_images=None):
         '''
         Subject.load_images(name, path) yields a persistent map of MRImages tracked by the given
           subject sub; in freesurfer subjects these are renamed and converted from their typical
           freesurfer filenames (such as 'ribbon') to forms that conform to the neuropythy naming
           conventions (such as 'gray_mask'). To access data by their original names, use the
           Subject.load_mgh_images() function.
+        Subject.load_images(name, path, mgh_images) uses the given map of MGH images, as returned
+          by Subject.load_mgh_images(), instead of loading a new one.
         '''
         ims = {}
-        mgh_images = Subject.load_mgh_images(name, path)
-        def _make_imm_mask(arr, val, eq=True):
-            arr = (arr == val) if eq else (arr != val)
+        if mgh_images is None: mgh_images = Subject.load_mgh_images(name, path)
+        def _make_imm_mask(cls):
+            rib = mgh_images['ribbon']
+            arr = np.zeros(rib.shape, dtype=np.bool_)
+            arr.reshape(-1)[_ribbon_classes(rib)[cls]] = True
             arr.setflags(write=False)
-            return fsmgh.MGHImage(arr, mgh_images['ribbon'].affine, mgh_images['ribbon'].header)
-        # start with the ribbon:
-        ims['lh_gray_mask']  = lambda:_make_imm_mask(mgh_images['ribbon'].get_data(), 3)
-        ims['lh_white_mask'] = lambda:_make_imm_mask(mgh_images['ribbon'].get_data(), 2)
-        ims['rh_gray_mask']  = lambda:_make_imm_mask(mgh_images['ribbon'].get_data(), 42)
-        ims['rh_white_mask'] = lambda:_make_imm_mask(mgh_images['ribbon'].get_data(), 41)
-        ims['brain_mask']    = lambda:_make_imm_mask(mgh_images['ribbon'].get_data(), 0, False)
+            return fsmgh.MGHImage(arr, rib.affine, rib.header)
+        # start with the ribbon; all of these masks share a single classification of its voxels
+        ims['lh_gray_mask']  = lambda:_make_imm_mask('lh_gray')
+        ims['lh_white_mask'] = lambda:_make_imm_mask('lh_white')
+        ims['rh_gray_mask']  = lambda:_make_imm_mask('rh_gray')
+        ims['rh_white_mask'] = lambda:_make_imm_mask('rh_white')
+        ims['brain_mask']    = lambda:_make_imm_mask('brain')
         # next, do the standard ones:
         def _make_accessor(nm): return lambda:mgh_images[nm]
         for (tname, name) in zip(['original', 'normalized', 'segmentation', 'brain'],
@@ -361,13 +450,56 @@ class Subject(mri.Subject):
                 tr = Subject._auto_retino_names[k]
                 ims[tr] = _make_accessor(k)
         return pimms.lazy_map(ims)
-    @pimms.value
-    def mgh_images(name, path):
+    @pimms.param
+    def mgh_images(ims):
         '''
         sub.mgh_images is a persistent map of MRImages, represented as MGHImage objects, tracked by
         the given FreeSurfer subject sub.
         '''
-        return Subject.load_mgh_images(name, path)
+        return ims
+    @pimms.value
+    def ribbon_classes(mgh_images):
+        '''
+        sub.ribbon_classes is a persistent map of the sorted flat (C-order) indices of the voxels in
+        each tissue class of the subject's ribbon image: 'lh_gray', 'lh_white', 'rh_gray',
+        'rh_white', and 'brain'. The ribbon is classified in a single pass, and this classification
+        is shared by the subject's masks and voxel indices.
+        '''
+        return _ribbon_classes(mgh_images['ribbon'])
+    @pimms.value
+    def lh_gray_indices(ribbon_classes, image_dimensions):
+        '''
+        See neuropythy.mri.Subject.lh_gray_indices.
+        '''
+        ii = np.unravel_index(ribbon_classes['lh_gray'], image_dimensions)
+        return tuple([pimms.imm_array(x) for x in ii])
+    @pimms.value
+    def rh_gray_indices(ribbon_classes, image_dimensions):
+        '''
+        See neuropythy.mri.Subject.rh_gray_indices.
+        '''
+        ii = np.unravel_index(ribbon_classes['rh_gray'], image_dimensions)
+        return tuple([pimms.imm_array(x) for x in ii])
+    @pimms.value
+    def lh_white_indices(ribbon_classes, image_dimensions):
+        '''
+        See neuropythy.mri.Subject.lh_white_indices.
+        '''
+        ii = np.unravel_index(ribbon_classes['lh_white'], image_dimensions)
+        return frozenset(zip(*ii))
+    @pimms.value
+    def rh_white_indices(ribbon_classes, image_dimensions):
+        '''
+        See neuropythy.mri.Subject.rh_white_indices.
+        '''
+        ii = np.unravel_index(ribbon_classes['rh_white'], image_dimensions)
+        return frozenset(zip(*ii))
+    @pimms.value
+    def image_dimensions(mgh_images):
+        '''
+        See neuropythy.mri.Subject.image_dimensions.
+        '''
+        return tuple(mgh_images['ribbon'].shape)
     @pimms.value
     def voxel_to_vertex_matrix(mgh_images):
         '''
@@ -419,9 +551,8 @@ def subject(name, meta_data=None, check_path=True):
             raise ValueError('Could not locate subject with name \'%s\'' % name)
         elif check_path:
             fpath = '/' + os.path.relpath(subpath, '/')
-            if fpath in subject._cache:
-                sub = subject._cache[fpath]
-            else:
+            sub = subject._cache.get(fpath)
+            if sub is None:
                 sub = Subject(subpath)
                 if isinstance(sub, Subject): subject._cache[fpath] = sub.persist()
         else:
@@ -430,7 +561,15 @@ def subject(name, meta_data=None, check_path=True):
     return (None                     if sub is None           else
             sub.with_meta(meta_data) if meta_data is not None else
             sub)
-subject._cache = {}
+subject._cache = mri.SubjectCache()
+def subject_cache():
+    '''
+    subject_cache() yields the SubjectCache object in which neuropythy's freesurfer module keeps the
+      subjects that it has loaded. The cache's stats() method reports its hits, misses, and
+      evictions as well as its number of subjects and their estimated size in bytes; see
+      neuropythy.mri.SubjectCache for the config items that limit the cache's size.
+    '''
+    return subject._cache
 def forget_subject(sid):
     '''
     forget_subject(sid) causes neuropythy's freesurfer module to forget about cached data for the
@@ -445,8 +584,8 @@ def forget_subject(sid):
     if sub.path in subject._cache:
         del subject._cache[sub.path]
     else:
-        for (k,v) in six.iteritems(subject._cache):
-            if v is sub:
+        for k in subject._cache.keys():
+            if subject._cache.peek(k) is sub:
                 del subject._cache[k]
                 break
     return None
@@ -455,7 +594,7 @@ def forget_all():
     forget_all() causes neuropythy's freesurfer module to forget all cached subjects. See also
     forget_subject.
     '''
-    subject._cache = {}
+    subject._cache.clear()
     return None
 
 # This function creates the tkr matrix for a volume given the dims
@@ -490,11 +629,16 @@ def tkr_vox2ras(img, zooms=None):
 
 # MGH Images!
 @nyio.importer('mgh', ('mgh', 'mgh.gz', 'mgz'))
-def load_mgh(filename, to='auto'):
+def load_mgh(filename, to='auto', mmap=True):
     '''
     load_mgh(filename) yields the MGHImage referened by the given filename by using the
       nibabel.freesurfer.mghformat.load function.
     
+    By default the data of an uncompressed (mgh) file, or of a compressed (mgz) file when the config
+    item mgz_cache_path is set, is a copy-on-write memory-map of the file (see load_mgh_memmap);
+    the optional argument mmap may be set to False to read the data into memory instead. Other
+    compressed files are loaded by nibabel as usual.
+    
     The optional argument 'to' may be used to coerce the resulting data to a particular format; the
     following arguments are understood:
       * 'header' will yield just the image header
@@ -508,21 +652,23 @@ def load_mgh(filename, to='auto'):
         in which case it is assumed to be a surface-field and the return value is equivalent to
         the 'field' value.
     '''
-    img = fsmgh.load(filename)
+    if mmap and (not _is_mgz(filename) or config['mgz_cache_path'] is not None):
+        img = load_mgh_memmap(filename, 'c')
+    else: img = fsmgh.load(filename)
     to = to.lower()
     if to == 'image':    return img
-    elif to == 'data':   return img.get_data()
+    elif to == 'data':   return np.asanyarray(img.dataobj)
     elif to == 'affine': return img.affine
     elif to == 'header': return img.header
     elif to == 'field':
-        dat = np.squeeze(img.get_data())
+        dat = np.squeeze(np.asanyarray(img.dataobj))
         if len(dat.shape) > 2:
             raise ValueError('image requested as field has more than 2 non-unitary dimensions')
         return dat
     elif to in ['auto', 'automatic']:
         dims = set(img.dataobj.shape)
         if 1 < len(dims) < 4 and 1 in dims:
-            return np.squeeze(img.get_data())
+            return np.squeeze(np.asanyarray(img.dataobj))
         else:
             return img
     else:
@@ -42,7 +42,7 @@ from .util import (
     prism_barycentric_coordinates)
 from .mesh import (VertexSet, Tesselation, Mesh, Topology, MapProjection, Path, PathTrace,
                    mesh, is_mesh, is_flatmap,
-                   tess, is_tess,
+                   tess, is_tess, shared_topology_count,
                    topo, is_topo,
                    is_vset, is_path, deduce_chirality,
                    map_projection, is_map_projection,
@@ -9,11 +9,12 @@ import numpy.linalg                 as npla
 import scipy                        as sp
 import scipy.spatial                as space
 import scipy.sparse                 as sps
+import scipy.sparse.linalg          as spsla
 import scipy.optimize               as spopt
 import nibabel                      as nib
 import nibabel.freesurfer.mghformat as fsmgh
 import pyrsistent                   as pyr
-import os, sys, six, types, logging, warnings, gzip, json, pimms
+import os, sys, six, types, logging, warnings, gzip, json, weakref, threading, pimms
 
 from .util  import (triangle_area, triangle_address, alignment_matrix_3D, rotation_matrix_3D,
                     cartesian_to_barycentric_3D, cartesian_to_barycentric_2D, vector_angle_cos,
@@ -22,13 +23,16 @@ from .util  import (triangle_area, triangle_address, alignment_matrix_3D, rotati
 from ..util import (ObjectWithMetaData, to_affine, zinv, is_image, is_address, address_data, curry,
                     curve_spline, CurveSpline, chop, zdivide, flattest, inner, config, library_path,
                     dirpath_to_list, to_hemi_str, is_tuple, is_list, is_set, close_curves,
-                    normalize, denormalize, AutoDict, auto_dict, times)
+                    normalize, denormalize, AutoDict, auto_dict, times, array_digest, LRUCache)
 from ..io   import (load, importer, exporter)
 from functools import reduce
 
 try:              from StringIO import StringIO
 except Exception: from io import StringIO
 
+if sys.version_info[0] == 3: from   collections import abc as colls
+else:                        import collections            as colls
+
 @pimms.immutable
 class VertexSet(ObjectWithMetaData):
     '''
@@ -457,6 +461,457 @@ def to_property(obj, prop=None,
     # That's it, just return
     return (prop, weights) if yield_weight else prop
 
+class RaggedArray(colls.Sequence):
+    '''
+    RaggedArray(offsets, data) is a read-only sequence of integer tuples stored in compressed
+      sparse row (CSR) form: the k'th element is tuple(data[offsets[k]:offsets[k+1]]). Ragged arrays
+      are used by the Tesselation class to store the vertex, edge, and face adjacency information of
+      a mesh without allocating a Python tuple per element; tuples are only created when an element
+      is requested.
+
+    The following attributes are available:
+      * ragged.offsets is the (n+1)-length array of row offsets into ragged.data.
+      * ragged.data is the flat array of all row elements.
+      * ragged.counts is the n-length array of the row lengths.
+    '''
+    __slots__ = ('offsets', 'data')
+    def __init__(self, offsets, data):
+        offsets = np.array(offsets, dtype=np.int32)
+        data = np.array(data, dtype=np.int32)
+        if len(offsets) == 0 or offsets[0] != 0 or offsets[-1] != len(data):
+            raise ValueError('ragged array offsets must run from 0 to len(data)')
+        offsets.setflags(write=False)
+        data.setflags(write=False)
+        object.__setattr__(self, 'offsets', offsets)
+        object.__setattr__(self, 'data', data)
+    def __setattr__(self, k, v):
+        raise TypeError('RaggedArray objects are immutable')
+    def __len__(self):
+        return len(self.offsets) - 1
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return tuple([self[ii] for ii in range(*k.indices(len(self)))])
+        n = len(self)
+        if k < 0: k += n
+        if k < 0 or k >= n: raise IndexError('RaggedArray index out of range')
+        return tuple(self.data[self.offsets[k]:self.offsets[k+1]].tolist())
+    def __iter__(self):
+        (o, d) = (self.offsets.tolist(), self.data.tolist())
+        for (a, b) in zip(o[:-1], o[1:]): yield tuple(d[a:b])
+    def __repr__(self):
+        return 'RaggedArray(<%d rows>, <%d elements>)' % (len(self), len(self.data))
+    @property
+    def counts(self):
+        '''
+        ragged.counts is the array of row lengths of the given ragged array.
+        '''
+        return np.diff(self.offsets)
+    @property
+    def rows(self):
+        '''
+        ragged.rows is an array, the same length as ragged.data, of the row index of each element.
+        '''
+        return np.repeat(np.arange(len(self), dtype=np.int32), self.counts)
+    def to_matrix(self, fill=-1):
+        '''
+        ragged.to_matrix() yields an (n x k) matrix where n is the number of rows in the given
+          ragged array and k is the length of its longest row; rows with fewer than k elements are
+          padded at their end with -1.
+        ragged.to_matrix(fill) uses the given fill value instead of -1.
+        '''
+        cnts = self.counts
+        k = np.max(cnts) if len(cnts) > 0 else 0
+        res = np.full((len(self), k), fill, dtype=self.data.dtype)
+        cols = np.arange(len(self.data)) - np.repeat(self.offsets[:-1], cnts)
+        res[self.rows, cols] = self.data
+        return res
+    def elements(self, rows):
+        '''
+        ragged.elements(rows) yields a flat array of the concatenated elements of the given rows of
+          the given ragged array; this is equivalent to, but much faster than,
+          numpy.concatenate([ragged[k] for k in rows]).
+        '''
+        rows = np.asarray(rows, dtype=int)
+        (a, cnts) = (self.offsets[rows], self.counts[rows])
+        if len(cnts) == 0: return self.data[:0]
+        ii = np.repeat(a - np.concatenate([[0], np.cumsum(cnts[:-1])]), cnts)
+        return self.data[ii + np.arange(len(ii))]
+    def map_data(self, f):
+        '''
+        ragged.map_data(f) yields a RaggedArray with the same row structure as the given ragged
+          array but whose data have been replaced by f(ragged.data).
+        '''
+        return RaggedArray(self.offsets, f(self.data))
+    @staticmethod
+    def from_groups(rows, data, n):
+        '''
+        RaggedArray.from_groups(rows, data, n) yields a RaggedArray with n rows in which each row k
+          contains the elements data[rows == k]; the relative order of the elements within each
+          row is the same as in data.
+        '''
+        rows = np.asarray(rows)
+        ii = np.argsort(rows, kind='mergesort')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n))])
+        return RaggedArray(offsets, np.asarray(data)[ii])
+
+@pimms.immutable
+class TesselationAdjacency(object):
+    '''
+    TesselationAdjacency is an immutable helper-class for Tesselation that stores the topology of a
+    triangle mesh as compact arrays. The vertex-to-face, vertex-to-edge, edge-to-face, and
+    face-to-face adjacency lists are stored as RaggedArray objects (int32 CSR arrays), and the edge
+    and face lookup tables are stored as sorted integer keys that can be searched in bulk. All of
+    these arrays are built using vectorized sorting and are computed lazily.
+
+    TesselationAdjacency objects operate only on vertex indices (not vertex labels); the Tesselation
+    class translates between the two. Generally, you should not need to create these objects
+    yourself; instead use tess.adjacency.
+    '''
+    def __init__(self, indexed_faces, vertex_count, parent=None):
+        self.indexed_faces = indexed_faces
+        self.vertex_count = vertex_count
+        self.parent = parent
+
+    @pimms.param
+    def indexed_faces(fs):
+        '''
+        adj.indexed_faces is the (3 x m) matrix of vertex indices that define the faces.
+        '''
+        fs = np.asarray(fs)
+        if fs.shape[0] != 3: raise ValueError('indexed_faces must be a (3 x m) matrix')
+        if not np.issubdtype(fs.dtype, np.integer): fs = fs.astype(int)
+        return pimms.imm_array(fs)
+    @pimms.param
+    def vertex_count(n):
+        '''
+        adj.vertex_count is the number of vertices in the tesselation.
+        '''
+        return int(n)
+    @pimms.param
+    def parent(p):
+        '''
+        adj.parent is None if the given adjacency object was built from scratch; otherwise it is the
+          tuple (adjacency, vertex_ids, face_ids) of the adjacency object of which adj is a subset
+          and the (sorted) indices of the parent's vertices and faces that adj keeps. The topology
+          arrays of a subset are derived from those of its parent.
+        '''
+        if p is None: return None
+        (adj, vids, fids) = p
+        if not isinstance(adj, TesselationAdjacency):
+            raise ValueError('parent adjacency must be a TesselationAdjacency object')
+        return (adj, pimms.imm_array(vids), pimms.imm_array(fids))
+    @pimms.value
+    def face_count(indexed_faces):
+        '''
+        adj.face_count is the number of faces in the tesselation.
+        '''
+        return indexed_faces.shape[1]
+    @pimms.value
+    def _half_edges(indexed_faces, vertex_count, parent):
+        '''
+        adj._half_edges is a tuple (edges, keys, face_edges, reverse) in which edges is the (2 x p)
+          matrix of unique undirected edges (with edges[0] < edges[1], sorted), keys is the sorted
+          vector of the int64 keys of these edges, face_edges is the (3 x m) matrix of the edge
+          index of each face's edges (a,b), (b,c), and (c,a), and reverse is a (3 x m) boolean
+          matrix that is True when the face traverses the associated edge from high to low index.
+        '''
+        (fs, n) = (indexed_faces, vertex_count)
+        m = fs.shape[1]
+        if parent is not None:
+            # the parent's edges that are in our faces, relabeled, are still sorted by key because
+            # the vertex relabeling is monotonic
+            (padj, vids, fids) = parent
+            (_, _, pfe, prev) = padj._half_edges
+            pfe = pfe[:,fids]
+            keep = np.zeros(padj.edge_count, dtype=bool)
+            keep[pfe] = True
+            eids = np.where(keep)[0]
+            edges = padj._vertex_remap(vids)[padj.edges[:,eids]]
+            keys = edges[0].astype(np.int64)*n + edges[1]
+            fe = (np.cumsum(keep) - 1)[pfe]
+            rev = prev[:,fids]
+            for x in (keys, edges, fe, rev): x.setflags(write=False)
+            return (edges, keys, fe, rev)
+        hu = np.concatenate([fs[0], fs[1], fs[2]]).astype(np.int64)
+        hv = np.concatenate([fs[1], fs[2], fs[0]]).astype(np.int64)
+        rev = hu > hv
+        hkeys = np.where(rev, hv*n + hu, hu*n + hv)
+        (keys, inv) = np.unique(hkeys, return_inverse=True)
+        edges = np.array([keys // n, keys % n], dtype=int)
+        for x in (keys, edges, inv, rev): x.setflags(write=False)
+        return (edges, keys, np.reshape(inv, (3, m)), np.reshape(rev, (3, m)))
+    @pimms.value
+    def edges(_half_edges):
+        '''
+        adj.edges is the (2 x p) matrix of the vertex indices of the p edges in the tesselation;
+          the edges are sorted and, for every edge, edges[0] < edges[1].
+        '''
+        return _half_edges[0]
+    @pimms.value
+    def edge_keys(_half_edges):
+        '''
+        adj.edge_keys is the sorted vector of int64 keys u*n + v for the edges (u,v) in adj.edges,
+          where n is the vertex count.
+        '''
+        return _half_edges[1]
+    @pimms.value
+    def face_edges(_half_edges):
+        '''
+        adj.face_edges is the (3 x m) matrix of the edge indices of each face's three edges; the
+          rows correspond to the face edges (a,b), (b,c), and (c,a) respectively.
+        '''
+        return _half_edges[2]
+    @pimms.value
+    def edge_count(edges):
+        '''
+        adj.edge_count is the number of edges in the tesselation.
+        '''
+        return edges.shape[1]
+    @pimms.value
+    def edge_faces(_half_edges, edge_count):
+        '''
+        adj.edge_faces is a RaggedArray of the faces adjacent to each edge. For each edge (u,v)
+          with u < v, the face that traverses the edge from u to v (if any) is listed first.
+        '''
+        (_, _, fe, rev) = _half_edges
+        (fe, rev) = (fe.flatten(), rev.flatten())
+        fids = np.tile(np.arange(fe.shape[0] // 3, dtype=np.int32), 3)
+        ii = np.lexsort((fids, rev, fe))
+        cnts = np.bincount(fe, minlength=edge_count)
+        return RaggedArray(np.concatenate([[0], np.cumsum(cnts)]), fids[ii])
+    @pimms.value
+    def face_neighbors(edge_faces, face_count):
+        '''
+        adj.face_neighbors is a RaggedArray of the faces that share an edge with each face; the
+          neighbors of each face are listed in the order of the shared edges' indices.
+        '''
+        cnts = edge_faces.counts
+        e = np.where(cnts == 2)[0]
+        (a, b) = [edge_faces.data[edge_faces.offsets[e] + k] for k in (0,1)]
+        (u, v, e) = (np.concatenate([a,b]), np.concatenate([b,a]), np.concatenate([e,e]))
+        ii = np.lexsort((e, u))
+        cnts = np.bincount(u, minlength=face_count)
+        return RaggedArray(np.concatenate([[0], np.cumsum(cnts)]), v[ii])
+    @pimms.value
+    def vertex_faces(indexed_faces, vertex_count):
+        '''
+        adj.vertex_faces is a RaggedArray of the (sorted) indices of the faces that contain each
+          vertex.
+        '''
+        m = indexed_faces.shape[1]
+        fids = np.repeat(np.arange(m, dtype=np.int32), 3)
+        return RaggedArray.from_groups(indexed_faces.T.flatten(), fids, vertex_count)
+    @pimms.value
+    def vertex_edges(edges, vertex_count):
+        '''
+        adj.vertex_edges is a RaggedArray of the (sorted) indices of the edges that contain each
+          vertex.
+        '''
+        eids = np.repeat(np.arange(edges.shape[1], dtype=np.int32), 2)
+        return RaggedArray.from_groups(edges.T.flatten(), eids, vertex_count)
+    @pimms.value
+    def neighborhoods(indexed_faces, vertex_count, parent):
+        '''
+        adj.neighborhoods is a RaggedArray of the ordered neighborhood of each vertex. For a vertex
+          u in the interior of the mesh, the neighborhood is the ring of vertices around u, in the
+          order of the faces' winding, starting with the vertex that follows u in the lowest-indexed
+          face that contains u. For a vertex on the boundary of the mesh, the neighborhood is the
+          fan of vertices around u from one boundary edge to the other, in winding order.
+        All fans are walked simultaneously: each face corner (u,a,b) is linked to the corner
+        (u,b,c) that continues the fan around u, and the fans are then traversed one step at a time
+        for all vertices at once. When adj is a subset of a parent adjacency object, only the
+        neighborhoods of vertices that have lost faces are walked; the rest are relabeled from the
+        parent's neighborhoods.
+        '''
+        if parent is None: return TesselationAdjacency._neighborhoods(indexed_faces, vertex_count)
+        (padj, vids, fids) = parent
+        n = vertex_count
+        # vertices that keep all of their faces keep their neighborhoods
+        pcnts = np.bincount(padj.indexed_faces.flatten(), minlength=padj.vertex_count)[vids]
+        cnts = np.bincount(indexed_faces.flatten(), minlength=n)
+        changed = (cnts != pcnts)
+        fs = indexed_faces[:, np.any(changed[indexed_faces], axis=0)]
+        sub = TesselationAdjacency._neighborhoods(fs, n)
+        pnei = padj.neighborhoods
+        (same, changed) = (np.where(~changed)[0], np.where(changed)[0])
+        rows = np.concatenate([np.repeat(same, pnei.counts[vids[same]]),
+                               np.repeat(changed, sub.counts[changed])])
+        data = np.concatenate([padj._vertex_remap(vids)[pnei.elements(vids[same])],
+                               sub.elements(changed)])
+        return RaggedArray.from_groups(rows, data, n)
+    @staticmethod
+    def _neighborhoods(indexed_faces, vertex_count):
+        '''
+        TesselationAdjacency._neighborhoods(indexed_faces, vertex_count) yields the RaggedArray of
+          neighborhoods for the given faces; see adj.neighborhoods.
+        '''
+        (fs, n) = (indexed_faces, vertex_count)
+        # the corners: for each face (a,b,c), corners (a,b,c), (b,c,a), and (c,a,b)
+        (u, a, b) = [np.concatenate([fs[i], fs[(i+1)%3], fs[(i+2)%3]]).astype(np.int64)
+                     for i in (0,1,2)]
+        k = len(u)
+        if k == 0: return RaggedArray(np.zeros(n + 1, dtype=np.int32), [])
+        # find each corner's successor (the corner (u,b,...)) and whether it has a predecessor
+        keys = u*n + a
+        srt = np.argsort(keys, kind='mergesort')
+        nxt = TesselationAdjacency._lookup_keys(keys[srt], u*n + b)
+        nxt = np.where(nxt >= 0, srt[nxt], -1)
+        haspred = np.zeros(k, dtype=bool)
+        haspred[nxt[nxt >= 0]] = True
+        # pick a starting corner for each vertex: the lowest face corner with no predecessor if
+        # the vertex is on a boundary, otherwise the lowest face corner
+        cid = np.arange(k)
+        fid = cid % (k // 3)
+        start = np.full(n, -1, dtype=np.int64)
+        for q in (np.ones(k, dtype=bool), ~haspred):
+            ii = np.lexsort((fid[q], u[q]))
+            (uq, jj) = np.unique(u[q][ii], return_index=True)
+            start[uq] = cid[q][ii][jj]
+        bnd = np.zeros(n, dtype=bool)
+        bnd[u[~haspred]] = True
+        # now walk all the fans together
+        pos = np.full(k, -1, dtype=np.int64)
+        cur = start[start >= 0]
+        step = 0
+        while len(cur) > 0:
+            pos[cur] = step
+            step += 1
+            cur = nxt[cur]
+            cur = cur[cur >= 0]
+            cur = cur[pos[cur] < 0]
+        # corners not reached (there may be some at non-manifold vertices) are dropped
+        ok = pos >= 0
+        (u, b, pos) = (u[ok], b[ok], pos[ok] + 1)
+        # boundary fans also begin with the first vertex of their starting corner
+        bv = np.where(bnd)[0]
+        u = np.concatenate([u, bv])
+        v = np.concatenate([b, a[start[bv]]])
+        pos = np.concatenate([pos, np.zeros(len(bv), dtype=np.int64)])
+        ii = np.lexsort((pos, u))
+        return RaggedArray(np.concatenate([[0], np.cumsum(np.bincount(u, minlength=n))]), v[ii])
+    @pimms.value
+    def _face_keys(indexed_faces, face_edges, edge_keys, vertex_count):
+        '''
+        adj._face_keys is a tuple (keys, ids) of the sorted int64 face keys and the face indices
+          that correspond to them. The key of face (a,b,c) with a <= b <= c is e*n + c where e is
+          the edge index of (a,b) and n is the vertex count.
+        '''
+        srt = np.sort(indexed_faces, axis=0)
+        e = TesselationAdjacency._lookup_keys(edge_keys, srt[0]*vertex_count + srt[1])
+        keys = e.astype(np.int64)*vertex_count + srt[2]
+        ids = np.argsort(keys, kind='mergesort')
+        keys = keys[ids]
+        for x in (keys, ids): x.setflags(write=False)
+        return (keys, ids)
+
+    @staticmethod
+    def _lookup_keys(keys, q):
+        '''
+        TesselationAdjacency._lookup_keys(keys, q) yields the indices into the sorted key vector
+          keys of the query keys q, or -1 for keys not found; when a key is duplicated, the last
+          matching index is returned.
+        '''
+        q = np.asarray(q, dtype=np.int64)
+        if len(keys) == 0: return np.full(q.shape, -1, dtype=int)
+        ii = np.searchsorted(keys, q, side='right') - 1
+        jj = np.clip(ii, 0, len(keys) - 1)
+        return np.where((ii >= 0) & (keys[jj] == q), jj, -1)
+    def _vertex_remap(self, vertex_ids):
+        '''
+        adj._vertex_remap(vertex_ids) yields a vector r such that r[vertex_ids[i]] == i and r[u] == -1
+          for any vertex u not in vertex_ids.
+        '''
+        r = np.full(self.vertex_count, -1, dtype=int)
+        r[vertex_ids] = np.arange(len(vertex_ids))
+        return r
+    def _valid_vertices(self, *args):
+        return reduce(np.logical_and, [(u >= 0) & (u < self.vertex_count) for u in args])
+    def edge_lookup(self, u, v):
+        '''
+        adj.edge_lookup(u, v) yields the edge index of the edge (u,v) where u and v are vertex
+          indices, or -1 if there is no such edge. The arguments u and v may be equal-length
+          vectors, in which case a vector is returned.
+        '''
+        (u, v) = [np.asarray(x, dtype=np.int64) for x in (u,v)]
+        ok = self._valid_vertices(u, v)
+        (u, v) = (np.where(ok, u, 0), np.where(ok, v, 0))
+        (u, v) = (np.minimum(u, v), np.maximum(u, v))
+        res = TesselationAdjacency._lookup_keys(self.edge_keys, u*self.vertex_count + v)
+        return np.where(ok, res, -1)
+    def face_lookup(self, a, b, c):
+        '''
+        adj.face_lookup(a, b, c) yields the face index of the face whose vertex indices are a, b,
+          and c (in any order), or -1 if there is no such face. The arguments may be equal-length
+          vectors, in which case a vector is returned.
+        '''
+        (a, b, c) = np.sort([np.asarray(x, dtype=np.int64) for x in (a,b,c)], axis=0)
+        e = self.edge_lookup(a, b)
+        ok = (e >= 0) & self._valid_vertices(c)
+        (keys, ids) = self._face_keys
+        res = TesselationAdjacency._lookup_keys(keys, np.where(ok, e*self.vertex_count + c, -1))
+        return np.where(ok & (res >= 0), ids[res], -1)
+
+class TesselationMap(colls.Mapping):
+    '''
+    TesselationMap is a read-only mapping whose keys are vertex labels or tuples of vertex labels
+    and whose values are looked-up in a Tesselation's adjacency arrays on demand. These are the
+    objects returned by tess.vertex_index, tess.edge_index, tess.face_index, tess.edge_face_index,
+    tess.vertex_edge_index, and tess.vertex_face_index; they behave like the dictionaries they
+    replace but do not store a Python object for each key.
+    '''
+    __slots__ = ('kind', 'labels', 'adjacency')
+    _kinds = ('vertex', 'edge', 'face', 'edge_faces', 'vertex_edges', 'vertex_faces')
+    def __init__(self, kind, labels, adjacency):
+        if kind not in TesselationMap._kinds: raise ValueError('Unrecognized map kind: %s' % kind)
+        object.__setattr__(self, 'kind', kind)
+        object.__setattr__(self, 'labels', labels)
+        object.__setattr__(self, 'adjacency', adjacency)
+    def __setattr__(self, k, v):
+        raise TypeError('TesselationMap objects are immutable')
+    def _vertex(self, u):
+        ii = TesselationAdjacency._lookup_keys(self.labels, u)
+        if ii < 0: raise KeyError(u)
+        return int(ii)
+    def __getitem__(self, k):
+        kind = self.kind
+        try:
+            if kind in ('vertex', 'vertex_edges', 'vertex_faces'):
+                ii = self._vertex(k)
+                if kind == 'vertex':       return ii
+                elif kind == 'vertex_edges': return self.adjacency.vertex_edges[ii]
+                else:                      return self.adjacency.vertex_faces[ii]
+            elif kind == 'face':
+                (a,b,c) = k
+                ii = self.adjacency.face_lookup(self._vertex(a), self._vertex(b), self._vertex(c))
+            else:
+                (u,v) = k
+                ii = self.adjacency.edge_lookup(self._vertex(u), self._vertex(v))
+        except (TypeError, ValueError): raise KeyError(k)
+        if ii < 0: raise KeyError(k)
+        return int(ii) if kind != 'edge_faces' else self.adjacency.edge_faces[ii]
+    def __len__(self):
+        adj = self.adjacency
+        return (len(self.labels) if self.kind.startswith('vertex') else
+                6*adj.face_count if self.kind == 'face' else
+                2*adj.edge_count)
+    def __iter__(self):
+        lbls = self.labels
+        if self.kind.startswith('vertex'):
+            for u in lbls: yield u
+        elif self.kind == 'face':
+            for (a,b,c) in zip(*lbls[self.adjacency.indexed_faces]):
+                for k in ((a,b,c), (b,c,a), (c,b,a), (a,c,b), (b,a,c), (c,a,b)): yield k
+        else:
+            for (u,v) in zip(*lbls[self.adjacency.edges]):
+                yield (u,v)
+                yield (v,u)
+    def __contains__(self, k):
+        try: self[k]
+        except KeyError: return False
+        return True
+    def __repr__(self):
+        return 'TesselationMap(<%s>, <%d keys>)' % (self.kind, len(self))
+
 @pimms.immutable
 class TesselationIndex(object):
     '''
@@ -465,105 +920,105 @@ class TesselationIndex(object):
     this is done via the __getitem__ (index[item]) method. In the case that you wish to obtain the
     vertex indices for an edge or face but don't wish to obtain the index of the edge or face
     itself, the __call__ (index(item)) method can be used. Note that when looking up the indices of
-    vertices, negative values are ignored/passed through. In this way, you can indicate a missing
-    vertex in a list with a -1 without being affected by indexing.
+    vertices, values that are not vertex labels in the tesselation (such as -1) yield None. All
+    lookups are performed using sorted searches over the arrays of the tesselation's adjacency
+    object (see TesselationAdjacency).
     '''
 
-    def __init__(self, vertex_index, edge_index, face_index):
-        self.vertex_index = vertex_index
-        self.edge_index = edge_index
-        self.face_index = face_index
+    def __init__(self, labels, adjacency):
+        self.labels = labels
+        self.adjacency = adjacency
 
     @pimms.param
-    def vertex_index(vi):
-        if not pimms.is_pmap(vi): vi = pyr.pmap(vi)
-        return vi
-    @pimms.param
-    def edge_index(ei):
-        if not pimms.is_pmap(ei): ei = pyr.pmap(ei)
-        return ei
+    def labels(lbls):
+        return pimms.imm_array(lbls)
     @pimms.param
-    def face_index(fi):
-        if not pimms.is_pmap(fi): fi = pyr.pmap(fi)
-        return fi
+    def adjacency(adj):
+        if not isinstance(adj, TesselationAdjacency):
+            raise ValueError('adjacency must be a TesselationAdjacency object')
+        return adj
     @pimms.value
-    def vertex_matrix(vertex_index):
-        ks = np.array(vertex_index.keys())
-        vs = np.array(vertex_index.values())
-        n = np.max(ks)
-        return sps.csr_matrix((vs + 1, (np.ones(len(ks)), ks)), shape=(1, n), dtype=np.int)
+    def vertex_index(labels, adjacency):
+        return TesselationMap('vertex', labels, adjacency)
     @pimms.value
-    def vertex_matrix(vertex_index):
-        ls = np.array(vertex_index.keys())
-        ii = np.array(vertex_index.values())
-        n = np.max(ls) + 1
-        return sps.csr_matrix((ii + 1, (np.zeros(len(ls)), ls)), shape=(1, n), dtype=np.int)
+    def edge_index(labels, adjacency):
+        return TesselationMap('edge', labels, adjacency)
     @pimms.value
-    def edge_matrix(edge_index):
-        (us,vs) = np.array(edge_index.keys()).T
-        ii = np.array(edge_index.values())
-        n = np.max([us,vs]) + 1
-        return sps.csr_matrix((ii + 1, (us, vs)), shape=(n, n), dtype=np.int)
-    @pimms.value
-    def face_matrix(face_index):
-        (a,b,c) = np.array(face_index.keys()).T
-        ii = np.array(face_index.values())
-        n = np.max([a,b,c]) + 1
-        # we have to cheat with the last two
-        bc = b*n + c
-        return sps.csr_matrix((ii + 1, (a,bc)), shape=(n, n*n), dtype=np.int)
+    def face_index(labels, adjacency):
+        return TesselationMap('face', labels, adjacency)
     
     def __repr__(self):
-            return "TesselationIndex(<%d vertices>)" % len(self.vertex_index)
+            return "TesselationIndex(<%d vertices>)" % len(self.labels)
+    def _vertices(self, u):
+        '''
+        index._vertices(u) yields the vertex indices of the vertex labels in the array u, with -1
+          for any label that is not in the tesselation.
+        '''
+        u = np.asarray(u)
+        if not np.issubdtype(u.dtype, np.integer):
+            # a non-integer array can only match labels at integer values
+            ok = np.isfinite(u) & (np.round(u) == u) if np.issubdtype(u.dtype, np.number) else \
+                 np.zeros(u.shape, dtype=bool)
+            u = np.where(ok, u, -1).astype(np.int64)
+        return TesselationAdjacency._lookup_keys(self.labels, u)
     def __getitem__(self, index):
         if is_tuple(index):
-            if   len(index) == 3: return self.face_index.get(index, None)
-            elif len(index) == 2: return self.edge_index.get(index, None)
-            elif len(index) == 1: return self.vertex_index.get(index[0], None)
-            else:                 raise ValueError('Unrecognized tesselation item: %s' % index)
+            if len(index) not in (1,2,3):
+                raise ValueError('Unrecognized tesselation item: %s' % index)
+            try: ii = self._vertices(index)
+            except Exception: return None
+            res = (ii[0]                            if len(index) == 1 else
+                   self.adjacency.edge_lookup(*ii)  if len(index) == 2 else
+                   self.adjacency.face_lookup(*ii))
+            if np.shape(res) == (): return None if res < 0 else int(res)
         elif is_set(index):
             return {k:self[k] for k in index}
         elif pimms.is_vector(index):
-            index = np.array(index)
-            mtx = self.vertex_matrix
-            yy = np.where((index >= 0) & (index < mtx.shape[1]))[0]
-            if len(yy) < len(index):
-                index = np.array(index)
-                res = np.full(len(index), -1)
-                res[yy] = flattest(mtx[0, index[yy]]) - 1
-            else: res = flattest(mtx[0, index]) - 1
+            res = self._vertices(index)
         elif pimms.is_matrix(index):
             m = np.asarray(index)
             if m.shape[0] != 2 and m.shape[0] != 3: m = m.T
-            if m.shape[0] == 2:
-                (u,v) = m
-                xx = np.where((u < 0) | (v < 0) | (u >= mtx.shape[0]) | (v >= mtx.shape[1]))[0]
-                if len(xx) > 0:
-                    (u,v) = [np.array(x) for x in (u,v)]
-                    u[xx] = 0
-                    v[xx] = 0
-                res = flattest(self.edge_matrix[(u,v)]) - 1
-            else:
-                (a,b,c) = m
-                mtx = self.face_matrix
-                bc = b*mtx.shape[0] + c
-                xx = np.where((a >= mtx.shape[0]) | (bc >= mtx.shape[1]))[0]
-                if len(xx) > 0:
-                    bc[xx] = 0
-                    a = np.array(a)
-                    a[xx] = 0
-                res = flattest(mtx[(a, bc)]) - 1
-        else: return self.vertex_index.get(index, None)
+            ii = self._vertices(m)
+            if m.shape[0] == 2: res = self.adjacency.edge_lookup(*ii)
+            else:               res = self.adjacency.face_lookup(*ii)
+        else:
+            res = self._vertices(index)
+            return None if res < 0 else int(res)
         ii = np.where(res < 0)[0]
         if len(ii) == 0: return res
-        res = res.astype(np.object)
+        res = res.astype(object)
         res[ii] = None
         return res
     def __call__(self, index):
-        if pimms.is_scalar(index): return self.vertex_index.get(index, None)
+        if pimms.is_scalar(index): return self[index]
         elif is_tuple(index):      return tuple([self[ii] for ii in index])
         else:                      return np.reshape(self[flattest(index)], np.shape(index))
 
+# Tesselations with identical faces share a single TesselationAdjacency object (and thus its lazily
+# computed topology); the shared objects are held weakly, keyed by a digest of the faces, so that a
+# topology is released when the last tesselation using it is released.
+_shared_adjacencies = weakref.WeakValueDictionary()
+_shared_adjacencies_lock = threading.Lock()
+def _shared_adjacency(key, faces, labels):
+    '''
+    _shared_adjacency(key, faces, labels) yields the TesselationAdjacency object for the given faces
+      and vertex labels, whose digest is key; the object is shared by all tesselations whose faces
+      have the same digest.
+    '''
+    with _shared_adjacencies_lock:
+        adj = _shared_adjacencies.get(key)
+        if adj is None:
+            adj = TesselationAdjacency(np.searchsorted(labels, faces), len(labels)).persist()
+            _shared_adjacencies[key] = adj
+        return adj
+def shared_topology_count():
+    '''
+    shared_topology_count() yields the number of distinct tesselation topologies that are currently
+      held in memory; tesselations with identical faces (e.g., the hemispheres of many fsaverage or
+      fs_LR subjects) share a topology.
+    '''
+    with _shared_adjacencies_lock: return len(_shared_adjacencies)
+
 @pimms.immutable
 class Tesselation(VertexSet):
     '''
@@ -577,6 +1032,7 @@ class Tesselation(VertexSet):
         # this class to a value instead of a param; instead we just set _properties directly
         self._properties = properties
         self.meta_data = meta_data
+        self._parent = None
 
     # The immutable parameters:
     @pimms.param
@@ -593,13 +1049,43 @@ class Tesselation(VertexSet):
                 raise ValueError('faces must be a (3 x m) or (m x 3) matrix')
         return pimms.imm_array(tris)
 
+    @pimms.param
+    def _parent(p):
+        '''
+        tess._parent is None unless tess was created by the subtess() method of another tesselation,
+          in which case it is the tuple (labels, adjacency, vertex_ids, face_ids) of the parent's
+          vertex labels and adjacency object and of the indices of the parent's vertices and faces
+          that are kept in tess. Sub-tesselations derive their topology from their parent's.
+        '''
+        if p is None: return None
+        (ls, adj, vids, fids) = p
+        return (pimms.imm_array(ls), adj, pimms.imm_array(vids), pimms.imm_array(fids))
+
     # The immutable values:
     @pimms.value
-    def labels(faces):
+    def _subset(faces, _parent):
+        '''
+        tess._subset is None if tess is not a sub-tesselation of a parent tesselation; otherwise it
+          is the tuple (labels, adjacency, vertex_ids, face_ids, indexed_faces) where the first four
+          elements are taken from tess._parent and indexed_faces is the relabeled parent faces. If
+          tess's faces do not agree with its parent's (e.g., because they were changed with the
+          copy() method), then this is None.
+        '''
+        if _parent is None: return None
+        (ls, adj, vids, fids) = _parent
+        if faces.shape[1] != len(fids): return None
+        pfs = adj.indexed_faces[:,fids]
+        if not np.array_equal(ls[pfs], faces): return None
+        r = np.full(len(ls), -1, dtype=int)
+        r[vids] = np.arange(len(vids))
+        return (ls, adj, vids, fids, pimms.imm_array(r[pfs]))
+    @pimms.value
+    def labels(faces, _subset):
         '''
         tess.labels is an array of the integer vertex labels; subsampling the tesselation object
         will maintain vertex labels (but not indices).
         '''
+        if _subset is not None: return pimms.imm_array(_subset[0][_subset[2]])
         return pimms.imm_array(np.unique(faces))
     @pimms.value
     def face_count(faces):
@@ -608,101 +1094,111 @@ class Tesselation(VertexSet):
         '''
         return faces.shape[1]
     @pimms.value
-    def face_index(faces):
+    def faces_digest(faces):
+        '''
+        tess.faces_digest is a digest string of the faces of the given tesselation; tesselations
+          with identical faces share their topology data.
+        '''
+        return array_digest(faces)
+    @pimms.value
+    def indexed_faces(faces, faces_digest, labels, _subset):
+        '''
+        tess.indexed_faces is identical to tess.faces except that each element has been indexed.
+        '''
+        if _subset is not None: return _subset[4]
+        return _shared_adjacency(faces_digest, faces, labels).indexed_faces
+    @pimms.value
+    def adjacency(faces, faces_digest, labels, indexed_faces, vertex_count, _subset):
+        '''
+        tess.adjacency is the TesselationAdjacency object that stores the topology of the given
+          tesselation (its vertex-to-face, vertex-to-edge, edge-to-face, and face-to-face adjacency
+          lists as well as its edge and face lookup tables) in compact CSR arrays. The adjacency
+          object operates on vertex indices rather than vertex labels; the remaining topology
+          values of the tesselation, such as tess.edge_faces and tess.index, are views of it.
+          Tesselations with identical faces share the same adjacency object.
+        '''
+        if _subset is None: return _shared_adjacency(faces_digest, faces, labels)
+        return TesselationAdjacency(indexed_faces, vertex_count, parent=_subset[1:4]).persist()
+    @pimms.value
+    def supertess_indices(_subset):
+        '''
+        tess.supertess_indices is None if tess was not created by the subtess() method of another
+          tesselation; otherwise it is the vector of the vertex indices, in the original
+          tesselation, of the vertices in tess.
+        '''
+        return None if _subset is None else _subset[2]
+    @pimms.value
+    def supertess_face_indices(_subset):
+        '''
+        tess.supertess_face_indices is None if tess was not created by the subtess() method of
+          another tesselation; otherwise it is the vector of the face indices, in the original
+          tesselation, of the faces in tess.
+        '''
+        return None if _subset is None else _subset[3]
+    @pimms.value
+    def face_index(labels, adjacency):
         '''
         tess.face_index is a mapping that indexes the faces by vertex labels (not vertex indices).
         '''
-        idx = {}
-        for (a,b,c,i) in zip(faces[0], faces[1], faces[2], range(faces.shape[1])):
-            idx[(a,b,c)] = i
-            idx[(b,c,a)] = i
-            idx[(c,b,a)] = i
-            idx[(a,c,b)] = i
-            idx[(b,a,c)] = i
-            idx[(c,a,b)] = i
-        return pyr.pmap(idx)
+        return TesselationMap('face', labels, adjacency)
     @pimms.value
-    def edge_data(faces):
+    def edge_data(edges, edge_index, edge_face_index):
         '''
         tess.edge_data is a mapping of data relevant to the edges of the given tesselation.
         '''
-        limit = np.max(faces) + 1
-        all_edges = np.hstack([[faces[0],faces[1]], [faces[1],faces[2]], [faces[2],faces[0]]])
-        (edge_list,cnt) = np.unique(np.sort(all_edges, axis=0), axis=1, return_counts=True)
-        rng = np.arange(edge_list.shape[1])
-        poss_edges = np.hstack([edge_list, np.flipud(edge_list)])
-        poss_idcs = np.concatenate([rng,rng])
-        idx = {k:ii for (k,ii) in zip(zip(poss_edges[0],poss_edges[1]), poss_idcs)}
-        rng = np.arange(faces.shape[1])
-        face_idcs = np.concatenate([rng,rng,rng])
-        esrt = np.sort(all_edges, axis=0)
-        edge2face = {k:ii for (k,ii) in zip(zip(*all_edges), face_idcs)}
-        for (e,er) in zip(zip(*edge_list), zip(*np.flipud(edge_list))):
-            tup = tuple([eff for q in (e,er) for eff in [edge2face.get(q)] if eff is not None])
-            assert(len(tup) > 0)
-            for eidx in (e,er): edge2face[eidx] = tup
-        edge_list.setflags(write=False)
-        return pyr.m(edges=edge_list,
-                     edge_index=pyr.pmap(idx),
-                     edge_face_index=pyr.pmap(edge2face))
+        return pyr.m(edges=edges, edge_index=edge_index, edge_face_index=edge_face_index)
     @pimms.value
-    def edges(edge_data):
+    def edges(labels, adjacency):
         '''
         tess.edges is a (2 x p) numpy array containing the p edge pairs that are included in the
         given tesselation.
         '''
-        return edge_data['edges']
+        return pimms.imm_array(labels[adjacency.edges])
     @pimms.value
-    def edge_count(edges):
+    def edge_count(adjacency):
         '''
         tess.edge_count is the number of edges in the given tesselation.
         '''
-        return edges.shape[1]
+        return adjacency.edge_count
     @pimms.value
-    def edge_index(edge_data):
+    def edge_index(labels, adjacency):
         '''
         tess.edge_index is a mapping that indexes the edges by vertex labels (not vertex indices).
         '''
-        return edge_data['edge_index']
+        return TesselationMap('edge', labels, adjacency)
     @pimms.value
-    def edge_face_index(edge_data):
+    def edge_face_index(labels, adjacency):
         '''
         tess.edge_face_index is a mapping that indexes the edges by vertex labels (not vertex
           indices) to a face index or pair of face indices. So for an edge from the vertex labeled
           u to the vertex labeled v, index.edge_face_index[(u,v)] is a tuple of the faces that are
           adjacent to the edge (u,v).
         '''
-        return edge_data['edge_face_index']
+        return TesselationMap('edge_faces', labels, adjacency)
     @pimms.value
-    def edge_faces(edges, edge_face_index):
+    def edge_faces(adjacency):
         '''
-        tess.edge_faces is a tuple that contains one element per edge; each element
-        tess.edge_faces[i] is a tuple of the 1 or two face indices of the faces that contain the
-        edge with edge index i.
+        tess.edge_faces is a sequence (a RaggedArray) that contains one element per edge; each
+        element tess.edge_faces[i] is a tuple of the 1 or two face indices of the faces that contain
+        the edge with edge index i.
         '''
-        return tuple([edge_face_index[e] for e in zip(*edges)])
+        return adjacency.edge_faces
     @pimms.value
-    def face_neighbors(edge_faces, face_count):
+    def face_neighbors(adjacency):
         '''
-        tess.face_neighbors is a tuple that contains one element per face; each element
-        tess.face_neighbors[i] is a tuple of the 0-3 face indices of the faces that are adjacent to
-        the face with index i.
-        '''
-        q = [[] for _ in range(face_count)]
-        for fs in edge_faces:
-            if len(fs) == 2:
-                (a,b) = fs
-                q[a].append(b)
-                q[b].append(a)
-        return tuple([tuple(qq) for qq in q])
+        tess.face_neighbors is a sequence (a RaggedArray) that contains one element per face; each
+        element tess.face_neighbors[i] is a tuple of the 0-3 face indices of the faces that are
+        adjacent to the face with index i.
+        '''
+        return adjacency.face_neighbors
     @pimms.value
-    def vertex_index(indices, labels):
+    def vertex_index(labels, adjacency):
         '''
         tess.vertex_index is an index of vertex-label to vertex index for the given tesselation.
         '''
-        return pyr.pmap({v:i for (i,v) in zip(indices, labels)})
+        return TesselationMap('vertex', labels, adjacency)
     @pimms.value
-    def index(vertex_index, edge_index, face_index):
+    def index(labels, adjacency):
         '''
         tess.index is a TesselationIndex object that indexed the faces, edges, and vertices in the
         given tesselation object. Vertex, edge, and face indices can be looked-up using the
@@ -721,98 +1217,61 @@ class Tesselation(VertexSet):
         sized vector (for vertices) or matrix (for edges and faces), and the result will be a list
         of the appropriate indices or an identically-sized array with the vertex indices.
         '''
-        idx = TesselationIndex(vertex_index, edge_index, face_index)
+        idx = TesselationIndex(labels, adjacency)
         return idx.persist()
     @pimms.value
-    def indexed_edges(edges, vertex_index):
+    def indexed_edges(adjacency):
         '''
         tess.indexed_edges is identical to tess.edges except that each element has been indexed.
         '''
-        return pimms.imm_array([[vertex_index[u] for u in row] for row in edges])
-    @pimms.value
-    def indexed_faces(faces, vertex_index):
-        '''
-        tess.indexed_faces is identical to tess.faces except that each element has been indexed.
-        '''
-        return pimms.imm_array([[vertex_index[u] for u in row] for row in faces])
+        return adjacency.edges
     @pimms.value
-    def vertex_edge_index(labels, edges):
+    def vertex_edge_index(labels, adjacency):
         '''
         tess.vertex_edge_index is a map whose keys are vertices and whose values are tuples of the
         edge indices of the edges that contain the relevant vertex.
         '''
-        d = {k:[] for k in labels}
-        for (i,(u,v)) in enumerate(edges.T):
-            d[u].append(i)
-            d[v].append(i)
-        return pyr.pmap({k:tuple(v) for (k,v) in six.iteritems(d)})
+        return TesselationMap('vertex_edges', labels, adjacency)
     @pimms.value
-    def vertex_edges(labels, vertex_edge_index):
+    def vertex_edges(adjacency):
         '''
-        tess.vertex_edges is a tuple whose elements are tuples of the edge indices of the edges
-        that contain the relevant vertex; i.e., for vertex u with vertex index i,
-        tess.vertex_edges[i] will be a tuple of the edges indices that contain vertex u.
+        tess.vertex_edges is a sequence (a RaggedArray) whose elements are tuples of the edge
+        indices of the edges that contain the relevant vertex; i.e., for vertex u with vertex index
+        i, tess.vertex_edges[i] will be a tuple of the edges indices that contain vertex u.
         '''
-        return tuple([vertex_edge_index[u] for u in labels])
+        return adjacency.vertex_edges
     @pimms.value
-    def vertex_face_index(labels, faces):
+    def vertex_face_index(labels, adjacency):
         '''
         tess.vertex_face_index is a map whose keys are vertices and whose values are tuples of the
         indices of the faces that contain the relevant vertex.
         '''
-        d = {k:[] for k in labels}
-        for (i,(u,v,w)) in enumerate(faces.T):
-            d[u].append(i)
-            d[v].append(i)
-            d[w].append(i)
-        return pyr.pmap({k:tuple(v) for (k,v) in six.iteritems(d)})
+        return TesselationMap('vertex_faces', labels, adjacency)
     @pimms.value
-    def vertex_faces(labels, vertex_face_index):
+    def vertex_faces(adjacency):
         '''
-        tess.vertex_faces is a tuple whose elements are tuples of the face indices of the faces
-        that contain the relevant vertex; i.e., for vertex u with vertex index i,
-        tess.vertex_faces[i] will be a tuple of the face indices that contain vertex u.
+        tess.vertex_faces is a sequence (a RaggedArray) whose elements are tuples of the face
+        indices of the faces that contain the relevant vertex; i.e., for vertex u with vertex index
+        i, tess.vertex_faces[i] will be a tuple of the face indices that contain vertex u.
         '''
-        return tuple([vertex_face_index[u] for u in labels])
-    @staticmethod
-    def _order_neighborhood(edges):
-        fres = [edges[0][1]]
-        bres = [edges[0][1]]
-        (fi,bi) = (0,0)
-        for _ in edges:
-            for e in edges:
-                if e[0] == fres[fi]:
-                    fres.append(e[1])
-                    fi += 1
-                    break
-        if fres[-1] == fres[0]:
-            fres = fres[:-1]
-        else:
-            for _ in range(len(edges) - fi):
-                for e in edges:
-                    if e[1] == bres[bi]:
-                        bres.append(e[0])
-                        bi += 1
-        return tuple(reversed(bres[1:])) + tuple(fres)
+        return adjacency.vertex_faces
     @pimms.value
-    def neighborhoods(labels, faces, vertex_faces):
+    def neighborhoods(labels, indexed_neighborhoods):
         '''
-        tess.neighborhoods is a tuple whose contents are the neighborhood of each vertex in the
-        tesselation.
+        tess.neighborhoods is a sequence (a RaggedArray) whose contents are the neighborhood of each
+        vertex in the tesselation. The neighborhood of each vertex is a tuple of the labels of its
+        neighbors in the order of the winding of the faces around it; for vertices on the boundary
+        of the tesselation, the neighborhood runs from one boundary neighbor to the other.
         '''
-        faces = faces.T
-        nedges = [[((f[0], f[1]) if f[2] == u else (f[1], f[2]) if f[0] == u else (f[2], f[0]))
-                   for f in faces[list(fs)]]
-                  for (u, fs) in zip(labels, vertex_faces)]
-        return tuple([Tesselation._order_neighborhood(nei) for nei in nedges])
+        return indexed_neighborhoods.map_data(lambda ii: labels[ii])
     @pimms.value
-    def indexed_neighborhoods(vertex_index, neighborhoods):
+    def indexed_neighborhoods(adjacency):
         '''
-        tess.indexed_neighborhoods is a tuple whose contents are the neighborhood of each vertex in
-        the given tesselation; this is identical to tess.neighborhoods except this gives the vertex
-        indices where tess.neighborhoods gives the vertex labels.
+        tess.indexed_neighborhoods is a sequence (a RaggedArray) whose contents are the neighborhood
+        of each vertex in the given tesselation; this is identical to tess.neighborhoods except
+        this gives the vertex indices where tess.neighborhoods gives the vertex labels.
         '''
-        return tuple([tuple([vertex_index[u] for u in nei]) for nei in neighborhoods])
+        return adjacency.neighborhoods
 
     # Requirements/checks
     @pimms.require
@@ -851,22 +1310,22 @@ class Tesselation(VertexSet):
         '''
         vertices = np.asarray(vertices)
         if len(vertices) != self.vertex_count or \
-           not np.array_equal(vertices, np.asarray(vertices, np.bool)):
+           not np.array_equal(vertices, np.asarray(vertices, bool)):
             tmp = self.index(vertices)
-            vertices = np.zeros(self.vertex_count, dtype=np.bool)
+            vertices = np.zeros(self.vertex_count, dtype=bool)
             vertices[tmp] = 1
-        vidcs = self.indices[vertices]
-        if len(vidcs) == self.vertex_count: return self
-        fsum = np.sum([vertices[f] for f in self.indexed_faces], axis=0)
-        fids = np.where(fsum == 3)[0]
+        if vertices.all(): return self
+        fids = np.where(np.all(vertices[self.indexed_faces], axis=0))[0]
         faces = self.faces[:,fids]
-        vidcs = self.index(np.unique(faces))
+        used = np.zeros(self.vertex_count, dtype=bool)
+        used[self.indexed_faces[:,fids]] = True
+        vidcs = np.where(used)[0]
         props = self._properties
         if props is not None and len(props) > 1: props = props[vidcs]
         md = self.meta_data.set(tag, self) if pimms.is_str(tag)   else \
              self.meta_data.set('supertess', self) if tag is True else \
              self.meta_data
-        dat = {'faces': faces}
+        dat = {'faces': faces, '_parent': (self.labels, self.adjacency, vidcs, fids)}
         if props is not self._properties: dat['_properties'] = props
         if md is not self.meta_data: dat['meta_data'] = md
         return self.copy(**dat)
@@ -890,6 +1349,234 @@ def tess(faces, properties=None, meta_data=None):
     '''
     return Tesselation(faces, properties=properties, meta_data=meta_data)
 
+@pimms.immutable
+class FaceGrid(object):
+    '''
+    FaceGrid is an immutable helper-class for Mesh that performs point-location (i.e., finds the
+    face of a mesh that contains a point) for many points at once. The faces of the mesh are
+    bucketed into a uniform grid of cells such that each face is listed in every cell that its
+    bounding box overlaps; a query point then only needs to be tested against the faces in its own
+    cell, and these tests are performed in bulk using vectorized barycentric coordinates.
+
+    For 2D meshes, the grid is built over the mesh coordinates and a point is contained by a face if
+    all of its barycentric coordinates in the face are non-negative. For 3D meshes, which are
+    assumed to be spherical (as with mesh.container in general), the grid is built over the unit-
+    normalized coordinates and a point is contained by a face if it lies in the cone that extends
+    from the origin through the face.
+
+    Generally, you should not need to create FaceGrid objects yourself; instead use mesh.face_grid.
+    '''
+    def __init__(self, face_coordinates, cell_size=None, tolerance=1e-9):
+        self.face_coordinates = face_coordinates
+        self.cell_size = cell_size
+        self.tolerance = tolerance
+
+    @pimms.param
+    def face_coordinates(fx):
+        '''
+        grid.face_coordinates is the (3 x d x m) array of the coordinates of the m faces.
+        '''
+        fx = np.asarray(fx, dtype=np.float64)
+        if len(fx.shape) != 3 or fx.shape[0] != 3 or fx.shape[1] not in (2,3):
+            raise ValueError('face_coordinates must be a (3 x d x m) array with d = 2 or 3')
+        return pimms.imm_array(fx)
+    @pimms.param
+    def cell_size(cs):
+        '''
+        grid.cell_size is either None, indicating that the cell size should be chosen automatically
+          from the sizes of the faces, or the width of the grid's cells.
+        '''
+        if cs is None: return None
+        cs = float(cs)
+        if not np.isfinite(cs) or cs <= 0: raise ValueError('cell_size must be a positive number')
+        return cs
+    @pimms.param
+    def tolerance(t):
+        '''
+        grid.tolerance is the amount by which a barycentric coordinate may be negative while its
+          point is still considered to be inside the face.
+        '''
+        return float(t)
+    @pimms.value
+    def spherical(face_coordinates):
+        '''
+        grid.spherical is True if the grid operates on the directions of 3D points (i.e., over a
+          spherical mesh) and False if it operates on 2D points.
+        '''
+        return face_coordinates.shape[1] == 3
+    @pimms.value
+    def _grid_face_coordinates(face_coordinates, spherical):
+        if not spherical: return face_coordinates
+        return pimms.imm_array(face_coordinates * zinv(np.sqrt(np.sum(face_coordinates**2,
+                                                                      axis=1)))[:,None,:])
+    @pimms.value
+    def _face_bounds(_grid_face_coordinates, spherical):
+        '''
+        grid._face_bounds is the (2 x d x m) array of the lower and upper corners of the bounding
+          boxes of each face; for spherical grids, these boxes are padded to account for the bulge
+          of the spherical triangle beyond its flat bounding box.
+        '''
+        fx = _grid_face_coordinates
+        (mn, mx) = (np.min(fx, axis=0), np.max(fx, axis=0))
+        if spherical:
+            # the sagitta of a chord of length L on the unit sphere is ~ L^2/8; pad with L^2/4
+            pad = np.max(mx - mn, axis=0)**2 / 4
+            (mn, mx) = (mn - pad, mx + pad)
+        return pimms.imm_array([mn, mx])
+    @pimms.value
+    def _cell_size(_face_bounds, cell_size):
+        if cell_size is not None: return cell_size
+        ext = np.max(_face_bounds[1] - _face_bounds[0], axis=0)
+        ext = ext[np.isfinite(ext)]
+        cs = np.median(ext) if len(ext) > 0 else 1.0
+        return cs if cs > 0 else 1.0
+    @pimms.value
+    def origin(_face_bounds):
+        '''
+        grid.origin is the lower corner of the grid.
+        '''
+        mn = _face_bounds[0]
+        mn = np.min(np.where(np.isfinite(mn), mn, np.inf), axis=1)
+        return pimms.imm_array(np.where(np.isfinite(mn), mn, 0))
+    @pimms.value
+    def shape(_face_bounds, origin, _cell_size):
+        '''
+        grid.shape is the number of grid cells along each dimension.
+        '''
+        mx = _face_bounds[1]
+        mx = np.max(np.where(np.isfinite(mx), mx, -np.inf), axis=1)
+        mx = np.where(np.isfinite(mx), mx, origin)
+        return tuple(np.floor((mx - origin) / _cell_size).astype(int) + 1)
+    @pimms.value
+    def _cells(_face_bounds, origin, _cell_size, shape):
+        '''
+        grid._cells is a tuple (keys, faces) where keys is the sorted vector of linear indices of
+          the non-empty grid cells and faces is the RaggedArray of the faces in each of these cells.
+        '''
+        (mn, mx) = _face_bounds
+        ok = np.where(np.isfinite(np.sum(mn + mx, axis=0)))[0]
+        lo = np.floor((mn[:,ok] - origin[:,None]) / _cell_size).astype(np.int64)
+        hi = np.floor((mx[:,ok] - origin[:,None]) / _cell_size).astype(np.int64)
+        cnts = hi - lo + 1
+        tots = np.prod(cnts, axis=0)
+        # each face gets one entry per cell in its bounding box
+        fids = np.repeat(ok, tots)
+        j = np.arange(np.sum(tots)) - np.repeat(np.cumsum(tots) - tots, tots)
+        key = np.zeros(len(j), dtype=np.int64)
+        stride = 1
+        for (l,c,s) in zip(lo, cnts, shape):
+            ck = np.repeat(c, tots)
+            key += (np.repeat(l, tots) + j % ck) * stride
+            j = j // ck
+            stride *= s
+        (keys, inv) = np.unique(key, return_inverse=True)
+        return (keys, RaggedArray.from_groups(inv, fids, len(keys)))
+    def _cell_lookup(self, x):
+        '''
+        grid._cell_lookup(x) yields the indices into grid._cells of the cells that contain the
+          (grid-space) points in the (d x n) matrix x, or -1 for points outside the grid.
+        '''
+        ijk = np.floor((x - self.origin[:,None]) / self._cell_size)
+        ok = np.all(np.isfinite(ijk), axis=0)
+        ok[ok] = np.all((ijk[:,ok] >= 0) & (ijk[:,ok] < np.asarray(self.shape)[:,None]), axis=0)
+        key = np.zeros(x.shape[1], dtype=np.int64)
+        stride = 1
+        for (ii,s) in zip(np.where(ok, ijk, 0).astype(np.int64), self.shape):
+            key += ii * stride
+            stride *= s
+        res = TesselationAdjacency._lookup_keys(self._cells[0], key)
+        return np.where(ok, res, -1)
+    def barycentric(self, faces, x):
+        '''
+        grid.barycentric(faces, x) yields the (3 x n) matrix of the barycentric coordinates of the
+          points in the (d x n) matrix x with respect to the faces (indices) in the given vector;
+          for spherical grids, these are the weights of the face's vertices whose sum is in the
+          direction of x. Points that cannot be expressed in terms of a face (such as points in a
+          degenerate face or, for spherical grids, points on the opposite side of the origin) have
+          coordinates of -inf.
+        '''
+        tx = self.face_coordinates[:,:,faces]
+        if self.spherical:
+            (a,b,c) = tx
+            w = np.asarray([np.sum(x * np.cross(u, v, axis=0), axis=0)
+                            for (u,v) in [(b,c), (c,a), (a,b)]])
+        else:
+            ((x1,y1), (x2,y2), (x3,y3)) = tx
+            (x, y) = x
+            w = np.asarray([(y2 - y3)*(x - x3) + (x3 - x2)*(y - y3),
+                            (y3 - y1)*(x - x3) + (x1 - x3)*(y - y3),
+                            (y1 - y2)*(x - x2) + (x2 - x1)*(y - y2)])
+        s = np.sum(w, axis=0)
+        bad = ~(s > 0) if self.spherical else np.isclose(s, 0)
+        s[bad] = 1
+        w = w / s
+        w[:,bad] = -np.inf
+        return w
+    def locate(self, x, chunk_size=65536):
+        '''
+        grid.locate(x) yields a tuple (faces, bc) where faces is a vector of the face indices of the
+          faces that contain each of the points in the (d x n) matrix x and bc is the (3 x n) matrix
+          of the barycentric coordinates of each point in its face. Points that are not in any face
+          have a face index of -1 and barycentric coordinates of nan. If a point is in more than one
+          face (e.g., on an edge), the face in which it lies furthest from the face's boundary is
+          chosen.
+
+        The optional argument chunk_size (default: 65536) specifies the number of points whose
+        candidate faces are tested at once; this bounds the memory used by the search.
+        '''
+        x = np.asarray(x, dtype=np.float64)
+        d = self.face_coordinates.shape[1]
+        if x.shape[0] != d: x = x.T
+        n = x.shape[1]
+        (faces, bc) = (np.full(n, -1, dtype=int), np.full((3, n), np.nan))
+        (keys, cfs) = self._cells
+        gx = x if not self.spherical else x * zinv(np.sqrt(np.sum(x**2, axis=0)))
+        chunk_size = n if chunk_size is None or chunk_size < 1 else int(chunk_size)
+        for k0 in range(0, n, chunk_size):
+            ii = np.arange(k0, min(n, k0 + chunk_size))
+            ci = self._cell_lookup(gx[:,ii])
+            ok = ci >= 0
+            (ii, ci) = (ii[ok], ci[ok])
+            pi = np.repeat(ii, cfs.counts[ci])
+            if len(pi) == 0: continue
+            fi = cfs.elements(ci)
+            w = self.barycentric(fi, x[:,pi])
+            score = np.min(w, axis=0)
+            q = np.where(score >= -self.tolerance)[0]
+            if len(q) == 0: continue
+            (pi, fi, w, score) = (pi[q], fi[q], w[:,q], score[q])
+            # for each point, keep the candidate face with the highest score
+            o = np.lexsort((-score, pi))
+            o = o[np.concatenate([[True], pi[o][1:] != pi[o][:-1]])]
+            faces[pi[o]] = fi[o]
+            bc[:,pi[o]] = w[:,o]
+        return (faces, bc)
+
+# Interpolation matrices are cached, both in memory and (optionally) on disk; the in-memory cache
+# holds the config's interpolation_cache_size most recently used matrices.
+def _to_cache_size(n):
+    if n is None: return None
+    n = int(n)
+    if n < 0: raise ValueError('cache sizes must be non-negative integers')
+    return n
+config.declare('interpolation_cache_size', filter=_to_cache_size, default_value=8)
+config.declare_dir('interpolation_cache_path')
+_interpolation_cache = LRUCache(sizeof=lambda m: m.data.nbytes + m.indices.nbytes + m.indptr.nbytes)
+def interpolation_cache():
+    '''
+    interpolation_cache() yields the LRUCache object in which neuropythy keeps the interpolation
+      matrices (prior to masking and weighting) that were most recently calculated by the
+      Mesh.interpolation_matrix() method; the number of matrices kept is given by the config item
+      neuropythy.config['interpolation_cache_size'] (default: 8). The cache's stats() method reports
+      its hits, misses, and evictions.
+
+    If the config item neuropythy.config['interpolation_cache_path'] is set to an existing
+    directory, then interpolation matrices are additionally saved there as .npz files and are
+    reloaded from there on a cache miss.
+    '''
+    _interpolation_cache.max_entries = config['interpolation_cache_size']
+    return _interpolation_cache
+
 @pimms.immutable
 class Mesh(VertexSet):
     '''
@@ -1056,6 +1743,20 @@ class Mesh(VertexSet):
         try:              return space.cKDTree(face_centers.T)
         except Exception: return space.KDTree(face_centers.T)
     @pimms.value
+    def fingerprint(coordinates, tess):
+        '''
+        mesh.fingerprint is a digest string of the coordinates and the (indexed) faces of the given
+          mesh; meshes with identical fingerprints are identical for the purposes of interpolation.
+        '''
+        return array_digest(coordinates, tess.indexed_faces)
+    @pimms.value
+    def face_grid(face_coordinates):
+        '''
+        mesh.face_grid is the FaceGrid object that is used to locate the faces that contain points
+          in the given mesh (see mesh.container and mesh.address).
+        '''
+        return FaceGrid(face_coordinates).persist()
+    @pimms.value
     def vertex_hash(coordinates):
         '''
         mesh.vertex_hash yields the scipy spatial hash of the vertices of the given mesh.
@@ -1116,7 +1817,8 @@ class Mesh(VertexSet):
         '''
         subt = self.tess.subtess(vertices, tag=tag_tess)
         if subt is self.tess: return self
-        vidcs = self.tess.index(subt.labels)
+        vidcs = subt.supertess_indices
+        if vidcs is None: vidcs = self.tess.index(subt.labels)
         props = self._properties
         if props is not None and props.row_count > 0:
             props = props[vidcs]
@@ -1158,19 +1860,6 @@ class Mesh(VertexSet):
                                (2,0,1))
             return point_in_triangle(tri, pt)
 
-    def _find_triangle_search(self, x, k=24, searched=set([]), n_jobs=-1):
-        # This gets called when a container triangle isn't found; the idea is that k should
-        # gradually increase until we find the container triangle; if k passes the max, then
-        # we give up and assume no triangle is the container
-        if k >= 288: return None
-        try:              (d,near) = self.facee_hash.query(x, k=k, n_jobs=n_jobs)
-        except Exception: (d,near) = self.facee_hash.query(x, k=k)
-        near = [n for n in near if n not in searched]
-        searched = searched.union(near)
-        tri_no = next((kk for kk in near if self.is_point_in_face(kk, x)), None)
-        return (tri_no if tri_no is not None
-                else self._find_triangle_search(x, k=(2*k), searched=searched))
-    
     def nearest_vertex(self, pt, n_jobs=-1):
         '''
         mesh.nearest_vertex(pt) yields the id number of the nearest vertex in the given
@@ -1191,7 +1880,7 @@ class Mesh(VertexSet):
         tri_no = np.asarray(tri_no)
         pt = np.asarray(pt)
         if tri_no.shape is () and len(pt.shape) == 1:
-            tx = self.coordinates[:, self.tess.faces[:, tri_no]]
+            tx = self.coordinates[:, self.tess.indexed_faces[:, tri_no]]
             n = self.face_normals[:, tri_no]
             d = np.dot(n, pt - tx[0])
             return (np.abs(d), pt - n*d)
@@ -1200,12 +1889,12 @@ class Mesh(VertexSet):
         else:
             pt = pt.T if pt.shape[0] != self.coordinates.shape[0] else pt
             tri_no = np.full(pt.shape[1], tri_no, dtype=np.int)
-        tx0 = self.coordinates[:,  self.tess.faces[0,tri_no]]
+        tx0 = self.coordinates[:,  self.tess.indexed_faces[0,tri_no]]
         n   = self.face_normals[:, tri_no]
         d   = np.sum(n * (pt - tx0), axis=0)
         return (np.abs(d), pt - n*d)
     
-    def nearest_data(self, pt, k=2, n_jobs=-1):
+    def nearest_data(self, pt, k=2, n_jobs=-1, chunk_size=65536):
         '''
         mesh.nearest_data(pt) yields a tuple (k, d, x) of the matrix x containing the point(s)
         nearest the given point(s) pt that is/are in the mesh; a vector d if the distances between
@@ -1213,23 +1902,23 @@ class Mesh(VertexSet):
         point(s) in x.
         Note that this function and those of this class are made for spherical meshes and are not
         intended to work with other kinds of complex topologies; though they might work 
-        heuristically.
+        heuristically. Points that are not contained by any face have a face index of None, a
+        distance of 0, and a nearest point of nan values.
+        The optional arguments k and n_jobs are accepted for backwards compatibility but are
+        ignored; the optional argument chunk_size is passed to mesh.face_grid.locate().
         '''
         pt = np.asarray(pt, dtype=np.float32)
         if len(pt.shape) == 1:
-            r = self.nearest_data([pt], k=k, n_jobs=n_jobs)[0];
+            r = self.nearest_data([pt], chunk_size=chunk_size)
             return (r[0][0], r[1][0], r[2][0])
         pt = pt.T if pt.shape[0] == self.coordinates.shape[0] else pt
-        try:              (d, near) = self.face_hash.query(pt, k=k, n_jobs=n_jobs)
-        except Exception: (d, near) = self.face_hash.query(pt, k=k)
-        ids = [tri_no if tri_no is not None else self._find_triangle_search(x, 2*k, set(near_i))
-               for (x, near_i) in zip(pt, near)
-               for tri_no in [next((k for k in near_i if self.is_point_in_face(k, x)), None)]]
-        pips = [self.point_in_plane(i, p) if i is not None else (0, None)
-                for (i,p) in zip(ids, pt)]
-        return (np.asarray(ids),
-                np.asarray([d[0] for d in pips]),
-                np.asarray([d[1] for d in pips]))
+        ids = self.face_grid.locate(pt.T, chunk_size=chunk_size)[0]
+        ok = np.where(ids >= 0)[0]
+        (d, x) = (np.zeros(len(pt)), np.full(pt.shape, np.nan))
+        if len(ok) > 0: (d[ok], x[ok]) = [u.T for u in self.point_in_plane(ids[ok], pt[ok])]
+        ids = ids.astype(object)
+        ids[ids < 0] = None
+        return (ids, d, x)
 
     def nearest(self, pt, k=2, n_jobs=-1):
         '''
@@ -1259,68 +1948,23 @@ class Mesh(VertexSet):
         dat = self.nearest_data(pt)
         return dat[1]
 
-    def container(self, pt, k=2, n_jobs=-1):
+    def container(self, pt, k=2, n_jobs=-1, chunk_size=65536):
         '''
         mesh.container(pt) yields the id number of the nearest triangle in the given
         mesh to the given point pt. If pt is an (n x dims) matrix of points, an id is given
         for each column of pt.
 
-        Implementation Note:
-          This method will fail to find the container triangle of a point if you have a very odd
-          geometry; the requirement for this condition is that, for a point p contained in a
-          triangle t with triangle center x0, there are at least n triangles whose centers are
-          closer to p than x0 is to p. The value n depends on your starting parameter k, but is
-          approximately 256.
+        The search is performed in bulk by mesh.face_grid (see FaceGrid); the optional argument
+        chunk_size (default: 65536) specifies how many points are searched at once. The arguments k
+        and n_jobs are accepted for backwards compatibility but are ignored.
         '''
         pt = np.asarray(pt)
         if len(pt.shape) == 1:
-            return self.container([pt], k=k, n_jobs=n_jobs)[0]
-        else:
-            if pt.shape[0] == self.coordinates.shape[0]: pt = pt.T
-            tcount = self.tess.faces.shape[1]
-            max_k = 256 if tcount > 256 else tcount
-            if k > tcount: k = tcount
-            def try_nearest(sub_pts, cur_k=k, top_i=0, near=None):
-                res = np.full(len(sub_pts), None, dtype=np.object)
-                if k != cur_k and cur_k > max_k: return res
-                if near is None:
-                    try:              near = self.face_hash.query(sub_pts, k=cur_k, n_jobs=n_jobs)[1]
-                    except Exception: near = self.face_hash.query(sub_pts, k=cur_k)[1]
-                # we want to try the nearest then recurse on those that didn't match...
-                guesses = near[:, top_i]
-                in_tri_q = self.is_point_in_face(guesses, sub_pts)
-                res[in_tri_q] = guesses[in_tri_q]
-                if in_tri_q.all(): return res
-                # recurse, trying the next nearest points
-                out_tri_q = np.logical_not(in_tri_q)
-                sub_pts = sub_pts[out_tri_q]
-                top_i += 1
-                res[out_tri_q] = (try_nearest(sub_pts, cur_k*2, top_i, None)
-                                  if top_i == cur_k else
-                                  try_nearest(sub_pts, cur_k, top_i, near[out_tri_q]))
-                return res
-            res = np.full(len(pt), None, dtype=np.object)
-            # filter out points that aren't close enough to be in a triangle:
-            (dmins, dmaxs) = [[f(x[np.isfinite(x)]) for x in self.coordinates]
-                              for f in [np.min, np.max]]
-            finpts = np.isfinite(np.sum(pt, axis=1))
-            if finpts.all():
-                if pt.shape[1] == 2:
-                    inside_q = reduce(np.logical_and,
-                                      [(x >= mn)&(x <= mx) for (x,mn,mx) in zip(pt.T,dmins,dmaxs)])
-                else:
-                    inside_q = np.full(len(pt), True, dtype=np.bool)
-            else:
-                inside_q = np.full(len(pt), False, dtype=np.bool)
-                if pt.shape[1] == 2:
-                    inside_q[finpts] = reduce(
-                        np.logical_and,
-                        [(x >= mn)&(x <= mx) for (x,mn,mx) in zip(pt[finpts].T,dmins,dmaxs)])
-                else:
-                    inside_q[finpts] = True
-            if not inside_q.any(): return res
-            res[inside_q] = try_nearest(pt[inside_q])
-            return res
+            return self.container([pt], chunk_size=chunk_size)[0]
+        if pt.shape[0] == self.coordinates.shape[0]: pt = pt.T
+        res = self.face_grid.locate(pt.T, chunk_size=chunk_size)[0].astype(object)
+        res[res < 0] = None
+        return res
 
     @staticmethod
     def scale_interpolation(interp, mask=None, weights=None):
@@ -1487,7 +2131,8 @@ class Mesh(VertexSet):
                 res = np.array(data[maxs], dtype=np.object)
                 res[bads] = np.nan
             return res
-    def interpolation_matrix(self, x, mask=None, weights=None, method='linear', n_jobs=-1):
+    def interpolation_matrix(self, x, mask=None, weights=None, method='linear', n_jobs=-1,
+                             cache_path=Ellipsis):
         '''
         mesh.interpolation_matrix(x) yields an interpolation matrix for the given point matrix x (x
           ay also be an address-data map).
@@ -1511,27 +2156,59 @@ class Mesh(VertexSet):
             data.
           * n_jobs (default: -1) is passed along to the cKDTree.query method, so may be set to an
             integer to specify how many processors to use, or may be -1 to specify all processors.
+          * cache_path (default: Ellipsis) specifies a directory in which the interpolation matrix
+            is saved to (or loaded from) a .npz file whose name is a digest of the mesh and the
+            points x; if Ellipsis, then neuropythy.config['interpolation_cache_path'] is used, and
+            if None, no file is used. Regardless of this option, recently calculated matrices are
+            kept in memory (see interpolation_cache()).
         '''
         if pimms.is_str(method): method = method.lower()
         if method in [None, Ellipsis, 'auto', 'automatic']:
             raise ValueError('interpolation_matrix() does not support method "automatic"')
         elif method in ['nn', 'nearest', 'near', 'nearest_neighbor', 'nearest-neighbor']:
-            return Mesh.scale_interpolation(
-                self.nearest_interpolation(x, n_jobs=n_jobs),
-                mask=mask,
-                weights=weights)
+            (method, f) = ('nearest', self.nearest_interpolation)
         elif method in ['linear', 'lin', 'trilinear']:
-            return Mesh.scale_interpolation(
-                self.linear_interpolation(x, n_jobs=n_jobs),
-                mask=mask,
-                weights=weights)
+            (method, f) = ('linear', self.linear_interpolation)
         elif method in ['heaviest', 'heavy', 'corner', 'h']:
-            return Mesh.scale_interpolation(
-                self.heaviest_interpolation(x, n_jobs=n_jobs),
-                mask=mask,
-                weights=weights)
+            (method, f) = ('heaviest', self.heaviest_interpolation)
         else: raise ValueError('unknown interpolation method: %s' % method)
-    def interpolate(self, x, data, mask=None, weights=None, method='automatic', n_jobs=-1):
+        if isinstance(x, Mesh): x = x.coordinates
+        # addresses are cheap to interpolate, so we don't bother caching them; anything that is not
+        # a numeric point matrix is handed to f as-is, since it cannot be digested
+        if is_address(x) or not pimms.is_array(x, 'number'): interp = f(x, n_jobs=n_jobs)
+        else: interp = self._cached_interpolation(x, method, f, n_jobs, cache_path)
+        return Mesh.scale_interpolation(interp, mask=mask, weights=weights)
+    def _cached_interpolation(self, x, method, f, n_jobs, cache_path):
+        '''
+        mesh._cached_interpolation(x, method, f, n_jobs, cache_path) yields the unscaled
+          interpolation matrix f(x) for the given method name, looking it up in or adding it to the
+          interpolation cache and the given cache_path (see interpolation_matrix()).
+        '''
+        x = np.asarray(x)
+        key = array_digest(self.fingerprint, x, method)
+        cache = interpolation_cache()
+        interp = cache.get(key)
+        if interp is not None: return interp
+        if cache_path is Ellipsis: cache_path = config['interpolation_cache_path']
+        flnm = None if cache_path is None else os.path.join(cache_path, 'interp_%s.npz' % key)
+        if flnm is not None and os.path.isfile(flnm):
+            try: interp = sps.load_npz(flnm).tocsr()
+            except Exception: interp = None
+        if interp is None:
+            interp = f(x, n_jobs=n_jobs).tocsr()
+            if flnm is not None:
+                # write to a temporary file first so that readers never see a partial file
+                tmp = flnm[:-4] + '.%d.tmp.npz' % os.getpid()
+                try:
+                    sps.save_npz(tmp, interp)
+                    os.rename(tmp, flnm)
+                except Exception:
+                    warnings.warn('Could not write interpolation cache file: %s' % flnm)
+                    if os.path.isfile(tmp): os.remove(tmp)
+        cache[key] = interp
+        return interp
+    def interpolate(self, x, data, mask=None, weights=None, method='automatic', n_jobs=-1,
+                    cache_path=Ellipsis):
         '''
         mesh.interpolate(x, data) yields a numpy array of the data interpolated from the given
           array, data, which must contain the same number of elements as there are points in the
@@ -1555,6 +2232,7 @@ class Mesh(VertexSet):
             data arrays if the method argument is 'linear'.
           * n_jobs (default: -1) is passed along to the cKDTree.query method, so may be set to an
             integer to specify how many processors to use, or may be -1 to specify all processors.
+          * cache_path (default: Ellipsis) is passed along to the interpolation_matrix() method.
         '''
         n = self.vertex_count
         if isinstance(x, Mesh): x = x.coordinates
@@ -1562,13 +2240,16 @@ class Mesh(VertexSet):
         interps = pimms.lazy_map(
             {'nearest':  lambda:self.interpolation_matrix(x,
                                                           n_jobs=n_jobs, method='nearest',
-                                                          mask=mask, weights=weights),
+                                                          mask=mask, weights=weights,
+                                                          cache_path=cache_path),
              'heaviest': lambda:self.interpolation_matrix(x,
                                                           n_jobs=n_jobs, method='heaviest',
-                                                          mask=mask, weights=weights),
+                                                          mask=mask, weights=weights,
+                                                          cache_path=cache_path),
              'linear':   lambda:self.interpolation_matrix(x,
                                                           n_jobs=n_jobs, method='linear',
-                                                          mask=mask, weights=weights)})
+                                                          mask=mask, weights=weights,
+                                                          cache_path=cache_path)})
         if pimms.is_str(method): method = method.lower()
         if method in [None, Ellipsis, 'auto', 'automatic']: method = None
         elif method in ['lin', 'linear', 'trilinear']: method = 'linear'
@@ -1612,23 +2293,25 @@ class Mesh(VertexSet):
             return tuple([_apply_interp(d) for d in data])
         else:
             return _apply_interp(data)
-    def address(self, data, n_jobs=-1):
+    def address(self, data, n_jobs=-1, chunk_size=65536):
         '''
         mesh.address(X) yields a dictionary containing the address or addresses of the point or
           points given in the vector or coordinate matrix X. Addresses specify a single unique 
           topological location on the mesh such that deformations of the mesh will address the same
           points differently. To convert a point from one mesh to another isomorphic mesh, you can
           address the point in the first mesh then unaddress it in the second mesh.
+
+        The optional argument chunk_size (default: 65536) specifies how many points are located at
+        once (see FaceGrid.locate); the argument n_jobs is ignored.
         '''
         # we have to have a topology and registration for this to work...
-        if isinstance(data, Mesh): return self.address(data.coordinates)
+        if isinstance(data, Mesh): return self.address(data.coordinates, chunk_size=chunk_size)
         data = np.asarray(data)
         idxfs = self.tess.indexed_faces
         coords = self.coordinates
         dims = coords.shape[0]
         if len(data.shape) == 1:
-            try:              face_id = self.container(data, n_jobs=n_jobs)
-            except Exception: face_id = self.container(data)
+            face_id = self.container(data, chunk_size=chunk_size)
             if face_id is None:
                 return {'faces':np.array([0,0,0]), 'coordinates':np.full(2,np.nan)}
             tx = coords[:, idxfs[:,face_id]].T
@@ -1636,15 +2319,14 @@ class Mesh(VertexSet):
         else:
             data = data if data.shape[1] == 3 or data.shape[1] == 2 else data.T
             n = data.shape[0]
-            try:              face_id = np.asarray(self.container(data), n_jobs=n_jobs)
-            except Exception: face_id = np.asarray(self.container(data))
+            face_id = self.face_grid.locate(data.T, chunk_size=chunk_size)[0]
             tx = np.full((3, dims, n), np.nan)
-            oks = np.where(np.logical_not(np.equal(face_id, None)))[0]
-            okfids = face_id[oks].astype('int')
+            oks = np.where(face_id >= 0)[0]
+            okfids = face_id[oks]
             tx[:,:,oks] = np.transpose(
                 np.reshape(coords[:,idxfs[:,okfids].flatten()], (dims, 3, oks.shape[0])),
                 (1,0,2))
-            faces = np.full((3, n), 0, dtype=np.int)
+            faces = np.full((3, n), 0, dtype=int)
             faces[:,oks] = self.tess.faces[:,okfids]
         bc = cartesian_to_barycentric_3D(tx, data) if dims == 3 else \
              cartesian_to_barycentric_2D(tx, data)
@@ -1669,13 +2351,77 @@ class Mesh(VertexSet):
             tx = selfx[:,faces].T
         return barycentric_to_cartesian(tx, coords)
 
+    def image_sampling_matrix(self, image_shape, affine=None, method='linear',
+                              native_to_vertex_matrix=None, weights=None):
+        '''
+        mesh.image_sampling_matrix(image_shape, affine) yields a sparse (n x v) matrix, where n is
+          the number of vertices in the given mesh and v is the number of voxels in an image with
+          the given shape (only the first 3 dimensions of image_shape are used), that samples the
+          voxels of an image at the mesh's vertex coordinates. The columns of the matrix correspond
+          to voxel indices raveled in C-order (i.e., the order of image[...].reshape(v, -1)).
+          Vertices that fall outside of the image have no entries in their row of the matrix.
+
+        The options affine, method, native_to_vertex_matrix, and weights are interpreted as in the
+        mesh.from_image() method, except that method must be either 'linear' or 'nearest' and that
+        weights, if given, must be a 3D array of voxel weights.
+        '''
+        image_shape = tuple(image_shape[0:3])
+        nvox = int(np.prod(image_shape))
+        n = self.vertex_count
+        if native_to_vertex_matrix is None:
+            native_to_vertex_matrix = np.eye(4)
+        native_to_vertex_matrix = to_affine(native_to_vertex_matrix)
+        if affine is None:
+            # wild guess: the inverse of FreeSurfer tkr_vox2ras matrix without alignment to native
+            ijk0 = np.asarray(image_shape) * 0.5
+            affine = to_affine(([[-1,0,0],[0,0,-1],[0,1,0]], ijk0), 3)
+        else: affine = to_affine(affine, 3)
+        affine = np.dot(native_to_vertex_matrix, affine)
+        affine = npla.inv(affine)
+        if pimms.is_str(method): method = method.lower()
+        # okay, these are actually pretty simple; first transform the coordinates
+        xyz = affine.dot(np.vstack((self.coordinates, np.ones(n))))[0:3]
+        shape = np.reshape(image_shape, (3,1))
+        if method == 'nearest':
+            ijk = np.asarray(np.round(xyz), dtype=int)
+            ok = np.where(np.all((ijk >= 0) & (ijk < shape), axis=0))[0]
+            cols = np.ravel_multi_index(tuple(ijk[:,ok]), image_shape)
+            return sps.csr_matrix((np.ones(len(ok)), (ok, cols)), shape=(n, nvox))
+        elif method != 'linear':
+            raise ValueError('image sampling method must be linear or nearest')
+        # find the 8 neighboring voxels
+        mins = np.floor(xyz)
+        maxs = np.ceil(xyz)
+        ok = np.where(np.all((mins >= 0) & (maxs < shape), axis=0))[0]
+        (mins,maxs,xyz) = [x[:,ok] for x in (mins,maxs,xyz)]
+        # the corners (and trilinear weights) of the 8 voxels around each vertex
+        corners = np.array([(a,b,c) for a in (0,1) for b in (0,1) for c in (0,1)]).T
+        voxs = np.where(corners[...,None], maxs[:,None,:], mins[:,None,:]).astype(int)
+        wgts = np.prod(1 - np.abs(xyz[:,None,:] - voxs), axis=0)
+        cols = np.ravel_multi_index(tuple(voxs), image_shape)
+        if weights is not None:
+            weights = np.reshape(weights, -1)
+            if len(weights) != nvox: raise ValueError('weights must be a 3D image')
+            wgts = wgts * weights[cols]
+        # normalize the weights for each vertex; note that duplicate corners (from vertices whose
+        # coordinates are exact voxel centers) are summed together by the sparse matrix
+        wgts *= zinv(np.sum(wgts, axis=0))
+        rows = np.broadcast_to(ok, cols.shape)
+        return sps.csr_matrix((wgts.flatten(), (rows.flatten(), cols.flatten())), shape=(n, nvox))
     def from_image(self, image, affine=None, method=None, fill=0, dtype=None,
-                   native_to_vertex_matrix=None, weights=None):
+                   native_to_vertex_matrix=None, weights=None, chunk_size=64, out=None):
         '''
         mesh.from_image(image) interpolates the given 3D image array at the values in the given 
           mesh's coordinates and yields the property that results. If image is given as a string,
           this function will attempt to load it as an mgh/mgz file or a nifti file.
 
+        If the image has more than 3 dimensions (e.g., a 4D time-series), then the result is an
+        array whose first dimension is the vertices and whose remaining dimensions are the image's
+        remaining dimensions. The interpolation is performed by building a sparse sampling matrix
+        (see mesh.image_sampling_matrix()) once and applying it to the frames of the image in
+        chunks; when the image is a nibabel image, these chunks are read directly from the image's
+        (possibly memory-mapped) dataobj, so the full image never needs to be loaded into memory.
+
         The following options may be used:
           * affine (default: None) may specify the affine transform that aligns the vertex
             coordinates with the image (vertex-to-voxel transform). If None, then uses a
@@ -1685,92 +2431,98 @@ class Mesh(VertexSet):
           * method (default: None) may specify either 'linear' or 'nearest'; if None, then the
             interpolation is linear when the image data is real and nearest otherwise.
           * fill (default: 0) values filled in when a vertex falls outside of the image.
-          * native_to_vertex_matrix (default: None) may optionally give a final transformation that
-            converts from native subject orientation encoded in images to vertex positions.
           * weights (default: None) may optionally provide an image whose voxels are weights to use
             during the interpolation; these weights are in addition to trilinear weights and are
             ignored in the case of nearest interpolation.
           * native_to_vertex_matrix (default: None) specifies a matrix that aligns the surface
             coordinates with their subject's 'native' orientation; None is equivalnet to the
             identity matrix.
+          * chunk_size (default: 64) specifies the number of frames of a 4D image that are read and
+            interpolated at a time.
+          * out (default: None) may specify an array (e.g., a numpy memmap) into which the result
+            is written; it must have the shape of the result. If out is given, it is returned.
         '''
-        if native_to_vertex_matrix is None:
-            native_to_vertex_matrix = np.eye(4)
-        native_to_vertex_matrix = to_affine(native_to_vertex_matrix)
         if pimms.is_str(image): image = load(image)
         if is_image(image):
             # we want to apply the image's affine transform by default
             if affine is None: affine = image.affine
-            image = image.get_data()
-        image = np.asarray(image)
-        if affine is None:
-            # wild guess: the inverse of FreeSurfer tkr_vox2ras matrix without alignment to native
-            from neuropythy.freesurfer import tkr_vox2ras
-            affine = np.dot(np.linalg.inv(native_to_vertex_matrix),
-                            tkr_vox2ras(image.shape[0:3], (1.0, 1.0, 1.0)))
-            ijk0 = np.asarray(image.shape) * 0.5
-            affine = to_affine(([[-1,0,0],[0,0,-1],[0,1,0]], ijk0), 3)
-        else: affine = to_affine(affine, 3)
-        affine = np.dot(native_to_vertex_matrix, affine)
-        affine = npla.inv(affine)
+            image = image.dataobj
+        elif not hasattr(image, 'shape') or not hasattr(image, 'dtype'):
+            image = np.asarray(image)
+        (shape, nvox) = (tuple(image.shape), int(np.prod(image.shape[0:3])))
+        # the dtype of an image's dataobj is its on-disk dtype; the dtype of the data after any
+        # slope/intercept scaling is the dtype of an (empty) slice of it
+        imdtype = image.dtype if isinstance(image, np.ndarray) else \
+                  np.asarray(image[..., :0]).dtype
+        if affine is not None: affine = to_affine(affine, 3)
         if method is not None: method = method.lower()
         if method is None or method in ['auto', 'automatic']:
-            method = 'linear' if np.issubdtype(image.dtype, np.inexact) else 'nearest'
-        if dtype is None: dtype = image.dtype
-        # okay, these are actually pretty simple; first transform the coordinates
-        xyz = affine.dot(np.vstack((self.coordinates, np.ones(self.vertex_count))))[0:3]
+            method = 'linear' if np.issubdtype(imdtype, np.inexact) else 'nearest'
+        if dtype is None: dtype = imdtype
         # remember: this might be a 4d or higher-dim image...
-        res = np.full((self.vertex_count,) + image.shape[3:], fill, dtype=dtype)
-        # now find the nearest voxel centers...
-        # if we are doing nearest neighbor; we're basically done already:
-        if method == 'nearest':
-            ijk = np.asarray(np.round(xyz), dtype=np.int)
-            ok = np.all((ijk >= 0) & [ii < sh for (ii,sh) in zip(ijk, image.shape)], axis=0)
-            res[ok] = image[tuple(ijk[:,ok])]
-            return res
-        # otherwise, we do linear interpolation; start by parsing the weights if given
-        if weights is None: weights = np.ones(image.shape)
-        elif pimms.is_str(weights): weights = load(weights).get_data()
-        elif is_image(weights): weights = weights.get_data()
-        else: weights = np.asarray(weights)
-        # find the 8 neighboring voxels
-        mins = np.floor(xyz)
-        maxs = np.ceil(xyz)
-        ok = np.all((mins >= 0) & [ii < sh for (ii,sh) in zip(maxs, image.shape[0:3])], axis=0)
-        (mins,maxs,xyz) = [x[:,ok] for x in (mins,maxs,xyz)]
-        voxs = np.asarray([mins,
-                           [mins[0], mins[1], maxs[2]],
-                           [mins[0], maxs[1], mins[2]],
-                           [mins[0], maxs[1], maxs[2]],
-                           [maxs[0], mins[1], mins[2]],
-                           [maxs[0], mins[1], maxs[2]],                           
-                           [maxs[0], maxs[1], mins[2]],
-                           maxs],
-                          dtype=np.int)
-        # trilinear weights
-        wgts_tri = np.asarray([np.prod(1 - np.abs(xyz - row), axis=0) for row in voxs])
-        # weight-image weights
-        wgts_wgt = np.asarray([weights[tuple(row)] for row in voxs])
-        # note that there might be a 4D image here
-        if len(wgts_wgt.shape) > len(wgts_tri.shape):
-            for _ in range(len(wgts_wgt.shape) - len(wgts_tri.shape)):
-                wgts_tri = np.expand_dims(wgts_tri, -1)
-        wgts = wgts_tri * wgts_wgt
-        wgts *= zinv(np.sum(wgts, axis=0))
-        vals = np.asarray([image[tuple(row)] for row in voxs])
-        res[ok] = np.sum(wgts * vals, axis=0)
+        fshape = shape[3:]
+        nframes = int(np.prod(fshape))
+        if out is None: res = np.full((self.vertex_count,) + fshape, fill, dtype=dtype)
+        elif out.shape != (self.vertex_count,) + fshape:
+            raise ValueError('out array must have shape %s' % ((self.vertex_count,) + fshape,))
+        else:
+            res = out
+            res[...] = fill
+        resmtx = np.reshape(res, (self.vertex_count, nframes))
+        # if out can't be reshaped without a copy (e.g., it is Fortran-ordered), we must write into
+        # it one frame at a time instead
+        if not np.may_share_memory(resmtx, res): resmtx = None
+        # parse the weights if given; weights that vary by frame must be applied frame by frame
+        if method == 'nearest' or weights is None: weights = None
+        else:
+            if pimms.is_str(weights): weights = load(weights)
+            if is_image(weights): weights = weights.dataobj
+            weights = np.reshape(np.asarray(weights), (nvox, -1))
+            if weights.shape[1] == 1: weights = weights[:,0]
+            elif weights.shape[1] != nframes: raise ValueError('weights and image shapes differ')
+        def _sampling_matrix(w):
+            return self.image_sampling_matrix(shape, affine=affine, method=method, weights=w,
+                                              native_to_vertex_matrix=native_to_vertex_matrix)
+        # build the sampling matrix once, restricted to the vertices inside the image
+        mtx = _sampling_matrix(None if weights is None or len(weights.shape) > 1 else weights)
+        ok = np.where(np.diff(mtx.indptr) > 0)[0]
+        mtx = mtx[ok]
+        if len(fshape) > 1:
+            # we can only stream along the final axis, so we just load everything in this case
+            image = np.reshape(np.asarray(image), shape[:3] + (nframes,))
+        # now step through the frames in chunks
+        chunk_size = max(1, int(chunk_size))
+        for f0 in range(0, nframes, chunk_size):
+            f1 = min(f0 + chunk_size, nframes)
+            if len(fshape) == 0: dat = np.asarray(image)
+            else:                dat = np.asarray(image[..., f0:f1])
+            dat = np.reshape(dat, (nvox, f1 - f0))
+            if method == 'nearest':
+                vals = dat[mtx.indices]
+            elif weights is None or len(weights.shape) == 1:
+                vals = mtx.dot(dat)
+            else:
+                vals = np.transpose([_sampling_matrix(weights[:,ii])[ok].dot(dat[:,ii - f0])
+                                     for ii in range(f0, f1)])
+            if resmtx is not None: resmtx[ok, f0:f1] = vals
+            else:
+                for ii in range(f0, f1): res[(ok,) + np.unravel_index(ii, fshape)] = vals[:,ii-f0]
         return res
     
     # smooth a field on the cortical surface
     def smooth(self, prop, smoothness=0.5, weights=None, weight_min=None, weight_transform=None,
                outliers=None, data_range=None, mask=None, valid_range=None, null=np.nan,
-               match_distribution=None, transform=None):
+               match_distribution=None, transform=None, solver='direct'):
         '''
         mesh.smooth(prop) yields a numpy array of the values in the mesh property prop after they
           have been smoothed on the cortical surface. Smoothing is done by minimizing the square
           difference between the values in prop and the smoothed values simultaneously with the
           difference between values connected by edges. The prop argument may be either a property
-          name or a list of property values.
+          name or a list of property values. Additionally, prop may be an (n x k) matrix whose rows
+          correspond to the n vertices of the mesh, in which case each of its k columns is smoothed
+          and an (n x k) matrix is returned; columns that share the same mask, outliers, and
+          weights share a single linear system, so smoothing many columns at once is much faster
+          than smoothing them one at a time.
         
         The following options are accepted:
           * weights (default: None) specifies the weight on each individual vertex that is in the
@@ -1804,24 +2556,74 @@ class Mesh(VertexSet):
           * null (default: numpy.nan) specifies what value should be placed in elements of the
             property that are not in the mask or that were NaN to begin with. By default, this is
             NaN, but 0 is often desirable.
+          * solver (default: 'direct') specifies how the smoothing problem, which is a sparse linear
+            least-squares problem, is solved. The 'direct' solver factorizes the system once (using
+            scipy.sparse.linalg.splu) and yields the exact minimum; the 'cg' solver uses the
+            (Jacobi-preconditioned) conjugate gradient method, which requires less memory for very
+            large meshes; the 'lbfgs' solver minimizes the objective using scipy.optimize.minimize
+            with the L-BFGS-B method, as older versions of neuropythy did.
         '''
-        # Do some argument processing ##############################################################
         n = self.tess.vertex_count
-        all_vertices = np.asarray(range(n), dtype=np.int)
+        if pimms.is_str(solver): solver = solver.lower()
+        if solver not in ('direct', 'cg', 'lbfgs'):
+            raise ValueError('unrecognized smoothing solver: %s' % (solver,))
+        if not pimms.is_str(prop) and pimms.is_matrix(prop) and np.shape(prop)[0] == n:
+            props = np.asarray(prop).T
+            is_vec = False
+        else:
+            props = [prop]
+            is_vec = True
+        # Parse each column and group the columns that share the same system ######################
+        opts = dict(outliers=outliers, data_range=data_range, mask=mask, valid_range=valid_range,
+                    weights=weights, weight_min=weight_min, weight_transform=weight_transform,
+                    transform=transform)
+        (systems, keys) = ({}, [])
+        for (col,p) in enumerate(props):
+            (msk, tth, wts, x0) = self._smoothing_setup(p, opts)
+            k = array_digest(msk, tth, wts)
+            if k not in systems:
+                systems[k] = (msk, tth, wts, [], [])
+                keys.append(k)
+            systems[k][3].append(col)
+            systems[k][4].append(x0)
+        # Solve each system ########################################################################
+        result = np.full((n, len(props)), null, dtype=float)
+        for (msk, tth, wts, cols, x0s) in (systems[k] for k in keys):
+            x0s = np.transpose(x0s)
+            sm_props = self._smoothing_solve(msk, tth, wts, x0s, smoothness, solver)
+            for (ii,col) in enumerate(cols):
+                (x0, sm_prop) = (x0s[:,ii], sm_props[:,ii])
+                # Apply output re-distributing if requested
+                if match_distribution is not None:
+                    percentiles = 100.0 * np.argsort(np.argsort(sm_prop)) / (float(len(msk)) - 1.0)
+                    if match_distribution is True:
+                        sm_prop = np.percentile(x0[tth], percentiles)
+                    elif hasattr(match_distribution, '__iter__'):
+                        sm_prop = np.percentile(match_distribution, percentiles)
+                    elif hasattr(match_distribution, '__call__'):
+                        sm_prop = [match_distribution(q) for q in percentiles / 100.0]
+                    else:
+                        raise ValueError('Invalid match_distribution argument')
+                result[msk, col] = sm_prop
+        return result[:,0] if is_vec else result
+    def _smoothing_setup(self, prop, opts):
+        '''
+        mesh._smoothing_setup(prop, opts) is used by mesh.smooth() to parse the given property and
+          options; yields (mask, tethered, weights, x0) where mask is the vertices included in the
+          smoothing, tethered is the indices into mask of the non-outlier vertices, weights is the
+          weights of the tethered vertices, and x0 is the starting values of the masked vertices.
+        '''
+        n = self.tess.vertex_count
+        all_vertices = np.arange(n)
+        mask = opts['mask']
+        outliers = opts['outliers']
         # Parse the property data and the weights...
-        (prop,weights) = self.property(prop, outliers=outliers, data_range=data_range,
-                                       mask=mask, valid_range=valid_range,
-                                       weights=weights, weight_min=weight_min,
-                                       weight_transform=weight_transform, transform=transform,
-                                       yield_weight=True)
+        (prop,weights) = self.property(prop, yield_weight=True, **opts)
         prop = np.array(prop)
         if not pimms.is_vector(prop, np.number):
             raise ValueError('non-numerical properties cannot be smoothed')
         # First, find the mask; these are values that can be included theoretically
-        where_inf = np.where(np.isinf(prop))[0]
         where_nan = np.where(np.isnan(prop))[0]
-        where_bad = np.union1d(where_inf, where_nan)
-        where_ok  = np.setdiff1d(all_vertices, where_bad)
         # Whittle down the mask to what we are sure is in the minimization:
         mask = reduce(np.setdiff1d,
                       [all_vertices if mask is None else all_vertices[mask],
@@ -1832,55 +2634,205 @@ class Mesh(VertexSet):
         # no matter what, trim out the infinite values (even if inf was in the data range)
         outliers = np.union1d(outliers, mask[np.where(np.isinf(prop[mask]))[0]])
         outliers = np.union1d(outliers, mask[np.where(np.isclose(weights[mask], 0))[0]])
-        outliers = np.asarray(outliers, dtype=np.int)
-        # here are the vertex sets we will use below
+        outliers = np.asarray(outliers, dtype=int)
+        mask = np.asarray(mask, dtype=int)
         tethered = np.setdiff1d(mask, outliers)
-        tethered = np.asarray(tethered, dtype=np.int)
-        mask = np.asarray(mask, dtype=np.int)
-        maskset  = frozenset(mask)
-        # Do the minimization ######################################################################
-        # start by looking at the edges
-        el0 = self.tess.indexed_edges
         # give all the outliers mean values
         prop[outliers] = np.mean(prop[tethered])
-        # x0 are the values we care about; also the starting values in the minimization
-        x0 = np.array(prop[mask])
-        # since we are just looking at the mask, look up indices that we need in it
-        mask_idx = {v:i for (i,v) in enumerate(mask)}
-        mask_tethered = np.asarray([mask_idx[u] for u in tethered])
-        el = np.asarray([(mask_idx[a], mask_idx[b]) for (a,b) in el0.T
-                         if a in maskset and b in maskset])
-        # These are the weights and objective function/gradient in the minimization
+        return (mask, np.searchsorted(mask, tethered), weights[tethered], prop[mask])
+    def _smoothing_solve(self, mask, tethered, weights, x0, smoothness, solver):
+        '''
+        mesh._smoothing_solve(mask, tethered, weights, x0, smoothness, solver) is used by
+          mesh.smooth() to solve the smoothing problem for the (m x k) matrix of starting values x0,
+          whose rows correspond to the m masked vertices. See mesh.smooth() for more information.
+
+        The smoothing objective for each column x of x0 is the sum of the tether term,
+          ks * sum(weights * (x0[tethered] - x[tethered])**2), and the smoothness term,
+          ke * sum((x[u] - x[v])**2) over all edges (u,v) in the mask; its minimum is the solution
+          to the sparse symmetric linear system (ke*L + ks*W) x = ks*W x0 where L is the graph
+          Laplacian of the masked edges and W is the diagonal matrix of the tether weights.
+        '''
+        (m, k) = x0.shape
         (ks, ke) = (smoothness, 1.0 - smoothness)
-        (zs, ix) = (np.ones(len(el)), np.arange(len(el)))
-        e2v = sps.csr_matrix((np.concatenate([zs,-zs]), (el.T.flatten(),np.concatenate([ix, ix]))),
-                             shape=(len(x0), len(el)), dtype=np.int)
-        (us, vs) = el.T
-        weights_tth = weights[tethered]
-        # build the optimization
-        def _f(x):
-            rs = np.dot(weights_tth, (x0[mask_tethered] - x[mask_tethered])**2)
-            re = np.sum((x[us] - x[vs])**2)
-            return ks*rs + ke*re
-        def _f_jac(x):
-            df = 2*ke*e2v.dot(x[us] - x[vs])
-            df[mask_tethered] += 2*ks*weights_tth*(x[mask_tethered] - x0[mask_tethered])
-            return df
-        sm_prop = spopt.minimize(_f, x0, jac=_f_jac, method='L-BFGS-B').x
-        # Apply output re-distributing if requested ################################################
-        if match_distribution is not None:
-            percentiles = 100.0 * np.argsort(np.argsort(sm_prop)) / (float(len(mask)) - 1.0)
-            if match_distribution is True:
-                sm_prop = np.percentile(x0[mask_tethered], percentiles)
-            elif hasattr(match_distribution, '__iter__'):
-                sm_prop = np.percentile(match_distribution, percentiles)
-            elif hasattr(match_distribution, '__call__'):
-                sm_prop = map(match_distribution, percentiles / 100.0)
-            else:
-                raise ValueError('Invalid match_distribution argument')
-        result = np.full(len(prop), null, dtype=np.float)
-        result[mask] = sm_prop
-        return result
+        # find the edges that are entirely inside the mask, reindexed into the mask
+        mask_idx = np.full(self.tess.vertex_count, -1, dtype=int)
+        mask_idx[mask] = np.arange(m)
+        el = mask_idx[self.tess.indexed_edges]
+        (us, vs) = el[:, np.all(el >= 0, axis=0)]
+        if solver == 'lbfgs':
+            e2v = sps.csr_matrix((np.concatenate([np.ones(len(us)), -np.ones(len(us))]),
+                                  (np.concatenate([us, vs]), np.tile(np.arange(len(us)), 2))),
+                                 shape=(m, len(us)))
+            def _f(x, x0):
+                rs = np.dot(weights, (x0[tethered] - x[tethered])**2)
+                re = np.sum((x[us] - x[vs])**2)
+                return ks*rs + ke*re
+            def _f_jac(x, x0):
+                df = 2*ke*e2v.dot(x[us] - x[vs])
+                df[tethered] += 2*ks*weights*(x[tethered] - x0[tethered])
+                return df
+            return np.transpose([spopt.minimize(_f, x0[:,ii], args=(x0[:,ii],), jac=_f_jac,
+                                                method='L-BFGS-B').x
+                                 for ii in range(k)])
+        # With no smoothness weight (smoothness=1), the edges contribute nothing to the system
+        if ke == 0: (us, vs) = (us[:0], vs[:0])
+        # Any connected component of the mask that has no tethered vertices with a positive tether
+        # weight has a singular system; its minimum is the component's mean (which is each vertex's
+        # initial value for isolated vertices), so we solve for it directly and drop its edges
+        (ncomps, comps) = sps.csgraph.connected_components(
+            sps.coo_matrix((np.ones(len(us)), (us, vs)), shape=(m, m)), directed=False)
+        tethered_comps = np.zeros(ncomps, dtype=bool)
+        tethered_comps[comps[tethered[ks*weights > 0]]] = True
+        free = ~tethered_comps[comps]
+        res = np.zeros((m, k))
+        if free.any():
+            cnts = np.bincount(comps[free], minlength=ncomps)
+            for ii in range(k):
+                means = np.bincount(comps[free], weights=x0[free,ii], minlength=ncomps)
+                res[free,ii] = means[comps[free]] / cnts[comps[free]]
+        keep = ~(free[us] | free[vs])
+        (us, vs) = (us[keep], vs[keep])
+        # Assemble the linear system
+        diag = ke*(np.bincount(us, minlength=m) + np.bincount(vs, minlength=m)).astype(float)
+        diag[tethered] += ks*weights
+        diag[free] = 1
+        a = sps.coo_matrix((np.concatenate([diag, np.full(2*len(us), -ke)]),
+                            (np.concatenate([np.arange(m), us, vs]),
+                             np.concatenate([np.arange(m), vs, us]))),
+                           shape=(m, m)).tocsc()
+        b = np.zeros((m, k))
+        b[tethered] = (ks * weights)[:,None] * x0[tethered]
+        b[free] = res[free]
+        if solver == 'direct':
+            return np.reshape(spsla.splu(a).solve(b), (m, k))
+        # Otherwise, we use conjugate gradient with a Jacobi preconditioner
+        precond = sps.diags(1.0 / diag)
+        for ii in range(k):
+            (res[:,ii], info) = spsla.cg(a, b[:,ii], x0=x0[:,ii], M=precond)
+            if info > 0: warnings.warn('conjugate gradient smoothing failed to converge')
+        return res
+    def geodesic_distances(self, sources, method='dijkstra', limit=np.inf):
+        '''
+        mesh.geodesic_distances(sources) yields a vector of the distance from each vertex in the
+          given mesh to the nearest of the given sources, as measured along the surface of the mesh.
+          Vertices that cannot be reached from any source have infinite distances.
+
+        The sources may be given as any of the following:
+          * a vector of vertex labels (all of which are at distance 0);
+          * a boolean vector with one value per vertex, True for vertices that are sources;
+          * an address (see mesh.address()) of one or more points on the surface; in this case the
+            initial distances of each vertex in the faces containing the points is its Euclidean
+            distance to the points.
+
+        The following options are accepted:
+          * method (default: 'dijkstra') specifies how the distances are calculated. The 'dijkstra'
+            method finds the minimum-length path over the mesh edges from the sources to each
+            vertex (using scipy.sparse.csgraph.dijkstra); these distances are upper bounds on the
+            true geodesic distances. The 'heat' method uses the heat method of Crane et al. (2013)
+            to approximate the true geodesic distances across the faces of the mesh; this requires
+            the solution of two sparse linear systems.
+          * limit (default: inf) specifies that distances greater than the given limit need not be
+            calculated and should be given as inf; this is ignored for the 'heat' method.
+        '''
+        n = self.vertex_count
+        # parse the sources into (vertex indices, initial distances)
+        if is_address(sources):
+            (faces, bcs) = address_data(sources, 2, strict=False)
+            ok = np.all(np.isfinite(bcs), axis=0)
+            (faces, bcs) = (self.tess.index(faces[:,ok]), bcs[:,ok])
+            bcs = np.vstack([bcs, [1 - np.sum(bcs, axis=0)]])
+            fx = self.coordinates[:,faces]
+            pts = np.sum(fx * bcs, axis=1)
+            (seeds, d0) = (faces.flatten(), np.sqrt(np.sum((fx - pts[:,None])**2, axis=0)).flatten())
+        else:
+            sources = np.asarray(sources)
+            if sources.dtype == np.bool_ and len(sources) == n: seeds = np.where(sources)[0]
+            else: seeds = self.tess.index(np.reshape(sources, -1))
+            seeds = np.asarray(seeds, dtype=int)
+            d0 = np.zeros(len(seeds))
+        if len(seeds) == 0: raise ValueError('No sources given to geodesic_distances')
+        if pimms.is_str(method): method = method.lower()
+        if method == 'heat': return self._heat_geodesic_distances(seeds, d0)
+        elif method != 'dijkstra': raise ValueError('unrecognized geodesic method: %s' % (method,))
+        # a source may appear more than once; only its smallest initial distance matters
+        ii = np.lexsort((d0, seeds))
+        (seeds, d0) = (seeds[ii], d0[ii])
+        ii = np.unique(seeds, return_index=True)[1]
+        (seeds, d0) = (seeds[ii], d0[ii])
+        # we add a vertex (n) with an edge to each source whose length is its initial distance
+        (u,v) = self.tess.indexed_edges
+        elens = self.edge_lengths
+        g = sps.csr_matrix((np.concatenate([elens, elens, d0]),
+                            (np.concatenate([u, v, np.full(len(seeds), n)]),
+                             np.concatenate([v, u, seeds]))),
+                           shape=(n + 1, n + 1))
+        d = sps.csgraph.dijkstra(g, directed=True, indices=n, limit=limit)
+        return d[:n]
+    def _heat_geodesic_distances(self, seeds, d0):
+        '''
+        mesh._heat_geodesic_distances(seeds, d0) is used by mesh.geodesic_distances() to calculate
+          distances using the heat method. The initial distances d0 of the seeds are used only to
+          weight the heat sources.
+        '''
+        n = self.vertex_count
+        fs = self.tess.indexed_faces
+        # we work in units of the mean edge length, so that the zinv() tolerances are meaningful
+        h = np.mean(self.edge_lengths)
+        fx = self.face_coordinates / h
+        # the cotangent of each face's angle at each corner (opposite the edge between the others)
+        cots = []
+        for k in range(3):
+            a = fx[(k+1) % 3] - fx[k]
+            b = fx[(k+2) % 3] - fx[k]
+            ab = np.sum(a*b, axis=0)
+            cots.append(ab * zinv(np.sqrt(np.sum(a**2, axis=0)*np.sum(b**2, axis=0) - ab**2)))
+        cots = np.asarray(cots)
+        # the (positive semi-definite) cotangent Laplacian and the lumped mass matrix
+        (ii, jj) = (np.concatenate([fs[1], fs[2], fs[0]]), np.concatenate([fs[2], fs[0], fs[1]]))
+        ww = 0.5 * np.concatenate(cots)
+        lap = sps.csr_matrix((np.concatenate([-ww, -ww]),
+                              (np.concatenate([ii, jj]), np.concatenate([jj, ii]))),
+                             shape=(n, n))
+        lap = lap - sps.diags(flattest(lap.sum(axis=1)))
+        mass = np.bincount(fs.flatten(), weights=np.tile(self.face_areas, 3), minlength=n)
+        mass /= 3.0 * h**2
+        # step 1: diffuse heat from the sources for a time equal to the squared edge length
+        t = 1.0
+        delta = mass * np.bincount(seeds, weights=np.exp(-d0 / h), minlength=n)
+        heat_op = (sps.diags(mass) + t*lap).tocsc()
+        heat = spsla.spsolve(heat_op, delta)
+        # on meshes with a boundary, we average the heat under the (implicit) Neumann boundary
+        # condition with that under a Dirichlet condition (zero heat on the boundary, except at the
+        # sources), as suggested by Crane et al.; otherwise the distances are distorted near it
+        bverts = np.unique(self.tess.indexed_edges[:, self.tess.edge_faces.counts == 1])
+        bverts = np.setdiff1d(bverts, seeds)
+        if len(bverts) > 0:
+            ii = np.setdiff1d(np.arange(n), bverts)
+            hd = np.zeros(n)
+            hd[ii] = spsla.spsolve(heat_op[ii][:,ii].tocsc(), delta[ii])
+            heat = 0.5*(heat + hd)
+        # step 2: the normalized negative gradient of the heat in each face
+        e1 = fx[1] - fx[0]
+        e2 = fx[2] - fx[0]
+        (g11, g12, g22) = (np.sum(e1*e1, axis=0), np.sum(e1*e2, axis=0), np.sum(e2*e2, axis=0))
+        det = zinv(g11*g22 - g12**2)
+        (h1, h2) = (heat[fs[1]] - heat[fs[0]], heat[fs[2]] - heat[fs[0]])
+        grad = e1*(det*(g22*h1 - g12*h2)) + e2*(det*(g11*h2 - g12*h1))
+        # (heat decays exponentially, so we can't use zinv's tolerance to normalize here)
+        gnorm = np.sqrt(np.sum(grad**2, axis=0))
+        grad = -grad / (gnorm + (gnorm == 0))
+        # step 3: the integrated divergence of this field at each vertex
+        div = np.zeros(n)
+        for k in range(3):
+            (k1, k2) = ((k+1) % 3, (k+2) % 3)
+            e_1 = fx[k1] - fx[k]
+            e_2 = fx[k2] - fx[k]
+            dv = cots[k2]*np.sum(e_1*grad, axis=0) + cots[k1]*np.sum(e_2*grad, axis=0)
+            div += 0.5 * np.bincount(fs[k], weights=dv, minlength=n)
+        # step 4: find the distance function whose gradient best matches the field
+        eps = 1e-10 * np.mean(mass)
+        d = spsla.spsolve((lap + eps*sps.eye(n)).tocsc(), -div)
+        return h * (d - np.min(d[seeds]))
 def is_mesh(m):
     '''
     is_mesh(m) yields True if m is a Mesh object and False otherwise.
@@ -2871,7 +3823,7 @@ class Topology(VertexSet):
         return self.copy(_registrations=self.registrations.set(name, coords))
     def interpolate(self, topo, data,
                     registration=None, mask=None, weights=None,
-                    method='automatic', n_jobs=1):
+                    method='automatic', n_jobs=1, cache_path=Ellipsis):
         '''
         topology.interpolate(topo, data) yields a numpy array of the data interpolated from the
           given array, data, which must contain the same number of elements as there are vertices
@@ -2898,6 +3850,8 @@ class Topology(VertexSet):
             fsaverage, followed by the fs_LR.
           * n_jobs (default: 1) is passed along to the cKDTree.query method, so may be set to an
             integer to specify how many processors to use, or may be -1 to specify all processors.
+          * cache_path (default: Ellipsis) specifies a directory in which interpolation matrices
+            are cached; see Mesh.interpolation_matrix().
         '''
         if is_address(topo):
             # we can use any surface since it's a mesh
@@ -2907,7 +3861,7 @@ class Topology(VertexSet):
             except Exception: mesh = None
             if mesh is None: raise ValueError('could not find mesh!')
             return mesh.interpolate(topo, data, mask=mask, weights=weights,
-                                    method=method, n_jobs=n_jobs)
+                                    method=method, n_jobs=n_jobs, cache_path=cache_path)
         elif not isinstance(topo, Topology):
             raise ValueError('Topologies can only be interpolated at a topology or an address')
         if registration is None:
@@ -2928,7 +3882,7 @@ class Topology(VertexSet):
             if True:
                 res = self.registrations[reg_name].interpolate(
                     topo.registrations[reg_name], data,
-                    mask=mask, method=method, n_jobs=n_jobs);
+                    mask=mask, method=method, n_jobs=n_jobs, cache_path=cache_path)
                 break
             #except Exception as e: errs.append(e)
         if res is None:
@@ -3223,13 +4177,13 @@ class Path(ObjectWithMetaData):
         mm  = sps.csr_matrix((np.ones(m), (q, np.arange(m))), shape=(n, m))
         lbl = zdivide(mm.dot(wq), flattest(mm.sum(axis=1)))
         # we crawl across vertices by edges until we find all of them
-        nei  = np.asarray(tess.indexed_neighborhoods)
+        nei  = tess.indexed_neighborhoods
         unk  = np.full(tess.vertex_count, True, dtype=np.bool)
         unk[q] = False
         q = np.unique(u[~np.isin(u, v)])
         while len(q) > 0:
             # get all their neighbors
-            q = np.unique([k for neitup in nei[q] for k in neitup]).astype(np.int64) 
+            q = np.unique(nei.elements(q)).astype(np.int64)
             q = q[unk[q]] # only not visited neighbors
             lbl[q] = 1.0 # they are inside the region now
             unk[q] = False # now we've visited them
@@ -3650,49 +4604,12 @@ class Path(ObjectWithMetaData):
         '''
         Path.estimate_distances(addresses, mesh) estimates all the distances between the vertices in
           the mesh and the path implied by the given set of addresses using a minimum-graph-distance
-          algorithm over the mesh edges.
+          algorithm over the mesh edges (see Mesh.geodesic_distances).
         '''
         # we're going to estimate an unsigned distance for every vertex, one can add the sign in for
         # a closed path using the contained_faces or similar if desired
-        d = np.full(mesh.vertex_count, np.inf) # initial distances
-        # for starters, we need to get distances from all the addresses
-        (faces, coords) = address_data(addresses, 2)
-        coords = np.vstack([coords, [1 - np.sum(coords, axis=0)]])
-        faces  = mesh.tess.index(faces)
-        # each face implies a minimum distance to each of its vertices
-        for (f,x) in zip(faces.T, coords.T):
-            fx = mesh.coordinates[:,f]
-            pt = np.sum(fx * x, axis=1)
-            # distances between...
-            dd = np.sqrt(np.sum((fx.T - pt)**2, axis=1))
-            ii = (d[f] > dd)
-            d[f[ii]] = dd[ii]
-        # okay, starting distances obtained; now let's do a search!
-        ii0 = np.where(np.isfinite(d))[0]
-        if len(ii0) == 0: raise ValueError('No distances obtained from addresses!')
-        # we iterate until we cannot decrease the path-length of anything
-        (max_iter,it) = (mesh.vertex_count + 1, 0)
-        (u,v) = np.hstack([mesh.tess.indexed_edges, np.flipud(mesh.tess.indexed_edges)])
-        elens = np.concatenate([mesh.edge_lengths, mesh.edge_lengths])
-        updated = ii0
-        while len(updated) > 0:
-            if it > max_iter: raise ValueError('Max iterations exceeded in min-distance search loop')
-            else: it += 1
-            # what edges might be affected by this update
-            ii = np.where(np.isin(u, updated))[0]
-            (uu,vv) = (u[ii],v[ii])
-            dnew = d[uu] + elens[ii]
-            # we want to compare into vv, but vv will have repeats, so we must min across these;
-            # easy way to do this is to put them all in a sparse matrix and min/argmin across
-            (vv,ridx) = np.unique(vv, return_inverse=True)
-            # we want to take the smallest value that is greater than 0, so we have to use a trick
-            mx = np.max(dnew) + 1.0
-            mtx = sps.csr_matrix((mx - dnew, (ridx, np.arange(len(dnew)))))
-            dnew = mx - flattest(mtx.max(axis=1))
-            # okay, find out where this distance is less than the previous dist
-            jj = np.where(d[vv] > dnew)[0]
-            updated = vv[jj]
-            d[updated] = dnew[jj]
+        d = mesh.geodesic_distances(addresses)
+        if not np.isfinite(d).any(): raise ValueError('No distances obtained from addresses!')
         return d
     @pimms.value
     def estimated_distances(addresses, surface):
@@ -3944,6 +4861,12 @@ def isolines(obj, prop, val,
     isolines(cortex, prop, val) yields the lines as addresses instead of coordinates.
     isolines(subject, prop, val) yields a lazy map whose keys are the keys of subject.hemis
       and whose values are equivalent to isolines(subject.hemis[key], prop, val).
+    isolines(obj, prop, vals) yields a list, each element of which is equivalent to
+      isolines(obj, prop, val) for the corresponding val in the vector vals; the isolines for all
+      values are calculated together, which is much faster than calculating them one at a time.
+
+    The lines for each value are sorted from shortest to longest; closed loops are included, with
+    their first point repeated at their end.
     
     The following optional arguments may be given:
       * yield_addresses (default: False) may be set to True to instruct isolines to return the
@@ -3961,7 +4884,6 @@ def isolines(obj, prop, val,
     '''
     import scipy.sparse as sps
     from neuropythy import (is_subject, is_list, is_tuple, is_topo, is_mesh, is_tess)
-    from neuropythy.util import flattest
     if is_subject(obj):
         kw = dict(outliers=outliers,     data_range=data_range,
                   clipped=clipped,       weights=weights,
@@ -3969,14 +4891,18 @@ def isolines(obj, prop, val,
                   mask=mask,             valid_range=valid_range,
                   transform=transform,   smooth=smooth,
                   yield_addresses=yield_addresses)
-        return pimms.lazy_map({h:curry(lambda h: isolines(mesh.hemis[h],prop,val,**kw),h)
-                               for h in six.iterkeys(mesh.hemis)})
+        return pimms.lazy_map({h:curry(lambda h: isolines(obj.hemis[h],prop,val,**kw),h)
+                               for h in six.iterkeys(obj.hemis)})
     elif not (is_topo(obj) or is_mesh(obj)):
         raise ValueError('argument must be a mesh, topology, or subject')
     if   smooth is True:          smooth = ()
     elif smooth in [False,None]:  smooth = None
     elif pimms.is_vector(smooth): smooth = tuple(smooth)
     else: raise ValueError('unrecognized smooth argument')
+    vals = np.asarray(val, dtype=float)
+    if len(vals.shape) > 1: raise ValueError('isolines values must be a number or a vector')
+    is_vec = (len(vals.shape) == 1)
+    vals = np.reshape(vals, -1)
     # find the addresses over the faces:
     fs = obj.tess.indexed_faces if not is_tess(obj) else obj.indexed_faces
     N  = obj.vertex_count
@@ -3987,86 +4913,85 @@ def isolines(obj, prop, val,
                       mask=mask,             valid_range=valid_range,
                       transform=transform)
     ii  = np.isfinite(p)
-    fii = np.where(np.sum([ii[f] for f in fs], axis=0) == 3)[0]
-    fs  = fs[:,fii]
-    fp  = np.asarray([p[f] for f in fs])
-    lt  = (fp <= val)
-    slt = np.sum(lt, 0)
-    (ii1,ii2) = [(slt == k) for k in (1,2)]
-    wmtx = sps.lil_matrix((N, N), dtype='float')
-    emtx = sps.dok_matrix((N*N, N*N), dtype='bool')
-    for (ii,fl) in zip([ii1,ii2], [True,False]):
-        tmp = np.array(lt.T)
-        tmp[~ii,:] = False
-        if fl:
-            w = fs.T[tmp]
-            tmp[ii] = ~tmp[ii]
-            (u,v) = np.reshape(fs.T[tmp], (-1,2)).T
-        else:
-            (u,v) = np.reshape(fs.T[tmp], (-1,2)).T
-            tmp[ii] = ~tmp[ii]
-            w = fs.T[tmp]
-        (pu,pv,pw) = [p[q] for q in (u,v,w)]
-        # the line is from somewhere on (u,w) to somewhere on (v,w)
-        (wu, wv) = [(val - pw) / (px - pw) for px in (pu,pv)]
-        # put these in the weight matrix
-        wmtx[u,w] = wu
-        wmtx[v,w] = wv
-        wmtx[w,u] = (1 - wu)
-        wmtx[w,v] = (1 - wv)
-        # and in the edge matrix
-        e1 = np.sort([u,w],axis=0).T.dot([N,1])
-        e2 = np.sort([v,w],axis=0).T.dot([N,1])
-        emtx[e1, e2] = True
-        emtx[e2, e1] = True
-    # okay, now convert these into sequential lines...
-    wmtx = wmtx.tocsr()
-    (rs,cs,xs) = sps.find(emtx)
-    # we need to compress emtx
-    ((rs,ridx),(cs,cidx)) = [np.unique(x, return_inverse=True) for x in (rs,cs)]
-    assert(len(ridx) == len(cidx) and len(cidx) == len(xs) and np.array_equal(rs,cs))
-    em = sps.csr_matrix((xs, (ridx,cidx)), dtype='bool')
-    ecounts = flattest(em.sum(axis=1))
-    ccs = sps.csgraph.connected_components(em, directed=False)[1]
-    lines = {}
-    loops = {}
-    for (lbl,st) in zip(*np.unique(ccs, return_index=True)):
-        if lbl < 0: continue
-        o0 = sps.csgraph.depth_first_order(em, st, directed=False)[0]
-        o = rs[o0]
-        (u,v) = (np.floor(o/N).astype('int'), np.mod(o, N).astype('int'))
-        w = flattest(wmtx[u,v])
-        if ecounts[o0[-1]] == 2:
-            loops[lbl] = (u,v,w)
-        else:
-            if ecounts[st] != 1:
-                o0 = sps.csgraph.depth_first_order(em, o0[-1], directed=False)[0]
-                o = rs[o0]
-                (u,v) = (np.floor(o/N).astype('int'), np.mod(o, N).astype('int'))
-                w = flattest(wmtx[u,v])
-            lines[lbl] = (u,v,w)
-    # okay, we add all of these to the addrs that we return; it's potentially
-    # more useful to have each face's full crossing in its own BC coordinates
-    # at times, and the duplicates can be eliminated with just a slice
-    addrs = []
-    for (lbl,(us,vs,ws)) in six.iteritems(lines):
-        (u0s,v0s,u1s,v1s) = (us[:-1],vs[:-1],us[1:],vs[1:])
-        qs = [np.setdiff1d([u1,v1], [u0,v0])[0] for (u0,v0,u1,v1) in zip(u0s,v0s,u1s,v1s)]
-        fs = np.asarray([u0s, qs, v0s], dtype=np.int)
-        fend = (u1s[-1], np.setdiff1d(fs[:,-1], (u1s[-1],v1s[-1])), v1s[-1])
-        fs = np.hstack([fs, np.reshape(fend, (3,1))])
-        # convert faces back to labels
-        fs = np.asarray([obj.labels[f] for f in fs])
-        # make the weights
-        ws = np.asarray([ws, 0*ws])
-        addrs.append({'faces': fs, 'coordinates': ws})
-    addrs = list(sorted(addrs, key=lambda a:a['faces'].shape[0]))
+    fs  = fs[:, np.all(ii[fs], axis=0)]
+    fp  = p[fs]
+    # Find the crossing edges of every face for every value at once: lt is (k x 3 x m) for k values
+    # and an edge (a,b) of a face is crossed when exactly one of a and b is <= the value
+    lt = (fp[None,:,:] <= np.reshape(vals, (-1,1,1)))
+    crossed = (lt != np.roll(lt, -1, axis=1))
+    (lvl, fid) = np.where(np.any(crossed, axis=1))
+    if len(fid) == 0: return [[] for _ in vals] if is_vec else []
+    # each crossed face crosses exactly 2 of its edges: (0,1), (1,2), or (2,0)
+    crossed = crossed[lvl, :, fid]
+    k0 = np.argmax(crossed, axis=1)
+    k1 = 2 - np.argmax(crossed[:,::-1], axis=1)
+    (a0, b0, a1, b1) = (fs[k0, fid], fs[(k0+1) % 3, fid], fs[k1, fid], fs[(k1+1) % 3, fid])
+    # The nodes of the isoline graph are the (value, edge) pairs; these are linked by faces
+    keys = np.concatenate([(lvl*N + np.minimum(a0,b0))*N + np.maximum(a0,b0),
+                           (lvl*N + np.minimum(a1,b1))*N + np.maximum(a1,b1)])
+    (keys, nodes) = np.unique(keys, return_inverse=True)
+    nn = len(keys)
+    (lnks, nlnks) = (np.reshape(nodes, (2,-1)), len(fid))
+    # nbrs[i] is the (up to 2) neighboring nodes of node i, and nfcs[i] the faces linking them
+    ends = np.concatenate(lnks)
+    ii = np.argsort(ends, kind='mergesort')
+    starts = np.searchsorted(ends[ii], np.arange(nn))
+    slot = np.arange(len(ii)) - starts[ends[ii]]
+    ok = (slot < 2) # any additional links only arise in non-manifold meshes
+    (nbrs, nfcs) = (np.full((nn,2), -1), np.full((nn,2), -1))
+    nbrs[ends[ii][ok], slot[ok]] = np.concatenate(lnks[::-1])[ii][ok]
+    nfcs[ends[ii][ok], slot[ok]] = np.tile(np.arange(nlnks), 2)[ii][ok]
+    # Each connected component is a line or a loop; a line starts at its lowest endpoint and a loop
+    # at its lowest node; we walk all of them at once
+    (ncomp, comps) = sps.csgraph.connected_components(
+        sps.coo_matrix((np.ones(nlnks), tuple(lnks)), shape=(nn,nn)), directed=False)
+    isend = (nbrs[:,1] == -1)
+    cstart = np.full(ncomp, nn)
+    np.minimum.at(cstart, comps[isend], np.where(isend)[0])
+    isloop = (cstart == nn)
+    np.minimum.at(cstart, comps, np.where(isloop[comps], np.arange(nn), nn))
+    (seqc, seqn, seqf) = ([np.arange(ncomp)], [cstart], [])
+    (walking, prev, cur) = (np.arange(ncomp), np.full(ncomp, -1), cstart)
+    while len(walking) > 0:
+        # step to the neighbor we didn't just come from; lines end at a missing neighbor
+        s = (nbrs[cur,0] == prev).astype(int)
+        (nxt, fc) = (nbrs[cur,s], nfcs[cur,s])
+        go = (nxt != -1)
+        (walking, prev, cur) = (walking[go], cur[go], nxt[go])
+        seqc.append(walking)
+        seqn.append(cur)
+        seqf.append(fc[go])
+        # loops end once they come back around to their start
+        go = (cur != cstart[walking])
+        (walking, prev, cur) = (walking[go], prev[go], cur[go])
+    # the walks were appended step by step, so a stable sort by component orders them
+    (seqc, seqn, seqf) = [np.concatenate(u) for u in (seqc, seqn, seqf)]
+    sq = seqn[np.argsort(seqc, kind='mergesort')]
+    fsq = seqf[np.argsort(seqc[ncomp:], kind='mergesort')]
+    # each point is addressed in the face that links it to the next point (or, for the final point,
+    # in the face that links it to the previous point)
+    cnts = np.bincount(seqc, minlength=ncomp)
+    pos = np.arange(len(sq)) - np.repeat(np.cumsum(cnts) - cnts, cnts)
+    fpos = np.minimum(pos, np.repeat(cnts - 2, cnts))
+    fpos += np.repeat(np.cumsum(cnts - 1) - (cnts - 1), cnts)
+    ptfaces = fid[fsq[fpos]]
+    (lvls, u, v) = (keys[sq] // N // N, keys[sq] // N % N, keys[sq] % N)
+    q = np.sum(fs[:,ptfaces], axis=0) - u - v
+    w = (vals[lvls] - p[v]) / (p[u] - p[v])
+    addrfs = np.split(obj.labels[np.asarray([u, q, v])], np.cumsum(cnts)[:-1], axis=1)
+    addrxs = np.split(np.asarray([w, 0*w]), np.cumsum(cnts)[:-1], axis=1)
+    # split these up into the lines for each value
+    res = [[] for _ in vals]
+    for (l,f,x) in zip(keys[cstart] // N // N, addrfs, addrxs):
+        res[l].append({'faces': f, 'coordinates': x})
+    # as in earlier versions, the lines for each value are sorted from shortest to longest
+    res = [list(sorted(addrs, key=lambda a:a['faces'].shape[1])) for addrs in res]
     # if obj is a topology or addresses were requested, return them now
-    if yield_addresses or not is_mesh(obj): return addrs
-    # otherwise, we now convert these into coordinates
-    xs = [obj.unaddress(addr) for addr in addrs]
-    if smooth is not None: xs = smooth_lines(xs, *smooth)
-    return xs
+    if not yield_addresses and is_mesh(obj):
+        # otherwise, we now convert these into coordinates
+        res = [[obj.unaddress(addr) for addr in addrs] for addrs in res]
+        if smooth is not None: res = [smooth_lines(xs, *smooth) for xs in res]
+    return res if is_vec else res[0]
 def smooth_lines(lns, n=1, inertia=0.5):
     '''
     smooth_lines(matrix) runs one smoothing iteration on the lines implied by the {2,3}xN matrix.
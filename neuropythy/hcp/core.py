@@ -265,11 +265,20 @@ def subject(sid, subjects_path=None, meta_data=None, default_alignment='MSMAll')
             fnm = str(sid)
             fdir = subjects_path
     fdir = os.path.abspath(os.path.join(pth, fnm))
-    if fdir in subject._cache: return subject._cache[fdir]
+    sub = subject._cache.get(fdir)
+    if sub is not None: return sub
     sub = Subject(sid, fdir, meta_data=meta_data, default_alignment=default_alignment).persist()
     if isinstance(sub, Subject): subject._cache[fdir] = sub
     return sub
-subject._cache = {}
+subject._cache = mri.SubjectCache()
+def subject_cache():
+    '''
+    subject_cache() yields the SubjectCache object in which neuropythy's hcp module keeps the
+      subjects that it has loaded. The cache's stats() method reports its hits, misses, and
+      evictions as well as its number of subjects and their estimated size in bytes; see
+      neuropythy.mri.SubjectCache for the config items that limit the cache's size.
+    '''
+    return subject._cache
 def forget_subject(sid):
     '''
     forget_subject(sid) causes neuropythy's hcp module to forget about cached data for the subject
@@ -283,8 +292,8 @@ def forget_subject(sid):
     if sub.path in subject._cache:
         del subject._cache[sub.path]
     else:
-        for (k,v) in six.iteritems(subject._cache):
-            if v is sub:
+        for k in subject._cache.keys():
+            if subject._cache.peek(k) is sub:
                 del subject._cache[k]
                 break
     return None
@@ -293,7 +302,7 @@ def forget_all():
     forget_all() causes neuropythy's hcp module to forget all cached subjects. See also
     forget_subject.
     '''
-    subject._cache = {}
+    subject._cache.clear()
     return None
     
 
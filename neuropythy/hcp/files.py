@@ -3,7 +3,7 @@
 # Stored data regarding the organization of the files in HCP subjects.
 # by Noah C. Benson
 
-import os, six, logging, pimms, pyrsistent as pyr, nibabel as nib, numpy as np
+import os, six, logging, atexit, threading, pimms, pyrsistent as pyr, nibabel as nib, numpy as np
 from .. import io as nyio
 from ..util import (config, is_image, to_credentials, file_map)
 
@@ -2029,12 +2029,28 @@ def _find_retinotopy_path(size=59):
     if _retinotopy_path is not None: dirs = [_retinotopy_path] + config['hcp_subject_paths']
     d = next((sd for sd in dirs if os.path.isfile(os.path.join(sd, _retinotopy_file[size]))), None)
     return d if d is None else os.path.join(d, _retinotopy_file[size])
+# The retinotopy databases are HDF5 files that are kept open once they have been found so that each
+# subject's data can be read directly from the file; h5py handles must not be used by more than
+# one thread at a time, so all reads go through _retinotopy_lock.
+_retinotopy_handles = {}
+_retinotopy_lock = threading.RLock()
+def _retinotopy_close():
+    with _retinotopy_lock:
+        for f in six.itervalues(_retinotopy_handles):
+            try: f.close()
+            except Exception: pass
+        _retinotopy_handles.clear()
+atexit.register(_retinotopy_close)
 def _retinotopy_open(fn, size=59):
     pth = _find_retinotopy_path(size=size)
-    if pth is not None:
-        import h5py
-        with h5py.File(pth, 'r') as f: return fn(f)
-    return None
+    if pth is None: return None
+    import h5py
+    with _retinotopy_lock:
+        f = _retinotopy_handles.get(pth)
+        if f is None or not f.id.valid:
+            f = h5py.File(pth, 'r')
+            _retinotopy_handles[pth] = f
+        return fn(f)
 def _retinotopy_submap(size=59):
     if _retinotopy_submap.cache is None: _retinotopy_submap.cache = {}
     if size not in _retinotopy_submap.cache:
@@ -2046,20 +2062,25 @@ def _retinotopy_submap(size=59):
         _retinotopy_submap.cache[size] = tmp
     return _retinotopy_submap.cache[size]
 _retinotopy_submap.cache = None
-def _retinotopy_dset(name, size=59):
+def _retinotopy_dset(name, sid, size=59):
+    '''
+    _retinotopy_dset(name, sid) yields the (6 x n) matrix of pRF parameters of the given fit (name
+      may be 'full', 'half1', or 'half2') for the given subject; only that subject's part of the
+      database is read from the file. If the subject is not in the database, yields None.
+    '''
     name = name.lower()
     if name in ['full', 'type1', '1', 'all']:  name = 0
     elif name in ['half1', 'split1', 'type1']: name = 1
     elif name in ['half2', 'split2', 'type3']: name = 2
     else: raise ValueError('name must be "full", "half1", or "half2"')
-    if _retinotopy_dset.cache[size][name] is None:
-        arr = _retinotopy_open(lambda f: f['allresults'][name], size=size)
-        if arr is None: return None
-        arr = np.array(arr)
-        arr.setflags(write=False)
-        _retinotopy_dset.cache[size][name] = arr
-    return _retinotopy_dset.cache[size][name]
-_retinotopy_dset.cache = {32:[None,None,None], 59:[None,None,None]}
+    smap = _retinotopy_submap(size=size)
+    if smap is None or sid not in smap: return None
+    k = smap[sid]
+    arr = _retinotopy_open(lambda f: f['allresults'][name, k, ...], size=size)
+    if arr is None: return None
+    arr = np.array(arr)
+    arr.setflags(write=False)
+    return arr
 def _cifti_to_hemis(data, sid=100610):
     (la, ra) = _load_fsLR_atlasroi_for_size(data.shape[0])
     (ln, rn) = [aa.shape[0]     for aa in (la, ra)]
@@ -2071,10 +2092,8 @@ def _cifti_to_hemis(data, sid=100610):
     for (dat,sl,ii) in zip([ldat,rdat],[lsl,rsl],[li,ri]): dat[ii] = data[sl]
     return (ldat, rdat)
 def _retinotopy_data(name, sid, size=59):
-    smap = _retinotopy_submap(size=size)
-    if smap is None or sid not in smap: return None
-    arr = _retinotopy_dset(name, size=size)
-    dat = arr[smap[sid]]
+    dat = _retinotopy_dset(name, sid, size=size)
+    if dat is None: return None
     return pyr.m(
         prf_polar_angle        = _cifti_to_hemis(np.mod(90 - dat[0] + 180, 360) - 180, sid),
         prf_eccentricity       = _cifti_to_hemis(dat[1], sid),
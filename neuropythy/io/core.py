@@ -382,7 +382,7 @@ def load_nifti(filename, to='auto'):
             raise ValueError('image requested as field has more than 2 non-unitary dimensions')
         return dat
     elif to in ['auto', 'automatic']:
-        dims = set(np.shape(img.get_data()))
+        dims = set(img.shape)
         if 1 < len(dims) < 4 and 1 in dims:
             return np.squeeze(np.asarray(img.get_data()))
         else:
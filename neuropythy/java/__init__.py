@@ -6,29 +6,99 @@
 import numpy   as np
 import scipy   as sp
 import numbers as num
-import os, sys, gzip
+import os, re, gzip, threading, pimms
 
-from array  import array
-from ..util import library_path
+from ..util import (library_path, config)
+
+def _to_java_heap_size(s):
+    if s is None: return None
+    if pimms.is_int(s): s = '%dm' % s
+    s = str(s).strip()
+    if not re.match(r'^[0-9]+[kKmMgG]?$', s):
+        raise ValueError('java_heap_size must be an integer (MB) or a string such as "4g"')
+    return s
+def _to_java_gateway_count(n):
+    n = int(n)
+    if n < 1: raise ValueError('java_gateway_count must be a positive integer')
+    return n
+config.declare('java_heap_size', filter=_to_java_heap_size, default_value='4g')
+config.declare('java_gateway_count', filter=_to_java_gateway_count, default_value=1)
 
 # Java start:
 _java_port = None
 _java = None
+# The pool of additional gateways used by java_executor(), and the thread-local gateway binding:
+_java_gateways = []
+_java_lock = threading.RLock()
+_java_local = threading.local()
+_java_executor = None
 
-def _init_registration():
+def _launch_gateway():
     from py4j.java_gateway import (launch_gateway, JavaGateway, GatewayParameters)
-    global _java, _java_port
-    if _java is not None: return
-    _java_port = launch_gateway(
+    heap = config['java_heap_size']
+    port = launch_gateway(
         classpath=os.path.join(library_path(), 'nben', 'target', 'nben-standalone.jar'),
-        javaopts=['-Xmx4g'],
+        javaopts=[] if heap is None else ['-Xmx' + heap],
         die_on_exit=True)
-    _java = JavaGateway(gateway_parameters=GatewayParameters(port=_java_port))
+    return (port, JavaGateway(gateway_parameters=GatewayParameters(port=port)))
+
+def _init_registration():
+    global _java, _java_port
+    with _java_lock:
+        if _java is not None: return
+        (_java_port, _java) = _launch_gateway()
 
 def java_link():
+    '''
+    java_link() yields the py4j JavaGateway object used by neuropythy. If the calling thread is a
+      worker of the java_executor() pool, then the gateway (i.e., the JVM) bound to that worker is
+      returned; otherwise the default gateway is returned. Gateways are launched on demand with
+      the maximum heap size given by neuropythy.config['java_heap_size'] (default: '4g').
+    '''
+    gw = getattr(_java_local, 'gateway', None)
+    if gw is not None: return gw
     if _java is None: _init_registration()
     return _java
 
+def _bind_java_worker():
+    # Binds the calling thread to its own gateway; the first thread bound shares the default one.
+    with _java_lock:
+        k = len(_java_gateways)
+        if k == 0:
+            _init_registration()
+            gw = _java
+        else:
+            gw = _launch_gateway()[1]
+        _java_gateways.append(gw)
+    _java_local.gateway = gw
+    return gw
+
+def _java_worker_call(f, args, kw):
+    # Runs f(*args, **kw) in a java_executor() worker thread, binding the worker to a gateway the
+    # first time it is used (thread pool initializers require Python 3.7).
+    if getattr(_java_local, 'gateway', None) is None: _bind_java_worker()
+    return f(*args, **kw)
+
+def java_executor():
+    '''
+    java_executor() yields a concurrent.futures.ThreadPoolExecutor whose worker threads each own a
+      separate JVM (py4j gateway); any function submitted to the executor that uses java_link(),
+      such as neuropythy.registration.mesh_register, runs against its worker's JVM, so that
+      separate registrations proceed in parallel. The number of workers is given by
+      neuropythy.config['java_gateway_count'] (default: 1) and the heap of each JVM by
+      neuropythy.config['java_heap_size'] (default: '4g'); the executor is created on first use,
+      and each worker's JVM is launched when the worker runs its first job.
+    '''
+    global _java_executor
+    with _java_lock:
+        if _java_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            class JavaExecutor(ThreadPoolExecutor):
+                def submit(self, f, *args, **kw):
+                    return ThreadPoolExecutor.submit(self, _java_worker_call, f, args, kw)
+            _java_executor = JavaExecutor(max_workers=config['java_gateway_count'])
+        return _java_executor
+
 def serialize_numpy(m, t):
     '''
     serialize_numpy(m, type) converts the numpy array m into a byte stream that can be read by the
@@ -37,44 +107,60 @@ def serialize_numpy(m, t):
     followed by that number of integers (the dimension sizes themselves) then the bytes of the
     array, flattened.
     The argument type gives the type of the array to be transferred and must be 'i' for integer or
-    'd' for double (or any other string accepted by array.array()).
+    'd' for double (or any other type code accepted by numpy.dtype()).
     '''
-    # Start with the header: <number of dimensions> <dim1-size> <dim2-size> ...
-    header = array('i', [len(m.shape)] + list(m.shape))
-    # Now, we can do the array itself, just flattened
-    body = array(t, m.flatten().tolist())
-    # Wrap bytes if necessary...
-    if sys.byteorder != 'big':
-        header.byteswap()
-        body.byteswap()
-    # And return the result:
-    return bytearray(header.tostring() + body.tostring())
+    # The header is <number of dimensions> <dim1-size> <dim2-size> ...; both the header and the
+    # body are written big-endian straight from the array buffers (no per-element conversion)
+    m = np.asarray(m)
+    header = np.asarray([len(m.shape)] + list(m.shape), dtype='>i4')
+    body = np.ascontiguousarray(m, dtype=np.dtype(t).newbyteorder('>'))
+    return bytearray(header.tobytes() + body.tobytes())
+
+def from_java_doubles(jarr):
+    '''
+    from_java_doubles(jarr) yields a numpy array of the values in the given java double[] or
+    double[][] array object. A double[] is copied into a big-endian java byte array in one JVM call
+    and decoded with numpy.frombuffer; a double[][] is serialized by java.util.Arrays.deepToString,
+    also in one JVM call, whose decimal representation of each double round-trips exactly. Two-
+    dimensional arrays must be rectangular.
+    '''
+    n = len(jarr)
+    if n == 0: return np.zeros(0)
+    jvm = java_link().jvm
+    if isinstance(jarr[0], num.Number):
+        bb = jvm.java.nio.ByteBuffer.allocate(8 * n)
+        bb.asDoubleBuffer().put(jarr)
+        return np.frombuffer(bb.array(), dtype='>f8').astype(float)
+    ncols = len(jarr[0])
+    s = jvm.java.util.Arrays.deepToString(jarr)
+    s = s.replace('[', '').replace(']', '')
+    res = np.array(s.split(','), dtype=float) if len(s.strip()) > 0 else np.zeros(0)
+    if len(res) != n * ncols: raise ValueError('from_java_doubles: 2D arrays must be rectangular')
+    return np.reshape(res, (n, ncols))
 
 def to_java_doubles(m):
     '''
     to_java_doubles(m) yields a java array object for the vector or matrix m.
     '''
-    global _java
-    if _java is None: _init_registration()
+    jvm = java_link().jvm
     m = np.asarray(m)
     dims = len(m.shape)
     if dims > 2: raise ValueError('1D and 2D arrays supported only')
     bindat = serialize_numpy(m, 'd')
-    return (_java.jvm.nben.util.Numpy.double2FromBytes(bindat) if dims == 2
-            else _java.jvm.nben.util.Numpy.double1FromBytes(bindat))
+    return (jvm.nben.util.Numpy.double2FromBytes(bindat) if dims == 2
+            else jvm.nben.util.Numpy.double1FromBytes(bindat))
 
 def to_java_ints(m):
     '''
     to_java_ints(m) yields a java array object for the vector or matrix m.
     '''
-    global _java
-    if _java is None: _init_registration()
+    jvm = java_link().jvm
     m = np.asarray(m)
     dims = len(m.shape)
     if dims > 2: raise ValueError('1D and 2D arrays supported only')
     bindat = serialize_numpy(m, 'i')
-    return (_java.jvm.nben.util.Numpy.int2FromBytes(bindat) if dims == 2
-            else _java.jvm.nben.util.Numpy.int1FromBytes(bindat))
+    return (jvm.nben.util.Numpy.int2FromBytes(bindat) if dims == 2
+            else jvm.nben.util.Numpy.int1FromBytes(bindat))
 
 def to_java_array(m):
     '''
@@ -11,12 +11,14 @@ import scipy.spatial       as spspace
 import neuropythy.geometry as geo
 import pyrsistent          as pyr
 import collections         as colls
-import os, sys, types, six, pimms
+import nibabel             as nib
+import os, sys, types, six, warnings, threading, pimms
 
 from itertools import chain
 
 from ..util import (ObjectWithMetaData, to_affine, is_image, is_address, is_tuple, address_data,
-                    curry, to_hemi_str)
+                    curry, to_hemi_str, config, array_digest, LRUCache, estimate_nbytes)
+from .images import image_memmap
 
 @pimms.immutable
 class Subject(ObjectWithMetaData):
@@ -36,6 +38,10 @@ class Subject(ObjectWithMetaData):
 
     Subject respects laziness in the hemis and images classes, and this mechanism is recommended
     as a way to lazily load subject data (see pimms.lazy_map).
+
+    If the config item neuropythy.config['vertex_to_voxel_cache_path'] is set to an existing
+    directory, then the linear, lines, and nearest vertex-to-voxel interpolation matrices of
+    subjects are saved there as .npz files and are reloaded from there by later processes.
     '''
     def __init__(self, name=None, path=None, hemis=None, images=None, meta_data=None,
                  voxel_to_vertex_matrix=None, voxel_to_native_matrix=None):
@@ -262,8 +268,9 @@ class Subject(ObjectWithMetaData):
         surface vertices into the the ribbon and weighting them by the fraction of the vector that
         lies in the voxel.
         '''
-        return _vertex_to_voxel_linear_interpolation(lh, lh_gray_indices, image_dimensions,
-                                                     voxel_to_vertex_matrix)
+        return _cached_vertex_to_voxel_interpolation(
+            'linear', _vertex_to_voxel_linear_interpolation, lh, lh_gray_indices, image_dimensions,
+            voxel_to_vertex_matrix)
     @pimms.value
     def rh_vertex_to_voxel_linear_interpolation(rh_gray_indices, rh, image_dimensions,
                                                 voxel_to_vertex_matrix):
@@ -276,8 +283,9 @@ class Subject(ObjectWithMetaData):
         surface vertices into the the ribbon and weighting them by the fraction of the vector that
         lies in the voxel.
         '''
-        return _vertex_to_voxel_linear_interpolation(rh, rh_gray_indices, image_dimensions,
-                                                     voxel_to_vertex_matrix)
+        return _cached_vertex_to_voxel_interpolation(
+            'linear', _vertex_to_voxel_linear_interpolation, rh, rh_gray_indices, image_dimensions,
+            voxel_to_vertex_matrix)
     @pimms.value
     def lh_vertex_to_voxel_heaviest_interpolation(lh_vertex_to_voxel_linear_interpolation):
         '''
@@ -350,8 +358,9 @@ class Subject(ObjectWithMetaData):
         surface vertices into the the ribbon and weighting them by the fraction of the vector that
         lies in the voxel.
         '''
-        return _vertex_to_voxel_lines_interpolation(lh, lh_gray_indices, image_dimensions,
-                                                    vertex_to_voxel_matrix)
+        return _cached_vertex_to_voxel_interpolation(
+            'lines', _vertex_to_voxel_lines_interpolation, lh, lh_gray_indices, image_dimensions,
+            vertex_to_voxel_matrix)
     @pimms.value
     def rh_vertex_to_voxel_lines_interpolation(rh_gray_indices, rh, image_dimensions,
                                                vertex_to_voxel_matrix):
@@ -364,8 +373,9 @@ class Subject(ObjectWithMetaData):
         surface vertices into the the ribbon and weighting them by the fraction of the vector that
         lies in the voxel.
         '''
-        return _vertex_to_voxel_lines_interpolation(rh, rh_gray_indices, image_dimensions,
-                                                    vertex_to_voxel_matrix)
+        return _cached_vertex_to_voxel_interpolation(
+            'lines', _vertex_to_voxel_lines_interpolation, rh, rh_gray_indices, image_dimensions,
+            vertex_to_voxel_matrix)
     @pimms.value
     def vertex_to_voxel_lines_interpolation(lh_vertex_to_voxel_lines_interpolation,
                                             rh_vertex_to_voxel_lines_interpolation):
@@ -395,7 +405,9 @@ class Subject(ObjectWithMetaData):
           as the ordering used in sub.lh_gray_indices.
         The method used is nearest-neighbors to either the closest pial or white surface vertex.
         '''
-        return _vertex_to_voxel_nearest_interpolation(lh, lh_gray_indices, voxel_to_vertex_matrix)
+        return _cached_vertex_to_voxel_interpolation(
+            'nearest', lambda h,g,s,m: _vertex_to_voxel_nearest_interpolation(h,g,m),
+            lh, lh_gray_indices, None, voxel_to_vertex_matrix)
     @pimms.value
     def rh_vertex_to_voxel_nearest_interpolation(rh_gray_indices, rh, voxel_to_vertex_matrix):
         '''
@@ -405,7 +417,9 @@ class Subject(ObjectWithMetaData):
           as the ordering used in sub.lh_gray_indices.
         The method used is nearest-neighbors to either the closest pial or white surface vertex.
         '''
-        return _vertex_to_voxel_nearest_interpolation(rh, rh_gray_indices, voxel_to_vertex_matrix)
+        return _cached_vertex_to_voxel_interpolation(
+            'nearest', lambda h,g,s,m: _vertex_to_voxel_nearest_interpolation(h,g,m),
+            rh, rh_gray_indices, None, voxel_to_vertex_matrix)
     @pimms.value
     def vertex_to_voxel_nearest_interpolation(lh_vertex_to_voxel_nearest_interpolation,
                                               rh_vertex_to_voxel_nearest_interpolation):
@@ -446,7 +460,8 @@ class Subject(ObjectWithMetaData):
         '''
         return os.path.join(sub.path, *args)
     def cortex_to_image(self, data,
-                        hemi=None, method='linear', fill=0, dtype=None, affine=None, shape=None):
+                        hemi=None, method='linear', fill=0, dtype=None, affine=None, shape=None,
+                        output=None, block_size=256):
         '''
         sub.cortex_to_image(data, hemi) projects the given cortical-surface data to the given
           subject's gray-matter voxels of the given hemisphere and returns the resulting numpy
@@ -472,6 +487,14 @@ class Subject(ObjectWithMetaData):
             matrix will be used.
           * shape (default: None) specifies the dimensions of the output array; if None, then the
             subject's image_dimensions is used.
+          * output (default: None) may specify the filename of an uncompressed NIfTI (.nii) or MGH
+            (.mgh) file; if given, the projection is written directly into a memory-map of this
+            file, which is given the subject's voxel_to_native_matrix as its affine, and the loaded
+            image is returned instead of an array.
+          * block_size (default: 256) specifies the number of frames of multi-frame data that are
+            projected at once; the memory used for the projection of a time-series is bounded by
+            the block size rather than the number of frames. If None, all frames are projected at
+            once.
         '''
         # what hemisphere(s)?
         hemi = to_hemi_str(hemi)
@@ -530,7 +553,9 @@ class Subject(ObjectWithMetaData):
         shape = self.image_dimensions if shape is None else shape
         # make our output array
         dims = shape + (frames,) if frames > 1 and len(shape) < 4 else shape
-        arr = np.full(dims, fill, dtype=dtype)
+        if output is None: arr = np.full(dims, fill, dtype=dtype)
+        else: arr = image_memmap(output, dims, dtype=dtype, affine=self.voxel_to_native_matrix,
+                                 fill=fill)
         # if we are given a transform matrix, we have to build the interpolation
         # what method? specifically, what matrices to use?
         if pimms.is_str(method):
@@ -559,14 +584,25 @@ class Subject(ObjectWithMetaData):
         else:
             indices = mask
             interp = method
-        data = [x for x in data if x is not None][0] if nhems == 1 else np.concatenate(data)
-        # if the fill is non-zero, we need to note where the interp matrix misses
-        misses = None if fill == 0 else np.where(np.abs(interp).sum(axis=1) == 0)
-        arr[indices] = interp.dot(data)
-        # note the misses if there are some
-        if misses: arr[misses] = fill
+        data = [x for x in data if x is not None]
+        indices = np.where(indices) if np.asarray(indices).dtype == np.bool_ else tuple(indices)
+        if frames == 1 or block_size is None or block_size >= frames:
+            data = data[0] if len(data) == 1 else np.concatenate(data)
+            arr[indices] = interp.dot(data)
+        else:
+            # project the frames a block at a time so that the dense intermediates stay small
+            for k0 in range(0, frames, block_size):
+                k1 = min(k0 + block_size, frames)
+                blk = np.concatenate([np.asarray(x[:, k0:k1]) for x in data])
+                arr[indices + (slice(k0, k1),)] = interp.dot(blk)
+        # if the fill is non-zero, the voxels that the interp matrix misses must be refilled
+        if fill != 0:
+            misses = np.where(np.asarray(np.abs(interp).sum(axis=1)).flatten() == 0)[0]
+            if len(misses) > 0: arr[tuple([ii[misses] for ii in indices])] = fill
         # That's everything!
-        return arr
+        if output is None: return arr
+        arr.flush()
+        return nib.load(output)
     def image_to_cortex(self, image,
                         surface='midgray', hemi=None, affine=None, method=None, fill=0, dtype=None,
                         weights=None):
@@ -593,6 +629,179 @@ def is_subject(s):
     '''
     return isinstance(s, Subject)
 
+# The freesurfer and hcp modules cache the subjects that they load in SubjectCache objects; the
+# limits of these caches are configurable.
+def _to_cache_limit(n):
+    if n is None: return None
+    n = int(n)
+    if n < 0: raise ValueError('cache limits must be non-negative integers')
+    return n
+config.declare('subject_cache_size', filter=_to_cache_limit, default_value=32)
+config.declare('subject_cache_bytes', filter=_to_cache_limit, default_value=None)
+class SubjectCache(LRUCache):
+    '''
+    SubjectCache() yields an LRUCache object for Subject objects. The cache holds at most
+      neuropythy.config['subject_cache_size'] subjects (default: 32) whose estimated total size is
+      at most neuropythy.config['subject_cache_bytes'] bytes (default: None, no limit); the least
+      recently used subjects are evicted when either limit is exceeded. The limits are read from
+      the config each time the cache is updated.
+
+    The size of a subject is estimated by estimate_nbytes() and so includes its realized lazy data;
+    because subjects grow as their data are loaded, the sizes of all cached subjects are updated
+    whenever a subject is added and the size of a subject is updated whenever it is requested.
+    '''
+    def __init__(self):
+        LRUCache.__init__(self, sizeof=estimate_nbytes)
+    def __getitem__(self, k):
+        with self._lock:
+            v = LRUCache.__getitem__(self, k)
+            self.resize(k)
+            return v
+    def __setitem__(self, k, v):
+        with self._lock:
+            for kk in self.keys(): self.resize(kk)
+            LRUCache.__setitem__(self, k, v)
+    def evict(self, keep=None):
+        self.max_entries = config['subject_cache_size']
+        self.max_bytes = config['subject_cache_bytes']
+        return LRUCache.evict(self, keep=keep)
+
+# Subject data can be prefetched: the lazy values named by a list of property paths are realized by
+# a pool of threads in the background while other work proceeds.
+def _to_thread_count(n):
+    n = int(n)
+    if n < 1: raise ValueError('thread counts must be positive integers')
+    return n
+config.declare('prefetch_thread_count', filter=_to_thread_count, default_value=8)
+_prefetch_executor = None
+_prefetch_lock = threading.Lock()
+def prefetch_executor():
+    '''
+    prefetch_executor() yields the concurrent.futures.ThreadPoolExecutor used by prefetch(); the
+      number of worker threads is given by neuropythy.config['prefetch_thread_count'] (default: 8)
+      when the executor is first created.
+    '''
+    global _prefetch_executor
+    from concurrent.futures import ThreadPoolExecutor
+    with _prefetch_lock:
+        if _prefetch_executor is None:
+            _prefetch_executor = ThreadPoolExecutor(max_workers=config['prefetch_thread_count'])
+        return _prefetch_executor
+default_prefetch_properties = ('lh.white_surface', 'lh.pial_surface',
+                               'rh.white_surface', 'rh.pial_surface')
+class _PrefetchJob(object):
+    '''
+    _PrefetchJob(obj, paths, executor) realizes the given property paths of obj in the executor;
+      job.future is a Future that yields obj once all of the paths have been realized.
+    '''
+    def __init__(self, obj, paths, executor):
+        from concurrent.futures import Future
+        self.future = Future()
+        self.pending = 1
+        self.lock = threading.Lock()
+        # we organize the paths into a tree so that each shared step is realized only once; paths
+        # that share their first step are realized one after the other by a single task because
+        # pimms does not lock lazy values, so siblings such as lh.white_surface and lh.pial_surface
+        # would otherwise both build the lazy values that they share (e.g., lh.tess)
+        tree = {}
+        for path in paths:
+            node = tree
+            for k in path.split('.'): node = node.setdefault(k, {})
+        self.result = obj
+        for (k, subtree) in six.iteritems(self._expand(obj, tree)):
+            with self.lock: self.pending += 1
+            executor.submit(self._run, obj, {k: subtree})
+        self._done()
+    @staticmethod
+    def _expand(obj, tree):
+        # replaces a '*' in the given tree with each of the keys of obj
+        if '*' not in tree: return tree
+        res = {k:v for (k,v) in six.iteritems(tree) if k != '*'}
+        for k in (list(six.iterkeys(obj)) if pimms.is_map(obj) else []):
+            res[k] = _prefetch_merge(res.get(k, {}), tree['*'])
+        return res
+    def _realize(self, obj, tree):
+        for (k, subtree) in six.iteritems(self._expand(obj, tree)):
+            # errors are ignored; they are raised again when the value is requested in earnest
+            try: x = obj[k] if pimms.is_map(obj) else getattr(obj, k)
+            except Exception: continue
+            if len(subtree) > 0: self._realize(x, subtree)
+    def _run(self, obj, tree):
+        try:     self._realize(obj, tree)
+        finally: self._done()
+    def _done(self):
+        with self.lock:
+            self.pending -= 1
+            finished = (self.pending == 0)
+        if finished: self.future.set_result(self.result)
+def _prefetch_merge(a, b):
+    # merges two prefetch path trees
+    res = dict(a)
+    for (k,v) in six.iteritems(b): res[k] = _prefetch_merge(res.get(k, {}), v)
+    return res
+def prefetch(sub, properties=None, executor=None):
+    '''
+    prefetch(sub) starts loading the white and pial surfaces of the given subject's hemispheres in
+      background threads and yields a concurrent.futures.Future object that yields sub once the
+      loading is complete.
+    prefetch(sub, properties) loads the given properties, which must be a list of property paths;
+      each path is a string of attribute names or map keys separated by dots, such as
+      'lh.white_surface', 'rh.properties.thickness', or 'images.ribbon', and the element '*'
+      stands for every key of a map (e.g., 'lh.properties.*').
+
+    Each path is realized exactly as if it had been requested on the subject, so once the prefetch
+    is done, requesting the same data costs nothing; errors encountered while prefetching are
+    ignored. Paths that begin with the same attribute (such as 'lh.white_surface' and
+    'lh.pial_surface') are realized in order by a single thread, while paths that begin with
+    different attributes (such as 'lh' and 'rh') are realized in parallel. Because pimms does not
+    lock lazy values, a lazy value that is shared by paths with different first attributes (e.g.,
+    one that both hemispheres depend on) may be calculated more than once if it has not yet been
+    realized. The optional argument executor may specify the concurrent.futures.Executor to use;
+    by default prefetch_executor() is used.
+    '''
+    if properties is None: properties = default_prefetch_properties
+    elif pimms.is_str(properties): properties = [properties]
+    if executor is None: executor = prefetch_executor()
+    return _PrefetchJob(sub, properties, executor).future
+def prefetch_iter(subjects, lookahead=2, properties=None, loader=None, executor=None):
+    '''
+    prefetch_iter(subjects) yields an iterator over the given sequence of subjects in which the
+      data of the next subjects are prefetched (see prefetch()) while the current subject is being
+      processed.
+    prefetch_iter(subjects, k) prefetches the next k subjects (default: 2).
+
+    The following options are also accepted:
+      * properties (default: None) is passed along to prefetch().
+      * loader (default: None) may specify a function that is used to load each subject from the
+        elements of subjects; e.g., prefetch_iter(sids, loader=ny.hcp_subject) loads each HCP
+        subject in the background as well. Errors raised by the loader are raised by the iterator
+        when it reaches the relevant subject.
+      * executor (default: None) is passed along to prefetch().
+    '''
+    from concurrent.futures import Future
+    if executor is None: executor = prefetch_executor()
+    def _start(s):
+        out = Future()
+        def _loaded(f):
+            try: sub = f.result()
+            except Exception as e: return out.set_exception(e)
+            p = prefetch(sub, properties=properties, executor=executor)
+            p.add_done_callback(lambda _: out.set_result(sub))
+        if loader is None: _loaded(_completed_future(s))
+        else: executor.submit(loader, s).add_done_callback(_loaded)
+        return out
+    queue = colls.deque()
+    it = iter(subjects)
+    for s in it:
+        queue.append(_start(s))
+        if len(queue) > lookahead: yield queue.popleft().result()
+    while len(queue) > 0: yield queue.popleft().result()
+def _completed_future(x):
+    from concurrent.futures import Future
+    f = Future()
+    f.set_result(x)
+    return f
+
 @pimms.immutable
 class Cortex(geo.Topology):
     '''
@@ -866,7 +1075,40 @@ def to_cortex(c):
 
 ####################################################################################################
 # These functions deal with cortex_to_image and image_to_cortex interpolation:
-def _vertex_to_voxel_linear_interpolation(hemi, gray_indices, image_shape, voxel_to_vertex_matrix):
+# The vertex-to-voxel interpolation matrices of subjects are expensive to build, so they may be
+# saved in a cache directory; they are keyed by a digest of the hemisphere's white and pial
+# surfaces, the gray voxels, the image shape, the affine transformation, and the method.
+config.declare_dir('vertex_to_voxel_cache_path')
+def _cached_vertex_to_voxel_interpolation(method, f, hemi, gray_indices, image_shape, affine):
+    '''
+    _cached_vertex_to_voxel_interpolation(method, f, hemi, gray_indices, image_shape, affine) yields
+      f(hemi, gray_indices, image_shape, affine) as a CSR matrix; if the config item
+      neuropythy.config['vertex_to_voxel_cache_path'] is set, then the matrix is loaded from (or,
+      after it is calculated, saved to) a .npz file in that directory.
+    '''
+    cache_path = config['vertex_to_voxel_cache_path']
+    if cache_path is None or gray_indices is None:
+        return f(hemi, gray_indices, image_shape, affine).tocsr()
+    key = array_digest(hemi.white_surface.fingerprint, hemi.pial_surface.fingerprint,
+                       tuple(np.asarray(u) for u in gray_indices),
+                       None if image_shape is None else tuple(image_shape[0:3]),
+                       np.asarray(affine, dtype=float), method)
+    flnm = os.path.join(cache_path, 'v2v_%s.npz' % key)
+    if os.path.isfile(flnm):
+        try: return sps.load_npz(flnm).tocsr()
+        except Exception: pass
+    interp = f(hemi, gray_indices, image_shape, affine).tocsr()
+    # write to a temporary file first so that readers never see a partial file
+    tmp = flnm[:-4] + '.%d.%d.tmp.npz' % (os.getpid(), threading.current_thread().ident)
+    try:
+        sps.save_npz(tmp, interp)
+        os.rename(tmp, flnm)
+    except Exception:
+        warnings.warn('Could not write vertex-to-voxel cache file: %s' % flnm)
+        if os.path.isfile(tmp): os.remove(tmp)
+    return interp
+def _vertex_to_voxel_linear_interpolation(hemi, gray_indices, image_shape, voxel_to_vertex_matrix,
+                                          max_faces=256, block_size=2**19):
     if gray_indices is None: raise ValueError('gray indices cannot be None')
     n      = len(gray_indices[0])
     vcount = hemi.vertex_count
@@ -874,49 +1116,108 @@ def _vertex_to_voxel_linear_interpolation(hemi, gray_indices, image_shape, voxel
     xyz = voxel_to_vertex_matrix.dot(np.vstack((np.asarray(gray_indices), np.ones(n))))[0:3].T
     # get some relevant structure data
     (fwcoords,fpcoords)  = (hemi.white_surface.face_coordinates, hemi.pial_surface.face_coordinates)
-    fids = np.concatenate((range(hemi.tess.face_count), range(hemi.tess.face_count)))
-    faces = np.concatenate((hemi.tess.indexed_faces, hemi.tess.indexed_faces), axis=-1)
-    face_centers = np.hstack((hemi.white_surface.face_centers, hemi.pial_surface.face_centers))
-    try:              shash = spspace.cKDTree(face_centers.T)
-    except Exception: shash = spspace.KDTree(face_centers.T)
-    (whsh, phsh) = [getattr(hemi, '%s_surface' % s).face_hash for s in ['white', 'pial']]
+    faces = hemi.tess.indexed_faces
+    fcount = hemi.tess.face_count
+    # the spatial hashes of the white and pial face centers are cached by the surfaces; the k nearest
+    # face centers of a voxel are the k nearest of the k found in each hash
+    hashes = (hemi.white_surface.face_hash, hemi.pial_surface.face_hash)
+    def _query(x, k):
+        (ds, fs) = [np.hstack([np.reshape(u, (len(x), -1)) for u in r])
+                    for r in zip(*[h.query(x, k) for h in hashes])]
+        srt = np.argsort(ds, axis=1)[:, :k]
+        rs = np.arange(len(x))[:,None]
+        return (ds[rs, srt], fs[rs, srt])
+    # no point in a prism is farther from the prism's face centers than its farthest vertex is
+    rmax = np.max([np.sqrt(np.sum((fx - c[None,:,:])**2, axis=1))
+                   for fx in (fwcoords, fpcoords)
+                   for c in (hemi.white_surface.face_centers, hemi.pial_surface.face_centers)])
     # Okay, for each voxel (xyz), we want to find the closest face centers; from those centers, we
-    # find the ones for which the nearest point in the plane of the face to the voxel lies inside
-    # the face, and of those we find the closest; this nearest point is then used for trilinear
-    # interpolation of the points in the triangle.
-    N = 256
-    sofar = 0
-    # go ahead and make our interp matrix
-    interp = sps.lil_matrix((n, vcount), dtype=np.float)
-    # Okay, we look for those isect's within the triangles
-    ii = np.asarray(range(n)) # the subset not yet matched
-    for i in range(N):
-        if len(ii) == 0: break
-        if i >= sofar:
-            sofar = max(4, 2*sofar)
-            idcs = shash.query(xyz[ii], sofar)[1].T
-        # we look at just the i'th column of the indices
-        col = fids[idcs[i]]
-        bcs = geo.prism_barycentric_coordinates(fwcoords[:,:,col], fpcoords[:,:,col], xyz[ii].T)
-        bcs = bcs[0:3] # since the layers are the same in this case...
-        outp = np.isclose(np.sum(bcs, axis=0), 0)
-        inp = np.logical_not(outp)
-        # for those in their prisms, we linearly interpolate using the bc coordinates
-        bcs = bcs[:,inp]
-        ii_inp = ii[inp]
-        fs = faces[:, col[inp]]
-        for k in (0,1,2): interp[(ii_inp, fs[k])] = bcs[k]
-        # trim down those that matched so we don't keep looking for them
-        ii = ii[outp]
-        idcs = idcs[:,outp]
-        # And continue!
-    # last, we normalize the rows
-    rowsums = np.asarray(interp.sum(axis=1))[:,0]
-    z = np.isclose(rowsums, 0)
-    invrows = np.logical_not(z) / (rowsums + z)
-    ii = np.asarray(range(n))
-    return sps.csc_matrix((invrows, (ii,ii))).dot(interp)
+    # find the ones whose white-to-pial prism contains the voxel, and of those we take the closest;
+    # the voxel is then linearly interpolated from the vertices of that face. Most voxels lie in the
+    # prism of the nearest face center, so the search starts there and is widened (2, 4, 8... face
+    # centers) for the voxels not yet matched; each widening tests all of the new candidates of all
+    # of these voxels together (in blocks of at most block_size prisms).
+    fids = np.full(n, -1, dtype=int)
+    bcs = np.zeros((2, n))
+    ii = np.arange(n) # the subset not yet matched
+    kmax = min(max_faces, 2*fcount)
+    (k0, k) = (0, min(1, kmax))
+    while len(ii) > 0 and k0 < kmax:
+        (ds, cands) = _query(xyz[ii], k)
+        cands = cands[:, k0:k]
+        ncol = cands.shape[1]
+        hits = np.zeros(len(ii), dtype=bool)
+        step = max(1, block_size // ncol)
+        for r0 in range(0, len(ii), step):
+            rs = np.arange(r0, min(r0 + step, len(ii)))
+            fs = cands[rs].flatten()
+            pts = np.repeat(xyz[ii[rs]], ncol, axis=0).T
+            bc = geo.prism_barycentric_coordinates(fwcoords[:,:,fs], fpcoords[:,:,fs], pts)
+            inp = np.reshape(~np.isclose(np.sum(bc, axis=0), 0), (len(rs), ncol))
+            # the first (i.e., nearest) candidate prism containing each voxel is its match
+            hit = np.any(inp, axis=1)
+            sel = np.where(hit)[0]*ncol + np.argmax(inp[hit], axis=1)
+            fids[ii[rs[hit]]] = fs[sel]
+            bcs[:, ii[rs[hit]]] = bc[0:2, sel]
+            hits[rs[hit]] = True
+        # trim down those that matched so we don't keep looking for them, as well as those that
+        # are too far from all of the remaining face centers to lie in any of their prisms
+        ii = ii[~hits & (ds[:,-1] <= rmax)]
+        (k0, k) = (k, min(2*k, kmax))
+    # the interpolation weights are the barycentric coordinates (a, b, 1 - a - b) of the voxel in
+    # its face's prism; we put these together into a sparse matrix all at once
+    ii = np.where(fids >= 0)[0]
+    (a, b) = bcs[:, ii]
+    wts = np.concatenate([a, b, 1 - a - b])
+    return sps.csr_matrix((wts, (np.tile(ii, 3), faces[:, fids[ii]].flatten())),
+                          shape=(n, vcount))
     
+def _voxel_traversal(x0, x1):
+    '''
+    _voxel_traversal(x0, x1) yields (ijk, lines, fracs) where x0 and x1 are 3 x n matrices of the
+      start and end points of n line segments in continuous voxel coordinates (such that voxel
+      (i,j,k) spans [i,i+1) x [j,j+1) x [k,k+1)). The return value ijk is a 3 x m integer matrix of
+      voxel indices, lines is the m-length vector of the segment indices that pass through these
+      voxels, and fracs is the fraction of each segment's length that lies in each voxel.
+    This is the voxel traversal algorithm of Amanatides and Woo (1987) run over all segments at
+    once: each pass advances every unfinished segment by one voxel, so the number of passes is the
+    maximum number of voxel boundaries crossed by any one segment.
+    '''
+    (x0, x1) = [np.asarray(x, dtype=float) for x in (x0, x1)]
+    u = x1 - x0
+    vox = np.floor(x0).astype(int)
+    step = np.sign(u).astype(int)
+    # the number of boundaries remaining to be crossed along each axis
+    rem = np.abs(np.floor(x1).astype(int) - vox)
+    nz = (u != 0)
+    u_inv = nz / (u + ~nz)
+    # the segment parameters (0 at x0, 1 at x1) of the next boundary and the distance between them
+    tdel = np.where(nz, np.abs(u_inv), np.inf)
+    tmax = np.where(nz, (vox + (step > 0) - x0) * u_inv, np.inf)
+    tmax[rem == 0] = np.inf
+    ii = np.arange(x0.shape[1])
+    tcur = np.zeros(len(ii))
+    (ijks, lns, frs) = ([np.zeros((3,0), dtype=int)], [np.zeros(0, dtype=int)], [np.zeros(0)])
+    while len(ii) > 0:
+        ax = np.argmin(tmax, axis=0)
+        cols = np.arange(len(ii))
+        tnext = np.minimum(tmax[ax, cols], 1)
+        done = np.all(rem == 0, axis=0)
+        tnext[done] = 1
+        ijks.append(vox.copy())
+        lns.append(ii)
+        frs.append(tnext - tcur)
+        # advance the unfinished segments one voxel along the axis of the nearest boundary
+        go = np.where(~done)[0]
+        (a, g) = (ax[go], go)
+        vox[a, g] += step[a, g]
+        rem[a, g] -= 1
+        tmax[a, g] = np.where(rem[a, g] == 0, np.inf, tmax[a, g] + tdel[a, g])
+        tcur = tnext
+        if len(go) < len(ii):
+            (ii, tcur) = (ii[go], tcur[go])
+            (vox, step, rem, tmax, tdel) = [x[:, go] for x in (vox, step, rem, tmax, tdel)]
+    return (np.hstack(ijks), np.concatenate(lns), np.concatenate(frs))
 def _vertex_to_voxel_lines_interpolation(hemi, gray_indices, image_shape, vertex_to_voxel_matrix):
     ijks = np.asarray(list(gray_indices) if isinstance(gray_indices, colls.Set) else gray_indices)
     ijks = ijks.T if ijks.shape[0] != 3 else ijks
@@ -928,83 +1229,27 @@ def _vertex_to_voxel_lines_interpolation(hemi, gray_indices, image_shape, vertex
     # positions, which should make the range 0-1, for example, cover the vertices in the first
     # voxel
     tmtx = vertex_to_voxel_matrix[0:3]
-    (pialX, whiteX) = [np.dot(tmtx, np.vstack((mtx, np.ones(mtx.shape[1]))))
+    (pialX, whiteX) = [np.dot(tmtx, np.vstack((mtx, np.ones(mtx.shape[1])))) + 0.5
                        for mtx in [hemi.pial_surface.coordinates, hemi.white_surface.coordinates]]
-    # get vectors along each axis
-    u = pialX - whiteX
-    # normalize these...
-    lens = np.sqrt(np.sum(u**2, axis=0))
-    z = np.isclose(lens, 0)
-    inv_lens = np.logical_not(z) / (lens + z)
-    u = inv_lens * u
-    usign = np.sign(u)
-    z = usign == 0
-    u_inv = np.logical_not(z) / (u + z)
-    # find smallest and largest voxel indices through which a particular line passes
-    (mins, maxs) = [np.array(x) for x in [whiteX, pialX]]
-    # extend these a little so that we don't miss any voxels
-    tmp = u*(lens*0.05)
-    mins -= tmp
-    maxs += tmp
-    # make a lookup table of gray indices (i,j,k) to the gray voxel's index
-    # this is a trick to get this all pushed into c-modules:
-    ijk_mult = (image_shape[1]*image_shape[2], image_shape[2], 1)
-    def ijk_to_idx(ijk):
-        return ijk_mult[0]*ijk[0] + ijk_mult[1]*ijk[1] + ijk[2]
-    idcs = ijk_to_idx(ijks)
-    index = sps.csr_matrix(
-        (range(1, 1+len(idcs)), (np.zeros(len(idcs)), idcs)),
-        shape=(1,np.prod(image_shape)),
-        dtype=np.int)
-    # make the interpolation matrix...
-    interp = sps.lil_matrix((len(ijks[0]), n), dtype=np.float)
-    # ends are the voxels in which the lines end
-    ends = usign * np.ceil(usign*maxs)
-    # Okay, we are going to walk along each of the lines...
-    ii = np.asarray(range(n))
-    while len(ii) > 0:
-        # we know that the current min values make a voxel on the line, but the question is, which
-        # voxel will be the next along the line?
-        # we want the ceiling of the current minimum; however, if the direction is negative (usign)
-        # then we need to reverse it, ceiling, then reverse it again:
-        z = (mins == np.round(mins))
-        uu = usign * np.ceil(usign * mins) # this is, for each dim, the nearest int boundary
-        # the new end-point might be farther than max? if so we replace it with max
-        uu = usign * np.min((uu, usign*ends), axis=0) # usign here undoes negatives
-        uu[z] += usign[z]
-        d3 = (uu - mins) * u_inv # the dist in each dim from the nearest integer boundary
-        # whichever row of d3 is smallest (rows are x, y, or z) determines how far the next voxel is
-        min_d = np.argsort(d3, axis=0)[0]
-        addrs = (min_d, range(len(min_d)))
-        d = d3[addrs]
-        frac = d * inv_lens
-        frac[inv_lens == 0] = 1
-        # what is the start voxel?
-        start = np.asarray(usign * np.floor(usign * mins), dtype=np.int)
-        # we want to add these fractions into the interp matrix
-        tmp = ijk_to_idx(start)
-        oob = np.any(start < 0, axis=0) | (tmp >= index.shape[1])
-        tmp[oob] = 0
-        found_idcs = index[0, tmp].toarray()[0]
-        gray_fis = (found_idcs > 0) & np.logical_not(oob)
-        found_idcs = found_idcs[gray_fis] - 1
-        interp[(found_idcs, ii[gray_fis])] = frac[gray_fis]
-        # update the min values
-        mins = mins + d*u
-        # if the min is now equal to the max, then we are done with that line!
-        keep = np.where(np.logical_not(np.isclose(np.sum((mins - maxs)**2, axis=0), 0))
-                        & np.all((maxs - mins) * u_inv > 0, axis=0))[0]
-        if len(keep) < len(ii):
-            (inv_lens,ii) = [x[keep] for x in (inv_lens,ii)]
-            (ends,mins,maxs,usign,u,u_inv) = [x[:,keep] for x in (ends,mins,maxs,usign,u,u_inv)]
+    # walk all of the white-to-pial lines through the voxels at once; each (voxel, vertex) pair
+    # is weighted by the fraction of the vertex's line that lies in the voxel
+    (vox, vs, fracs) = _voxel_traversal(whiteX, pialX)
+    # make a lookup from the gray voxels' flat indices to their order in gray_indices
+    image_shape = tuple(image_shape[0:3])
+    idcs = np.ravel_multi_index(tuple(ijks), image_shape)
+    srt = np.argsort(idcs)
+    ok = np.all((vox >= 0) & (vox < np.reshape(image_shape, (3,1))), axis=0) & (fracs > 0)
+    (vox, vs, fracs) = (vox[:,ok], vs[ok], fracs[ok])
+    vidcs = np.ravel_multi_index(tuple(vox), image_shape)
+    pos = np.clip(np.searchsorted(idcs, vidcs, sorter=srt), 0, len(idcs) - 1)
+    ok = (idcs[srt[pos]] == vidcs)
+    interp = sps.csr_matrix((fracs[ok], (srt[pos[ok]], vs[ok])), shape=(len(ijks[0]), n))
     # now we want to scale the rows by their totals
     totals = np.asarray(interp.sum(axis=1))[:,0]
     zs = np.isclose(totals, 0)
     inv_totals = np.logical_not(zs) / (totals + zs)
-    rng = range(len(inv_totals))
-    interp = sps.csr_matrix((inv_totals, (rng, rng))).dot(interp.tocsc())
     # That's all we have to do!
-    return interp
+    return sps.diags(inv_totals).dot(interp).tocsr()
 
 def _vertex_to_voxel_nearest_interpolation(hemi, gray_indices, voxel_to_vertex_matrix):
     if isinstance(hemi, Subject):       hemi   = (hemi.lh, hemi.rh)
@@ -1111,8 +1356,10 @@ def cortex_to_image_interpolation(obj, mask=None, affine=None, method='linear',
     hems = (obj.lh, obj.rh) if isinstance(obj, Subject) else (obj,)
     # all arguments are basically pre-processed; we just need to make the interpolation
     method = 'auto' if method is None else method.lower()
+    # the linear and nearest interpolations work in vertex-space, so they need the inverse affine
+    inv_affine = npla.inv(affine)
     if method in ['linear', 'auto', 'automatic']:
-        interp = [_vertex_to_voxel_linear_interpolation(h, mask, shape, affine) for h in hems]
+        interp = [_vertex_to_voxel_linear_interpolation(h, mask, shape, inv_affine) for h in hems]
         if len(interp) == 1: interp = interp[0]
         else: interp = sps.hstack(interp)
     elif method in ['lines', 'line']:
@@ -1120,7 +1367,7 @@ def cortex_to_image_interpolation(obj, mask=None, affine=None, method='linear',
         if len(interp) == 1: interp = interp[0]
         else: interp = sps.hstack(interp)
     elif method in ['heaviest', 'heavy', 'weight', 'weightiest']:
-        interp = [_vertex_to_voxel_linear_interpolation(h, mask, shape, affine) for h in hems]
+        interp = [_vertex_to_voxel_linear_interpolation(h, mask, shape, inv_affine) for h in hems]
         if len(interp) == 1: interp = interp[0]
         else: interp = sps.hstack(interp)
         # convert to binary matrix:
@@ -1130,8 +1377,7 @@ def cortex_to_image_interpolation(obj, mask=None, affine=None, method='linear',
                               shape=interp.shape,
                               dtype=np.int)
     elif method in ['nearest', 'near', 'nearest-neighbor', 'nn']:
-        aff = npla.inv(affine)
-        interp = [_vertex_to_voxel_nearest_interpolation(h, mask, aff) for h in hems]
+        interp = [_vertex_to_voxel_nearest_interpolation(h, mask, inv_affine) for h in hems]
         if len(interp) == 1: interp = interp[0]
         else: interp = sps.hstack(interp)
     else:
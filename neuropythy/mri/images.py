@@ -536,3 +536,57 @@ def to_image(img, image_type=None, meta_data=None, **kwargs):
     if aff0 is not None and 'affine' not in mdat: mdat['affine'] = to_affine(aff0, 3)
     # okay, we create the image now:
     return image_type.create(img, meta_data=mdat)
+_mgh_dtypes = tuple([np.dtype(t) for t in (np.uint8, np.int16, np.int32, np.float32)])
+def image_memmap(filename, shape, dtype=None, affine=None, image_type=None, fill=None):
+    '''
+    image_memmap(filename, shape) creates an uncompressed image file with the given filename whose
+      data has the given shape, and yields a writable numpy memmap of the file's data. The image
+      type is deduced from the filename's extension ('.nii' or '.mgh') unless given explicitly.
+      Once the memmap has been filled in and flushed, the file may be loaded as an ordinary image;
+      because the data is never held in memory all at once, this is suitable for very large
+      images such as long time-series.
+
+    The following options may be given:
+      * dtype (default: None) specifies the data type of the image; if None, the default type of
+        the image type is used. MGH files can only store uint8, int16, int32, and float32 data, so
+        for mgh images any other real type is stored as float32 and any other integer type as
+        int32.
+      * affine (default: None) specifies the affine transformation of the image; if None, the
+        default affine of the image type is used.
+      * image_type (default: None) specifies the image type; this may be 'nifti1' or 'mgh'.
+      * fill (default: None) specifies a value to which all of the image's voxels are set; if None,
+        then the file is created with zeros.
+    '''
+    if image_type is None:
+        flnm = filename.lower()
+        image_type = ('nifti1' if flnm.endswith('.nii') else
+                      'mgh'    if flnm.endswith('.mgh') else
+                      None)
+        if image_type is None:
+            raise ValueError('image_memmap requires an uncompressed .nii or .mgh filename')
+    image_type = to_image_type(image_type)
+    if image_type not in (Nifti1ImageType, MGHImageType):
+        raise ValueError('image_memmap supports only nifti1 and mgh images')
+    shape = tuple([int(k) for k in shape])
+    dtype = image_type.default_type() if dtype is None else np.dtype(dtype)
+    if image_type is MGHImageType and dtype not in _mgh_dtypes:
+        dtype = np.dtype(np.float32 if np.issubdtype(dtype, np.inexact) else np.int32)
+    affine = to_affine(image_type.default_affine() if affine is None else affine, 3)
+    # we make the header from an image of a broadcast (so not allocated) array of the right shape
+    img = image_type.image_type()(np.broadcast_to(np.zeros((), dtype=dtype), shape), affine)
+    img.update_header()
+    hdr = img.header
+    if image_type is Nifti1ImageType: hdr.set_data_offset(352)
+    offset = hdr.get_data_offset()
+    ddtype = hdr.get_data_dtype()
+    nbytes = ddtype.itemsize * int(np.prod(shape))
+    with open(filename, 'wb') as fl:
+        hdr.write_to(fl)
+        fl.write(b'\x00' * (offset - fl.tell()))
+        fl.truncate(offset + nbytes)
+        if image_type is MGHImageType:
+            fl.seek(offset + nbytes)
+            hdr.writeftr_to(fl)
+    arr = np.memmap(filename, dtype=ddtype, mode='r+', offset=offset, shape=shape, order='F')
+    if fill is not None and fill != 0: arr[...] = fill
+    return arr
@@ -9,4 +9,5 @@ models that are projected to the cortical surface. See specifically, the help st
 mesh_register function.
 '''
 
-from .core       import (mesh_register, java_potential_term)
+from .core       import (mesh_register, mesh_register_async, java_potential_term,
+                         coarse_map, prolong_displacement)
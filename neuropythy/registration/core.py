@@ -3,10 +3,14 @@
 # Core tools for registering the cortical surface to a particular potential function
 # By Noah C. Benson
 
-import numpy  as     np
-from   numpy  import pi
-from   ..java import (to_java_doubles, to_java_ints, to_java_array, java_link, serialize_numpy)
-from   ..     import geometry as geo
+import numpy         as     np
+import scipy.sparse  as     sps
+import scipy.spatial as     spspace
+from   numpy         import pi
+from   ..java        import (to_java_doubles, to_java_ints, to_java_array, java_link,
+                             serialize_numpy, from_java_doubles, java_executor)
+from   ..            import geometry as geo
+from   .             import engine
 import pimms
 
 # These are dictionaries of all the details we have about each of the possible arguments to the
@@ -42,7 +46,7 @@ _parse_field_data_types = {
        'harmonic':      ['newHarmonicPerimeterPotential', ['scale', 1.0], ['shape', 2.0],
                                                           'F', 'X']}};
 
-def _parse_field_function_argument(argdat, args, faces, edges, coords):
+def _parse_field_function_argument(argdat, args, faces, edges, coords, to_array=to_java_array):
     # first, see if this is an easy one...
     if argdat == 'F':
         return faces
@@ -51,19 +55,18 @@ def _parse_field_function_argument(argdat, args, faces, edges, coords):
     elif argdat == 'E':
         return edges
     elif pimms.is_int(argdat):
-        return to_java_array(args[argdat])
+        return to_array(args[argdat])
     # okay, none of those; must be a list with a default arg
     argname = argdat[0]
     argdflt = argdat[1]
     # see if we can find such an arg...
     for i in range(len(args)):
         if pimms.is_str(args[i]) and args[i].lower() == argname.lower():
-            return (args[i+1] if pimms.is_number(args[i+1]) else to_java_array(args[i+1]))
+            return (args[i+1] if pimms.is_number(args[i+1]) else to_array(args[i+1]))
     # did not find the arg; use the default:
     return argdflt
 
-def _parse_field_argument(instruct, faces, edges, coords):
-    _java = java_link()
+def _parse_field_argument(instruct, faces, edges, coords, backend='java'):
     if pimms.is_str(instruct):
         insttype = instruct
         instargs = []
@@ -84,23 +87,33 @@ def _parse_field_argument(instruct, faces, edges, coords):
         if shape_name not in instdata:
             raise RuntimeError('Shape ' + shape_name + ' not supported for type ' + insttype)
         instdata = instdata[shape_name]
-    # okay, we have a list of instructions... find the java method we are going to call...
-    java_method = getattr(_java.jvm.nben.mesh.registration.Fields, instdata[0])
+    # okay, we have a list of instructions... find the method we are going to call...
+    if backend == 'numpy':
+        if instdata[0] not in engine.fields:
+            raise RuntimeError('Field type %s is not supported by the numpy backend' % insttype)
+        method = engine.fields[instdata[0]]
+        to_array = np.asarray
+    else:
+        method = getattr(java_link().jvm.nben.mesh.registration.Fields, instdata[0])
+        to_array = to_java_array
     # and parse the arguments into a list...
-    java_args = [_parse_field_function_argument(a, instargs, faces, edges, coords)
-                 for a in instdata[1:]]
+    args = [_parse_field_function_argument(a, instargs, faces, edges, coords, to_array=to_array)
+            for a in instdata[1:]]
     # and call the function...
-    return java_method(*java_args)
+    return method(*args)
 
 # parse a field potential argument and return a java object that represents it
-def _parse_field_arguments(arg, faces, edges, coords):
+def _parse_field_arguments(arg, faces, edges, coords, backend='java'):
     '''See mesh_register.'''
     if not hasattr(arg, '__iter__'):
         raise RuntimeError('field argument must be a list-like collection of instructions')
-    pot = [_parse_field_argument(instruct, faces, edges, coords) for instruct in arg]
+    pot = [_parse_field_argument(instruct, faces, edges, coords, backend=backend)
+           for instruct in arg]
     # make a new Potential sum unless the length is 1
     if len(pot) <= 1:
         return pot[0]
+    elif backend == 'numpy':
+        return engine.field_sum(pot)
     else:
         sp = java_link().jvm.nben.mesh.registration.Fields.newSum()
         for field in pot: sp.addField(field)
@@ -118,9 +131,97 @@ def java_potential_term(mesh, instructions):
     coords = to_java_doubles(mesh.coordinates)
     return _parse_field_arguments([instructions], faces, edges, coords)
     
+# Multiresolution registration: coarse meshes, coarse fields, and prolongation of displacements
+def coarse_map(mesh, factor):
+    '''
+    coarse_map(mesh, factor) yields the tuple (coarse, vertex_ids) where coarse is a 2D mesh with
+      roughly 1/factor as many vertices as the given 2D mesh and vertex_ids are the indices of the
+      vertices of mesh that were kept in coarse. The vertices are chosen by laying a square grid
+      whose spacing is sqrt(factor) times the mean edge length over the mesh and keeping one vertex
+      per grid cell (a boundary vertex if the cell contains one, otherwise the vertex nearest the
+      cell center); these are then re-triangulated, and triangles outside of mesh are discarded.
+    '''
+    x = mesh.coordinates
+    if x.shape[0] != 2: raise ValueError('coarse_map requires a 2D mesh')
+    h = np.mean(mesh.edge_lengths) * np.sqrt(factor)
+    x0 = np.min(x, axis=1)[:,None]
+    cell = np.floor((x - x0) / h).astype(int)
+    key = cell[0] * (np.max(cell[1]) + 1) + cell[1]
+    dist = np.sum((x - x0 - (cell + 0.5)*h)**2, axis=0)
+    # boundary vertices are those on edges with only one face
+    tess = mesh.tess
+    bnd = np.zeros(mesh.vertex_count, dtype=bool)
+    bnd[tess.indexed_edges[:, tess.adjacency.edge_faces.counts == 1]] = True
+    ii = np.lexsort((dist, ~bnd, key))
+    ii = ii[np.concatenate([[True], np.diff(key[ii]) != 0])]
+    # re-triangulate; the mesh container test removes triangles that span concavities
+    faces = spspace.Delaunay(x[:,ii].T).simplices.T
+    ctrs = np.mean([x[:,ii[f]] for f in faces], axis=0)
+    faces = faces[:, np.array([c is not None for c in mesh.container(ctrs)], dtype=bool)]
+    (u, faces) = np.unique(faces, return_inverse=True)
+    vids = ii[u]
+    faces = np.reshape(faces, (3, -1))
+    return (geo.mesh(faces, x[:,vids]), vids)
+def _coarse_field(field, mesh, coarse):
+    # anchors are moved to the coarse vertices nearest to their fine vertices; the anchor points
+    # are shifted by the same offset so that the anchored displacements are unchanged
+    tree = spspace.cKDTree(coarse.coordinates.T)
+    res = []
+    for instr in field:
+        if pimms.is_str(instr) or instr[0].lower() not in ('anchor', 'mesh-field'):
+            res.append(instr)
+            continue
+        if instr[0].lower() == 'mesh-field':
+            raise ValueError('multiresolution registration does not support mesh-field potentials')
+        ii = np.asarray(instr[2], dtype=int)
+        pts = np.asarray(instr[3], dtype=float)
+        if pts.shape[0] != 2: pts = pts.T
+        near = tree.query(mesh.coordinates[:,ii].T)[1]
+        pts = pts + coarse.coordinates[:,near] - mesh.coordinates[:,ii]
+        res.append([instr[0], instr[1], near, pts] + list(instr[4:]))
+    return res
+def prolong_displacement(mesh, coarse, disp, max_iterations=10):
+    '''
+    prolong_displacement(mesh, coarse, disp) yields the (2 x n) displacement field of the given
+      fine mesh's vertices that is linearly interpolated from the (2 x k) displacement field disp
+      of the vertices of the coarse mesh (see coarse_map), in the meshes' reference coordinates.
+      Fine vertices outside of the coarse mesh take the displacement of their nearest coarse
+      vertex.
+
+    Because the interpolated displacement can fold the fine mesh where the coarse displacement
+    changes quickly, the displacements of the vertices of any flipped triangles are replaced with
+    the mean displacement of their neighbors for up to max_iterations (default: 10) rounds; if
+    triangles are still flipped, the whole displacement is scaled down until none are.
+    '''
+    x = mesh.coordinates
+    interp = coarse.interpolation_matrix(x, method='linear')
+    res = np.asarray(interp.dot(np.transpose(disp))).T
+    out = np.where(~np.isclose(np.asarray(interp.sum(axis=1)).flatten(), 1))[0]
+    if len(out) > 0:
+        near = spspace.cKDTree(coarse.coordinates.T).query(x[:,out].T)[1]
+        res[:,out] = np.asarray(disp)[:,near]
+    faces = mesh.tess.indexed_faces
+    def _signs(y):
+        (u, v) = (y[:,faces[1]] - y[:,faces[0]], y[:,faces[2]] - y[:,faces[0]])
+        return np.sign(u[0]*v[1] - u[1]*v[0])
+    s0 = _signs(x)
+    (a, b) = mesh.tess.indexed_edges
+    n = mesh.vertex_count
+    adj = sps.csr_matrix((np.ones(2*len(a)), (np.concatenate([a,b]), np.concatenate([b,a]))),
+                         shape=(n,n))
+    deg = np.asarray(adj.sum(axis=1)).flatten()
+    for _ in range(max_iterations):
+        bad = np.unique(faces[:, _signs(x + res) != s0])
+        if len(bad) == 0: return res
+        res[:,bad] = adj[bad].dot(res.T).T / deg[bad]
+    scale = 1.0
+    while scale > 1e-6 and (_signs(x + scale*res) != s0).any(): scale *= 0.5
+    return scale * res
+
 # The mesh_register function
 def mesh_register(mesh, field, max_steps=2000, max_step_size=0.05, max_pe_change=1,
-                  method='random', return_report=False, initial_coordinates=None):
+                  method='random', return_report=False, initial_coordinates=None,
+                  snapshot_stride=None, backend='java', multiresolution=None):
     '''
     mesh_register(mesh, field) yields the mesh that results from registering the given mesh by
     minimizing the given potential field description over the position of the vertices in the
@@ -178,9 +279,12 @@ def mesh_register(mesh, field, max_steps=2000, max_step_size=0.05, max_pe_change
         allowed while 0.9 would indicate that the minimizer should minimize until the potential
         is 10% or less of the initial potential.
       * return_report (default: False) indicates that instead of returning the registered data,
-        mesh_register should instead return the Java Minimizer.Report object (for debugging).
+        mesh_register should instead return the Java Minimizer.Report object (for debugging); with
+        the numpy backend, the reports are dictionaries. With multiresolution, the reports of the
+        coarse stages precede those of the full mesh.
       * method (default: 'random') specifies the search algorithm used; available options are 
-        'random', 'nimble', and 'pure'. Generally all options will converge on a similar solution,
+        'random', 'nimble', and 'pure'; the numpy backend additionally accepts 'lbfgs', which uses
+        a limited-memory BFGS search direction. Generally all options will converge on a similar solution,
         but usually 'random' is fastest. The 'pure' option uses the nben library's step function,
         which performs straight-forward gradient descent. The 'nimble' option performs a gradient
         descent in which subsets of vertices in the mesh that have the highest gradients during the
@@ -197,6 +301,28 @@ def mesh_register(mesh, field, max_steps=2000, max_step_size=0.05, max_pe_change
         gradients from dominating the minimization and often results in the best results.
       * initial_coordinates (default: None) specifies the start coordinates of the registration;
         if None, uses those in the given mesh, which is generally desired.
+      * snapshot_stride (default: None) may be set to a positive integer s, in which case the
+        vertex coordinates are recorded every s steps during the minimization and the return value
+        is the tuple (result, snapshots), where result is the value that would otherwise have been
+        returned and snapshots is a (k x d x n) array of the k recorded d x n coordinate matrices,
+        beginning with the initial coordinates. The snapshots are taken within a single
+        minimization session (per round of max_steps), so the mesh and the potential field are
+        prepared only once. With multiresolution, the initial coordinates are followed by one
+        snapshot per coarse stage: the full mesh's coordinates after that stage's displacement has
+        been prolonged to it.
+      * backend (default: 'java') specifies the registration engine: 'java' uses the nben Java
+        library via py4j, while 'numpy' uses the vectorized implementation in the module
+        neuropythy.registration.engine, which requires no JVM. The numpy backend supports all
+        field types except 'mesh-field'.
+      * multiresolution (default: None) may be a list of tuples (factor, steps), in which case a
+        coarse-to-fine registration of the (2D) mesh is performed: for each tuple, in order, a
+        coarse mesh with about 1/factor as many vertices is made (see coarse_map), registered for
+        the given number of steps (with a max_step_size scaled by sqrt(factor)), and its
+        displacement is prolonged to the full mesh (see prolong_displacement) as the starting
+        point of the next stage. The full mesh is then registered for max_steps steps, which can
+        typically be much smaller than without the coarse stages. Anchors are moved to the nearest
+        coarse vertices during the coarse stages. For example, [(64, 2000), (8, 1000)] followed by
+        max_steps=500.
 
     Examples:
       registered_mesh = mesh_register(
@@ -225,16 +351,45 @@ def mesh_register(mesh, field, max_steps=2000, max_step_size=0.05, max_pe_change
         if method[0].lower() == 'nimble' and len(method) > 1 and not pimms.is_str(method[1]):
             method = [method]
     else: method = [method]
+    if backend not in ('java', 'numpy'):
+        raise ValueError('backend must be \'java\' or \'numpy\'')
     if initial_coordinates is None:
         init_coords = mesh.coordinates
     else:
         init_coords = np.asarray(initial_coordinates)
         if init_coords.shape[0] != mesh.coordinates.shape[0]:
             init_coords = init_coords.T
+    if multiresolution is None: multiresolution = ()
+    if snapshot_stride is not None:
+        if not pimms.is_int(snapshot_stride) or snapshot_stride < 1:
+            raise RuntimeError('snapshot_stride must be None or a positive integer')
+        snapshot_stride = int(snapshot_stride)
+        nsnaps = 1 + len(multiresolution)
+        nsnaps += sum(int(np.ceil(ms / snapshot_stride)) for ms in max_steps)
+        snapshots = np.zeros((nsnaps,) + init_coords.shape)
+        snapshots[0] = init_coords
+    rep = []
+    isnap = 1
+    for (factor, steps) in multiresolution:
+        (cmesh, vids) = coarse_map(mesh, factor)
+        cx = init_coords[:,vids]
+        # the final snapshot of the coarse registration is its result
+        (crep, csnaps) = mesh_register(cmesh, _coarse_field(field, mesh, cmesh),
+                                       max_steps=steps, max_pe_change=max_pe_change,
+                                       method=method[0],
+                                       max_step_size=np.sqrt(factor) * max_step_size[0],
+                                       initial_coordinates=cx, backend=backend,
+                                       return_report=return_report,
+                                       snapshot_stride=max(steps, 1))
+        if return_report and crep is not None: rep.extend(crep)
+        init_coords = init_coords + prolong_displacement(mesh, cmesh, csnaps[-1] - cx)
+        if snapshot_stride is not None:
+            snapshots[isnap] = init_coords
+            isnap += 1
     # If steps is 0, we can skip most of this...
     if np.sum(max_steps) == 0:
-        if return_report: return None
-        else: return init_coords
+        res = (rep if len(rep) > 0 else None) if return_report else init_coords
+        return res if snapshot_stride is None else (res, snapshots)
     # Otherwise, we run at least some minimization
     max_pe_change = float(max_pe_change)
     nrounds = len(max_steps)
@@ -242,15 +397,22 @@ def mesh_register(mesh, field, max_steps=2000, max_step_size=0.05, max_pe_change
         if len(max_step_size) == 1: max_step_size = [max_step_size[0] for _ in max_steps]
         if len(method) == 1:        method        = [method[0]        for _ in max_steps]
     # Parse the field argument.
-    faces  = to_java_ints(mesh.tess.indexed_faces)
-    edges  = to_java_ints(mesh.tess.indexed_edges)
-    coords = to_java_doubles(mesh.coordinates)
-    init_coords = coords if init_coords is mesh.coordinates else to_java_doubles(init_coords)
-    potential = _parse_field_arguments(field, faces, edges, coords)
+    if backend == 'numpy':
+        (faces, edges, coords) = (mesh.tess.indexed_faces, mesh.tess.indexed_edges,
+                                  mesh.coordinates)
+        (to_array, from_array) = (np.asarray, np.array)
+        new_minimizer = engine.Minimizer
+    else:
+        faces  = to_java_ints(mesh.tess.indexed_faces)
+        edges  = to_java_ints(mesh.tess.indexed_edges)
+        coords = to_java_doubles(mesh.coordinates)
+        (to_array, from_array) = (to_java_doubles, from_java_doubles)
+        new_minimizer = java_link().jvm.nben.mesh.registration.Minimizer
+    init_coords = coords if init_coords is mesh.coordinates else to_array(init_coords)
+    potential = _parse_field_arguments(field, faces, edges, coords, backend=backend)
     # Okay, that's basically all we need to do the minimization...
-    rep = []
     for (method,max_step_size,max_steps) in zip(method, max_step_size, max_steps):
-        minimizer = java_link().jvm.nben.mesh.registration.Minimizer(potential, init_coords)
+        minimizer = new_minimizer(potential, init_coords)
         max_step_size = float(max_step_size)
         max_steps = int(max_steps)
         if pimms.is_str(method):
@@ -261,22 +423,48 @@ def mesh_register(mesh, field, max_steps=2000, max_step_size=0.05, max_pe_change
             k = method[1]
             method = method[0].lower()
         if method == 'pure':
-            r = minimizer.step(max_pe_change, max_steps, max_step_size)
+            step = lambda n: minimizer.step(max_pe_change, n, max_step_size)
+        elif method == 'random' and backend == 'numpy':
+            step = lambda n: minimizer.random_step(max_pe_change, n, max_step_size, k == -1)
         elif method == 'random':
             # if k is -1, we do the inverse version where we draw from the 1/mean distribution
-            r = minimizer.randomStep(max_pe_change, max_steps, max_step_size, k == -1)
+            step = lambda n: minimizer.randomStep(max_pe_change, n, max_step_size, k == -1)
+        elif method == 'nimble' and backend == 'numpy':
+            step = lambda n: minimizer.nimble_step(max_pe_change, n, max_step_size, int(k))
         elif method == 'nimble':
-            r = minimizer.nimbleStep(max_pe_change, max_steps, max_step_size, int(k))
+            step = lambda n: minimizer.nimbleStep(max_pe_change, n, max_step_size, int(k))
+        elif method == 'lbfgs' and backend == 'numpy':
+            step = lambda n: minimizer.lbfgs_step(max_pe_change, n, max_step_size)
         else:
             raise ValueError('Unrecognized method: %s' % method)
-        rep.append(r)
-        init_coords = minimizer.getX()
+        getx = (lambda: minimizer.x) if backend == 'numpy' else minimizer.getX
+        if snapshot_stride is None:
+            rep.append(step(max_steps))
+        else:
+            # run the steps in chunks on the same minimizer, recording the coordinates after each
+            for s0 in range(0, max_steps, snapshot_stride):
+                rep.append(step(min(snapshot_stride, max_steps - s0)))
+                snapshots[isnap] = from_array(getx())
+                isnap += 1
+        init_coords = getx()
     # Return the report if requested
-    if return_report:
-        return rep
-    else:
-        result = init_coords
-        return np.asarray([[x for x in row] for row in result])
+    res = rep if return_report else from_array(init_coords)
+    return res if snapshot_stride is None else (res, snapshots)
+
+def mesh_register_async(mesh, field, *args, **kw):
+    '''
+    mesh_register_async(mesh, field, ...) is a non-blocking version of mesh_register(mesh, field,
+      ...): it accepts the same arguments but immediately yields a concurrent.futures.Future object
+      whose result() is the return value of mesh_register. The registration is run by the
+      java_executor() thread pool, whose workers each own a separate JVM, so up to
+      neuropythy.config['java_gateway_count'] registrations (e.g., of two hemispheres or of many
+      subjects) run in parallel; further registrations wait in the pool's queue.
+
+    Note that the field instructions must not contain Java objects created outside of the worker
+    (e.g., by java_potential_term); such objects belong to the default JVM and cannot be passed to
+    another.
+    '''
+    return java_executor().submit(mesh_register, mesh, field, *args, **kw)
 
 # The topology and registration stuff is below:
 class JavaTopology:
@@ -0,0 +1,335 @@
+####################################################################################################
+# registration/engine.py
+# A NumPy implementation of the potential fields and the minimizer used by mesh_register
+# By Noah C. Benson
+
+'''
+The neuropythy.registration.engine module implements the potential fields and the minimization
+routines of the nben Java library directly in NumPy. It is used by mesh_register when it is called
+with the option backend='numpy'; see help(neuropythy.registration.mesh_register).
+'''
+
+import numpy as np
+
+# Shape functions ##################################################################################
+# Each shape function f(x, x0, *params) yields the tuple (f(x), df/dx) for an array of values x and
+# reference values x0; values outside of a function's domain yield an infinite potential.
+def _harmonic(x, x0, scale, order):
+    d = x - x0
+    a = np.abs(d)
+    return (scale / order * a**order, scale * a**(order - 1) * np.sign(d))
+def _harmonic_log(x, x0, scale, order):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d = np.log(x / x0)
+        a = np.abs(d)
+        (f, df) = (scale / order * a**order, scale * a**(order - 1) * np.sign(d) / x)
+    bad = ~(x > 0)
+    return (np.where(bad, np.inf, f), np.where(bad, 0, df))
+def _lennard_jones(x, x0, scale, order):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = x0 / x
+        (rq, rh) = (r**order, r**(0.5 * order))
+        (f, df) = (scale * (1 + rq - 2*rh), scale * order / x * (rh - rq))
+    bad = ~(x > 0)
+    return (np.where(bad, np.inf, f), np.where(bad, 0, df))
+def _gaussian(x, x0, scale, sigma, order):
+    d = (x - x0) / sigma
+    a = np.abs(d)
+    e = np.exp(-0.5 * a**order)
+    return (scale * (1 - e), scale * e * 0.5 * order * a**(order - 1) * np.sign(d) / sigma)
+def _infinite_well(x, x0, scale, order, mn, mx):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        (u, v) = (((x0 - mn) / (x - mn))**order, ((mx - x0) / (mx - x))**order)
+        (a, b) = (u - 1, v - 1)
+        f = scale * (a**2 + b**2)
+        df = scale * 2 * (-a * order * u / (x - mn) + b * order * v / (mx - x))
+    bad = ~((x > mn) & (x < mx))
+    return (np.where(bad, np.inf, f), np.where(bad, 0, df))
+
+def _accumulate(ii, g, n):
+    '''
+    _accumulate(ii, g, n) yields the (d x n) matrix whose columns are the sums of the columns of the
+      (d x m) matrix g grouped by the m vertex indices ii.
+    '''
+    return np.array([np.bincount(ii, weights=row, minlength=n) for row in g])
+
+# Potential Fields #################################################################################
+# Each field is a function of the (d x n) coordinate matrix X that yields the tuple (pe, G) of the
+# potential value and its (d x n) gradient. As in the nben library, the potential of each field is
+# the mean (rather than the sum) of its terms, so that scales are comparable between fields.
+def edge_field(shape, params, edges, X0, relative=False):
+    '''
+    edge_field(shape, params, edges, X0) yields a potential field function of the edge lengths of
+      the given (2 x m) edge matrix; the reference lengths are taken from the coordinates X0. If
+      the option relative is True, then the shape function operates on the ratio of each edge
+      length to its reference length instead of on the edge length itself.
+    '''
+    (u, v) = np.asarray(edges)
+    uv = np.concatenate([u, v])
+    d0 = np.sqrt(np.sum((X0[:,u] - X0[:,v])**2, axis=0))
+    m = float(len(u))
+    def _edge_field(X):
+        dx = X[:,u] - X[:,v]
+        d = np.sqrt(np.sum(dx**2, axis=0))
+        if relative:
+            (f, df) = shape(d / d0, 1.0, *params)
+            df = df / d0
+        else: (f, df) = shape(d, d0, *params)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            g = dx * np.where(d > 0, df / (m * d), 0)
+        return (np.sum(f) / m, _accumulate(uv, np.concatenate([g, -g], axis=1), X.shape[1]))
+    return _edge_field
+def _corner_angles(p, q):
+    # the angles between the columns of p and q and their gradients with respect to p and q
+    (pp, qq) = (np.sum(p**2, axis=0), np.sum(q**2, axis=0))
+    (pp, qq) = (np.where(pp > 0, pp, np.inf), np.where(qq > 0, qq, np.inf))
+    if p.shape[0] == 2:
+        # signed angles in 2D
+        th = np.arctan2(p[0]*q[1] - p[1]*q[0], np.sum(p*q, axis=0))
+        dp = np.array([p[1], -p[0]]) / pp
+        dq = np.array([-q[1], q[0]]) / qq
+    else:
+        dt = np.sum(p*q, axis=0)
+        cr = np.sqrt(np.maximum(pp*qq - dt**2, 0))
+        th = np.arctan2(cr, dt)
+        s = -1.0 / np.where(cr > 0, cr, np.inf)
+        dp = s * (q - dt / pp * p)
+        dq = s * (p - dt / qq * q)
+    return (th, dp, dq)
+def _face_corners(X, faces):
+    # yields (p, q) where p and q are the two edge vectors leaving each corner of each face; the
+    # corners are ordered as faces[0], faces[1], then faces[2]
+    (x0, x1, x2) = [X[:,f] for f in faces]
+    e = np.concatenate([x1 - x0, x2 - x1, x0 - x2], axis=1)
+    return (e, -np.roll(e, len(faces[0]), axis=1))
+def angle_field(shape, params, faces, X0):
+    '''
+    angle_field(shape, params, faces, X0) yields a potential field function of the angles of the
+      triangles in the given (3 x m) face matrix; the reference angles are taken from X0. In 2D the
+      angles are signed such that they are positive in the reference configuration; a triangle
+      that flips during the minimization thus has negative angles.
+    '''
+    faces = np.asarray(faces)
+    # the angles are at corners a, between the edges to b and to c
+    (a, b, c) = np.concatenate([faces, faces[[1,2,0]], faces[[2,0,1]]], axis=1)
+    bca = np.concatenate([b, c, a])
+    th0 = _corner_angles(*_face_corners(X0, faces))[0]
+    sgn = np.where(th0 < 0, -1.0, 1.0) if X0.shape[0] == 2 else 1.0
+    th0 = sgn * th0
+    m = float(len(a))
+    def _angle_field(X):
+        (th, dp, dq) = _corner_angles(*_face_corners(X, faces))
+        (f, df) = shape(sgn * th, th0, *params)
+        df = df * sgn / m
+        (gp, gq) = (dp * df, dq * df)
+        g = np.concatenate([gp, gq, -(gp + gq)], axis=1)
+        return (np.sum(f) / m, _accumulate(bca, g, X.shape[1]))
+    return _angle_field
+def anchor_field(shape, params, vertices, points):
+    '''
+    anchor_field(shape, params, vertices, points) yields a potential field function of the
+      distances between the given vertex indices and the columns of the (d x k) matrix of points.
+    '''
+    vertices = np.asarray(vertices, dtype=int)
+    points = np.asarray(points, dtype=float)
+    if points.shape[1] != len(vertices): points = points.T
+    m = float(len(vertices))
+    def _anchor_field(X):
+        dx = X[:,vertices] - points
+        d = np.sqrt(np.sum(dx**2, axis=0))
+        (f, df) = shape(d, 0.0, *params)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            g = dx * np.where(d > 0, df / (m * d), 0)
+        return (np.sum(f) / m, _accumulate(vertices, g, X.shape[1]))
+    return _anchor_field
+def perimeter_field(shape, params, faces, X0):
+    '''
+    perimeter_field(shape, params, faces, X0) yields a potential field function of the distances of
+      the vertices on the boundary of the given triangle mesh from their positions in X0.
+    '''
+    faces = np.asarray(faces)
+    n = X0.shape[1]
+    (u, v) = (faces.flatten(), faces[[1,2,0]].flatten())
+    keys = np.minimum(u, v) * n + np.maximum(u, v)
+    (keys, cnts) = np.unique(keys, return_counts=True)
+    keys = keys[cnts == 1]
+    vs = np.unique(np.concatenate([keys // n, keys % n]))
+    if len(vs) == 0: return lambda X: (0.0, np.zeros(X.shape))
+    return anchor_field(shape, params, vs, X0[:,vs])
+def field_sum(fields):
+    '''
+    field_sum(fields) yields the potential field function that is the sum of the given fields.
+    '''
+    fields = list(fields)
+    if len(fields) == 1: return fields[0]
+    def _field_sum(X):
+        (pe, G) = (0, np.zeros(X.shape))
+        for f in fields:
+            (p, g) = f(X)
+            pe += p
+            G += g
+        return (pe, G)
+    return _field_sum
+
+# These map the nben Fields method names (see registration.core._parse_field_data_types) to the
+# functions that construct the equivalent fields; each accepts the same arguments in the same order
+fields = {
+    'newStandardMeshPotential':
+        lambda es, ans, F, X: field_sum([edge_field(_harmonic, (es, 2.0), _face_edges(F), X),
+                                         angle_field(_harmonic, (ans, 2.0), F, X),
+                                         perimeter_field(_harmonic, (1.0, 2.0), F, X)]),
+    'newHarmonicEdgePotential':
+        lambda s, q, F, X:       edge_field(_harmonic, (s, q), _face_edges(F), X),
+    'newHarmonicLogEdgePotential':
+        lambda s, q, F, X:       edge_field(_harmonic_log, (s, q), _face_edges(F), X),
+    'newLJEdgePotential':
+        lambda s, q, F, X:       edge_field(_lennard_jones, (s, q), _face_edges(F), X),
+    'newWellEdgePotential':
+        lambda s, q, a, b, E, X: edge_field(_infinite_well, (s, q, a, b), E, X, relative=True),
+    'newHarmonicAnglePotential':
+        lambda s, q, F, X:       angle_field(_harmonic, (s, q), F, X),
+    'newHarmonicLogAnglePotential':
+        lambda s, q, F, X:       angle_field(_harmonic_log, (s, q), F, X),
+    'newLJAnglePotential':
+        lambda s, q, F, X:       angle_field(_lennard_jones, (s, q), F, X),
+    'newWellAnglePotential':
+        lambda s, q, a, b, F, X: angle_field(_infinite_well, (s, q, a, b), F, X),
+    'newHarmonicAnchorPotential':
+        lambda s, q, ii, pts, X: anchor_field(_harmonic, (s, q), ii, pts),
+    'newGaussianAnchorPotential':
+        lambda s, sig, q, ii, pts, X: anchor_field(_gaussian, (s, sig, q), ii, pts),
+    'newHarmonicPerimeterPotential':
+        lambda s, q, F, X:       perimeter_field(_harmonic, (s, q), F, X)}
+def _face_edges(faces):
+    faces = np.asarray(faces)
+    (u, v) = (faces.flatten(), faces[[1,2,0]].flatten())
+    return np.unique(np.sort([u, v], axis=0), axis=1)
+
+# The Minimizer ####################################################################################
+class Minimizer(object):
+    '''
+    Minimizer(field, X) is a gradient-descent minimizer of the given potential field function,
+      starting at the (d x n) coordinate matrix X; it mirrors the nben Java Minimizer class. The
+      methods step, random_step, nimble_step, and lbfgs_step each run up to a given number of steps
+      and may be called repeatedly to continue the same minimization; minimizer.x is the current
+      coordinate matrix.
+
+    The max_pe_change argument of the step methods is the fraction of the potential at the time the
+    minimizer was created that may be minimized away before the minimizer stops. Every step moves
+    each vertex by at most max_step_size and is shortened until it decreases the potential.
+    '''
+    def __init__(self, field, X):
+        self.field = field
+        self.x = np.array(X, dtype=float)
+        (self.potential, self.gradient) = field(self.x)
+        self.initial_potential = self.potential
+        if not np.isfinite(self.potential):
+            raise ValueError('the initial potential of the registration is not finite')
+        # the fraction of the maximum step size that the last successful step used
+        self.step_fraction = 1.0
+    def _done(self, max_pe_change):
+        return self.potential <= (1 - max_pe_change) * self.initial_potential
+    def _descend(self, D, max_step_size, t=None, max_halvings=24):
+        # moves along the direction matrix D by t (by default, such that the largest column of D
+        # moves by max_step_size times the last successful step fraction), halving the step until
+        # the potential decreases; yields False if that never happens
+        dn = np.sqrt(np.max(np.sum(D**2, axis=0)))
+        if not dn > 0: return False
+        tmax = max_step_size / dn
+        if t is None: (t, frac) = (self.step_fraction * tmax, True)
+        else:         (t, frac) = (min(t, tmax), False)
+        for _ in range(max_halvings):
+            x = self.x + t*D
+            (pe, g) = self.field(x)
+            if pe < self.potential:
+                (self.x, self.potential, self.gradient) = (x, pe, g)
+                if frac: self.step_fraction = min(1.0, 2.0 * t / tmax)
+                return True
+            t *= 0.5
+        return False
+    def _run(self, direction, max_pe_change, max_steps, max_step_size):
+        pe0 = self.potential
+        k = 0
+        while k < max_steps and not self._done(max_pe_change):
+            if not self._descend(direction(), max_step_size): break
+            k += 1
+        return {'steps': k, 'initial_potential': pe0, 'final_potential': self.potential}
+    def step(self, max_pe_change, max_steps, max_step_size):
+        '''
+        minimizer.step(max_pe_change, max_steps, max_step_size) performs up to max_steps steps of
+          plain gradient descent.
+        '''
+        return self._run(lambda: -self.gradient, max_pe_change, max_steps, max_step_size)
+    def random_step(self, max_pe_change, max_steps, max_step_size, inverse=False):
+        '''
+        minimizer.random_step(max_pe_change, max_steps, max_step_size) performs up to max_steps
+          steps of gradient descent in which the step length of each vertex is drawn from an
+          exponential distribution whose mean is the length of the vertex's gradient. If the
+          optional argument inverse is True, then all vertices draw their step lengths from the
+          same distribution, whose mean is the mean gradient length.
+        '''
+        def _direction():
+            g = self.gradient
+            gn = np.sqrt(np.sum(g**2, axis=0))
+            mu = np.full(len(gn), np.mean(gn)) if inverse else gn
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return -g * np.where(gn > 0, np.random.exponential(mu + (mu == 0)) / gn, 0)
+        return self._run(_direction, max_pe_change, max_steps, max_step_size)
+    def nimble_step(self, max_pe_change, max_steps, max_step_size, k=4):
+        '''
+        minimizer.nimble_step(max_pe_change, max_steps, max_step_size, k) performs up to max_steps
+          nimble steps: the vertices are partitioned into k groups by gradient length and each step
+          consists of 2**k sub-steps in which the group with the j'th largest gradients is updated
+          every 2**j sub-steps.
+        '''
+        k = int(k)
+        pe0 = self.potential
+        n = self.x.shape[1]
+        steps = 0
+        while steps < max_steps and not self._done(max_pe_change):
+            gn = np.sum(self.gradient**2, axis=0)
+            part = np.empty(n, dtype=int)
+            part[np.argsort(-gn)] = np.arange(n) * k // n
+            moved = False
+            for s in range(2**k):
+                mask = (s % (2**part)) == 0
+                if self._descend(-self.gradient * mask, max_step_size): moved = True
+                if self._done(max_pe_change): break
+            if not moved: break
+            steps += 1
+        return {'steps': steps, 'initial_potential': pe0, 'final_potential': self.potential}
+    def lbfgs_step(self, max_pe_change, max_steps, max_step_size, history=10):
+        '''
+        minimizer.lbfgs_step(max_pe_change, max_steps, max_step_size) performs up to max_steps
+          steps of the limited-memory BFGS algorithm; the search direction is obtained from the
+          last history (default: 10) steps by the standard two-loop recursion, and the step is
+          limited by max_step_size and shortened until the potential decreases (so that the
+          infinite potentials of the infinite-well fields are never crossed).
+        '''
+        pe0 = self.potential
+        (ss, ys) = ([], [])
+        k = 0
+        while k < max_steps and not self._done(max_pe_change):
+            g = self.gradient.flatten()
+            q = g.copy()
+            alphas = []
+            for (s,y) in reversed(list(zip(ss, ys))):
+                a = np.dot(s, q) / np.dot(y, s)
+                q -= a * y
+                alphas.append(a)
+            if ss: q *= np.dot(ss[-1], ys[-1]) / np.dot(ys[-1], ys[-1])
+            for ((s,y),a) in zip(zip(ss, ys), reversed(alphas)):
+                q += (a - np.dot(y, q) / np.dot(y, s)) * s
+            D = -np.reshape(q, self.x.shape)
+            if np.dot(q, g) <= 0: (D, ss, ys) = (-self.gradient, [], [])
+            x0 = self.x
+            if not self._descend(D, max_step_size, t=1.0):
+                if not ss or not self._descend(-self.gradient, max_step_size): break
+                (ss, ys) = ([], [])
+            (s, y) = ((self.x - x0).flatten(), self.gradient.flatten() - g)
+            if np.dot(s, y) > 0:
+                ss.append(s)
+                ys.append(y)
+                if len(ss) > history: (ss, ys) = (ss[1:], ys[1:])
+            k += 1
+        return {'steps': k, 'initial_potential': pe0, 'final_potential': self.potential}
@@ -13,6 +13,45 @@ else:                        import collections            as colls
 
 logging.getLogger().setLevel(logging.INFO)
 
+def grid_mesh(n, width=None):
+    '''
+    grid_mesh(n) yields a 2D mesh of an n x n grid of vertices, spaced 1 apart, in which each grid
+      square is split into two triangles.
+    grid_mesh(n, width) scales the grid so that it is width wide.
+    '''
+    (r, c) = np.meshgrid(np.arange(n-1), np.arange(n-1))
+    (r, c) = (r.flatten(), c.flatten())
+    (a, b, d, e) = (r*n + c, r*n + c + 1, r*n + c + n, r*n + c + n + 1)
+    x = np.asarray(np.meshgrid(np.arange(float(n)), np.arange(float(n))))[::-1].reshape(2, -1)
+    if width is not None: x = x * (width / (n - 1.0))
+    return ny.geometry.mesh(np.hstack([[a, b, e], [a, e, d]]), x)
+def disk_mesh(rings):
+    '''
+    disk_mesh(k) yields a 2D mesh of a disk made of a center vertex and k concentric rings of
+      vertices, spaced 1 apart, that are Delaunay-triangulated.
+    '''
+    import scipy.spatial as space
+    x = [[0.0, 0.0]]
+    for k in range(1, rings + 1):
+        th = np.arange(6*k) * 2*np.pi / (6*k)
+        x.extend(np.transpose([k*np.cos(th), k*np.sin(th)]))
+    x = np.transpose(x)
+    return ny.geometry.mesh(space.Delaunay(x.T).simplices.T, x)
+def sphere_mesh(n, radius=100.0):
+    '''
+    sphere_mesh(n) yields a 3D mesh of a sphere with n vertices in a Fibonacci spiral whose faces
+      are the convex hull of the vertices, wound counter-clockwise when seen from outside.
+    '''
+    import scipy.spatial as space
+    i = np.arange(n) + 0.5
+    (phi, th) = (np.arccos(1 - 2*i/n), np.pi * (1 + np.sqrt(5)) * i)
+    x = radius * np.asarray([np.cos(th)*np.sin(phi), np.sin(th)*np.sin(phi), np.cos(phi)])
+    faces = space.ConvexHull(x.T).simplices.T
+    (a, b, c) = [x[:,f] for f in faces]
+    flip = np.sum(np.cross(b - a, c - a, axis=0) * a, axis=0) < 0
+    faces[1:, flip] = faces[:0:-1, flip]
+    return ny.geometry.mesh(faces, x)
+
 class TestNeuropythy(unittest.TestCase):
     '''
     The TestNeuropythy class defines all the tests for the neuropythy library.
@@ -85,6 +124,157 @@ class TestNeuropythy(unittest.TestCase):
         wh = np.isfinite(v1_ecc) & np.isfinite(v1_rad)
         self.assertGreater(np.corrcoef(v1_ecc[wh], v1_rad[wh])[0,0], 0.5)
 
+    def test_tesselation(self):
+        '''
+        test_tesselation() ensures that the adjacency data of the Tesselation class are correct.
+        '''
+        logging.info('neuropythy: Testing tesselation topology...')
+        # a square pyramid (with an open base) whose vertex labels are not 0-based
+        faces = np.array([[10,11,12], [10,12,13], [10,13,14], [10,14,11]])
+        tess = ny.geometry.tess(faces)
+        self.assertEqual(tess.vertex_count, 5)
+        self.assertEqual(tess.edge_count, 8)
+        self.assertEqual(tess.edges.shape, (2,8))
+        self.assertTrue((tess.edges[0] < tess.edges[1]).all())
+        # edge (10,11) is shared by faces 0 (10->11) and 3 (11->10)
+        e = tess.index[(11,10)]
+        self.assertEqual(e, tess.index[(10,11)])
+        self.assertEqual(tuple(tess.edge_faces[e]), (0,3))
+        self.assertEqual(tess.edge_face_index[(10,11)], (0,3))
+        self.assertEqual(tess.index[(12,10,11)], 0)
+        self.assertIsNone(tess.index[(11,12,13)])
+        self.assertIsNone(tess.index[(11,13)])
+        self.assertEqual([tuple(fs) for fs in tess.face_neighbors], [(3,1), (0,2), (1,3), (0,2)])
+        self.assertEqual(tuple(tess.vertex_faces[0]), (0,1,2,3))
+        self.assertEqual(tess.vertex_face_index[12], (0,1))
+        self.assertEqual(list(tess.index(np.array([10,14,99]))), [0,4,None])
+        self.assertEqual(len(tess.edge_index), 16)
+        # neighborhoods are ordered by face winding; boundary fans run edge to edge
+        self.assertEqual(tuple(tess.neighborhoods[0]), (12,13,14,11))
+        self.assertEqual(tuple(tess.neighborhoods[2]), (13,10,11))
+        self.assertEqual(tuple(tess.indexed_neighborhoods[2]), (3,0,1))
+        # sub-tesselations derive their topology from the parent's but must match a fresh build
+        sub = tess.subtess([10,11,12,13])
+        ref = ny.geometry.tess(sub.faces)
+        self.assertEqual(list(sub.supertess_indices), [0,1,2,3])
+        self.assertEqual(list(sub.supertess_face_indices), [0,1])
+        self.assertTrue(np.array_equal(sub.edges, ref.edges))
+        self.assertTrue(np.array_equal(sub.adjacency.face_edges, ref.adjacency.face_edges))
+        for k in ['edge_faces', 'face_neighbors', 'vertex_faces', 'vertex_edges', 'neighborhoods']:
+            self.assertEqual([tuple(u) for u in getattr(sub, k)], [tuple(u) for u in getattr(ref, k)])
+        # tesselations with identical faces share their topology
+        self.assertIs(ny.geometry.tess(faces.T).adjacency, tess.adjacency)
+        self.assertIsNot(ref.adjacency, tess.adjacency)
+
+    def test_container(self):
+        '''
+        test_container() ensures that mesh.container() and mesh.address() find the faces that
+          contain points on flat and spherical meshes, including points on vertices and edges and
+          points outside of the mesh, by comparing them to a brute-force search.
+        '''
+        logging.info('neuropythy: Testing point location in meshes...')
+        rng = np.random.RandomState(0)
+        def brute_force(mesh, pts):
+            # yields a (faces x points) boolean matrix of which faces contain which points; for 3D
+            # meshes, a face contains the points whose rays from the origin pass through it
+            (a, b, c) = [mesh.coordinates[:,f].T for f in mesh.tess.indexed_faces]
+            res = []
+            for p in pts.T:
+                if mesh.coordinates.shape[0] == 2:
+                    m = np.transpose([b - a, c - a], (1,2,0))
+                    (u, v) = np.transpose(np.linalg.solve(m, p - a))
+                    ok = np.ones(len(u), dtype=bool)
+                else:
+                    m = np.transpose([np.tile(p, (len(a), 1)), a - b, a - c], (1,2,0))
+                    (t, u, v) = np.transpose(np.linalg.solve(m, a))
+                    ok = (t > 0)
+                res.append(ok & (u >= -1e-9) & (v >= -1e-9) & (u + v <= 1 + 1e-9))
+            return np.transpose(res)
+        for mesh in [disk_mesh(6), sphere_mesh(200)]:
+            (x, fs) = (mesh.coordinates, mesh.tess.indexed_faces)
+            # random points inside of random faces, the vertices, and the edge midpoints
+            w = rng.dirichlet([1,1,1], 300).T
+            f = rng.randint(fs.shape[1], size=300)
+            (u, v) = mesh.tess.indexed_edges
+            pts = [np.sum([w[k] * x[:,fs[k,f]] for k in range(3)], axis=0),
+                   x, 0.5*(x[:,u] + x[:,v])]
+            if x.shape[0] == 2: pts.append(rng.rand(2, 50) * 30 + 7) # all outside of the disk
+            pts = np.hstack(pts)
+            bf = brute_force(mesh, pts)
+            res = mesh.container(pts)
+            found = np.array([r is not None for r in res])
+            self.assertTrue(np.array_equal(found, bf.any(axis=0)))
+            ii = np.where(found)[0]
+            self.assertTrue(bf[res[ii].astype(int), ii].all())
+            # addresses of points in the mesh return to the same points (or the same directions)
+            addr = mesh.address(pts)
+            self.assertTrue(np.isnan(addr['coordinates'][:, ~found]).all())
+            y = mesh.unaddress({k:v[:,found] for (k,v) in six.iteritems(addr)})
+            pts = pts[:,found]
+            if x.shape[0] == 3:
+                (y, pts) = [q / np.sqrt(np.sum(q**2, axis=0)) for q in (y, pts)]
+            self.assertTrue(np.allclose(y, pts))
+
+    def test_registration(self):
+        '''
+        test_registration() ensures that the numpy backend of mesh_register minimizes a simple
+          potential without flipping any triangles.
+        '''
+        from neuropythy.registration import mesh_register
+        logging.info('neuropythy: Testing numpy mesh registration...')
+        mesh = grid_mesh(10)
+        (faces, x) = (mesh.tess.indexed_faces, mesh.coordinates)
+        def signed_areas(x):
+            (u, v) = (x[:,faces[1]] - x[:,faces[0]], x[:,faces[2]] - x[:,faces[0]])
+            return u[0]*v[1] - u[1]*v[0]
+        # pull the middle vertex toward a corner
+        field = [['edge', 'harmonic'], ['angle', 'infinite-well'],
+                 ['anchor', 'harmonic', [44], [[3.0], [3.0]], 'scale', 10.0]]
+        for method in ['random', 'lbfgs']:
+            (y, snaps) = mesh_register(mesh, field, method=method, max_steps=100, backend='numpy',
+                                       snapshot_stride=50)
+            self.assertEqual(snaps.shape, (3, 2, 100))
+            self.assertTrue(np.array_equal(snaps[-1], y))
+            self.assertLess(np.linalg.norm(y[:,44] - 3), np.linalg.norm(x[:,44] - 3))
+            self.assertTrue((np.sign(signed_areas(y)) == np.sign(signed_areas(x))).all())
+
+    def test_multiresolution(self):
+        '''
+        test_multiresolution() ensures that coarse meshes and prolonged displacements used by the
+          multiresolution mode of mesh_register do not flip any triangles.
+        '''
+        from neuropythy.registration import (mesh_register, coarse_map, prolong_displacement)
+        logging.info('neuropythy: Testing multiresolution mesh registration...')
+        mesh = disk_mesh(12)
+        (faces, x) = (mesh.tess.indexed_faces, mesh.coordinates)
+        def signed_areas(x):
+            (u, v) = (x[:,faces[1]] - x[:,faces[0]], x[:,faces[2]] - x[:,faces[0]])
+            return u[0]*v[1] - u[1]*v[0]
+        (coarse, vids) = coarse_map(mesh, 8)
+        self.assertLess(coarse.vertex_count, mesh.vertex_count / 4)
+        self.assertTrue(np.array_equal(coarse.coordinates, x[:,vids]))
+        # swirl the coarse mesh; the stronger swirls fold the interpolated displacement
+        cx = coarse.coordinates
+        for amount in [0.5, 3.0]:
+            th = amount * (1 - np.sqrt(np.sum(cx**2, axis=0))/12)**2
+            cy = [np.cos(th)*cx[0] - np.sin(th)*cx[1], np.sin(th)*cx[0] + np.cos(th)*cx[1]]
+            disp = prolong_displacement(mesh, coarse, cy - cx)
+            self.assertEqual(disp.shape, x.shape)
+            self.assertGreater(np.max(np.abs(disp)), 0.5)
+            self.assertTrue((np.sign(signed_areas(x + disp)) == np.sign(signed_areas(x))).all())
+        # the full registration reports and snapshots include the coarse stage
+        field = [['edge', 'harmonic'], ['angle', 'infinite-well'],
+                 ['anchor', 'harmonic', [0], [[3.0], [3.0]], 'scale', 10.0]]
+        (y, snaps) = mesh_register(mesh, field, max_steps=50, backend='numpy',
+                                   snapshot_stride=25, multiresolution=[(8, 50)])
+        self.assertEqual(snaps.shape, (4, 2, mesh.vertex_count))
+        self.assertTrue(np.array_equal(snaps[0], x))
+        self.assertTrue(np.array_equal(snaps[-1], y))
+        self.assertTrue((np.sign(signed_areas(y)) == np.sign(signed_areas(x))).all())
+        rep = mesh_register(mesh, field, max_steps=50, backend='numpy', return_report=True,
+                            multiresolution=[(8, 50)])
+        self.assertEqual(len(rep), 2)
+
     def test_cmag(self):
         '''
         test_cmag() ensures that the neuropythy.vision cortical magnification function is working.
@@ -155,6 +345,309 @@ class TestNeuropythy(unittest.TestCase):
             vs = calc_interp(sub.rh, intersub.rh, ps)
             check_interp(sub.rh, ps, vs)
 
+    def test_interpolation_matrix(self):
+        '''
+        test_interpolation_matrix() ensures that interpolation matrices between small synthetic meshes
+          are correct and may be requested using either a mesh or its coordinates.
+        '''
+        logging.info('neuropythy: Testing mesh-to-mesh interpolation matrices...')
+        src = grid_mesh(21, 10.0)
+        dst = grid_mesh(11, 9.0)
+        dat = 2*src.coordinates[0] - src.coordinates[1]
+        for method in ['linear', 'nearest', 'heaviest']:
+            interp = src.interpolation_matrix(dst, method=method, cache_path=None)
+            self.assertEqual(interp.shape, (dst.vertex_count, src.vertex_count))
+            self.assertTrue(np.allclose(interp.sum(axis=1), 1))
+            cmp = src.interpolation_matrix(dst.coordinates, method=method, cache_path=None)
+            self.assertEqual((interp != cmp).nnz, 0)
+        # linear interpolation of a linear function is exact
+        u = src.interpolate(dst, dat, method='linear', cache_path=None)
+        self.assertTrue(np.allclose(u, 2*dst.coordinates[0] - dst.coordinates[1]))
+
+    def test_from_image(self):
+        '''
+        test_from_image() ensures that mesh.from_image() samples the scaled data of images that are
+          read lazily from disk and that it writes its results correctly into non-contiguous out
+          arrays.
+        '''
+        import nibabel, tempfile, shutil
+        logging.info('neuropythy: Testing mesh.from_image()...')
+        rng = np.random.RandomState(0)
+        mesh = sphere_mesh(50, 3.0)
+        aff = np.eye(4)
+        aff[:3,3] = -4
+        # an int16 image with a non-trivial slope and intercept; the sampled data should be real
+        img = nibabel.Nifti1Image(rng.randint(0, 100, size=(9,9,9,4)).astype(np.int16), aff)
+        img.header.set_slope_inter(0.5, 10)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            flnm = os.path.join(tmpdir, 'scaled.nii')
+            nibabel.save(img, flnm)
+            dat = np.asarray(nibabel.load(flnm).get_fdata())
+            cmp = mesh.from_image(dat, affine=aff)
+            res = mesh.from_image(flnm, chunk_size=3)
+            self.assertEqual(res.dtype, np.float64)
+            self.assertTrue(np.allclose(res, cmp))
+            self.assertFalse(np.allclose(res, np.round(res)))
+        finally: shutil.rmtree(tmpdir)
+        # a 5D image written into a Fortran-ordered out array
+        dat = rng.rand(9,9,9,2,3)
+        cmp = mesh.from_image(dat, affine=aff)
+        out = np.zeros((mesh.vertex_count, 2, 3), order='F')
+        res = mesh.from_image(dat, affine=aff, out=out, chunk_size=2)
+        self.assertIs(res, out)
+        self.assertTrue(np.allclose(out, cmp))
+
+    def test_cortex_to_image(self):
+        '''
+        test_cortex_to_image() ensures that subject.cortex_to_image() projects multi-frame data in
+          blocks into memory-mapped NIfTI and MGH output files with the same result as an in-memory
+          projection, including when the requested dtype cannot be stored in an MGH file.
+        '''
+        import nibabel, tempfile, shutil
+        logging.info('neuropythy: Testing cortex_to_image()...')
+        @pimms.immutable
+        class TestSubject(ny.mri.Subject):
+            @pimms.value
+            def voxel_to_native_matrix(voxel_to_vertex_matrix): return voxel_to_vertex_matrix
+        (white, pial) = (sphere_mesh(200, 6.0), sphere_mesh(200, 8.0))
+        ctx = ny.mri.Cortex('lh', white.tess,
+                            {'white': white.coordinates, 'pial': pial.coordinates}, {})
+        # a 21 x 21 x 21 image whose gray voxels form a shell between the surfaces
+        r = np.sqrt(np.sum((np.mgrid[0:21, 0:21, 0:21] - 10.0)**2, axis=0))
+        mask = nibabel.Nifti1Image(((r > 6.3) & (r < 7.7)).astype(np.int32), np.eye(4))
+        aff = np.eye(4)
+        aff[:3,3] = -10
+        sub = TestSubject(hemis={'lh': ctx}, images={'lh_gray_mask': mask},
+                          voxel_to_vertex_matrix=aff)
+        dat = np.random.RandomState(0).rand(5, ctx.vertex_count)
+        cmp = sub.cortex_to_image(dat, hemi='lh', block_size=None)
+        self.assertEqual(cmp.shape, (21, 21, 21, 5))
+        self.assertTrue(np.sum(cmp != 0) > 0)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for ext in ['nii', 'mgh']:
+                for dtype in [None, np.float64]:
+                    flnm = os.path.join(tmpdir, 'proj.' + ext)
+                    img = sub.cortex_to_image(dat, hemi='lh', output=flnm, block_size=2,
+                                              dtype=dtype)
+                    self.assertTrue(np.allclose(np.asarray(img.dataobj), cmp))
+                    del img
+        finally: shutil.rmtree(tmpdir)
+
+    def test_geodesic_distances(self):
+        '''
+        test_geodesic_distances() ensures that the geodesic distances on a flat grid mesh match the
+          Euclidean distances, using both the Dijkstra and the heat methods, with one or more
+          sources and with a distance limit.
+        '''
+        logging.info('neuropythy: Testing geodesic distances...')
+        mesh = grid_mesh(21)
+        x = mesh.coordinates
+        euc = lambda ks: np.min([np.sqrt(np.sum((x - x[:,[k]])**2, axis=0)) for k in ks], axis=0)
+        for srcs in [[220], [0, 440, 30], [44, 396, 220]]:
+            e = euc(srcs)
+            # the Dijkstra distances follow the edges, so they can't be shorter than the Euclidean
+            # distances, and the diagonals of the grid make them at most sqrt(2) times longer
+            d = mesh.geodesic_distances(srcs)
+            self.assertTrue(np.all(d[srcs] == 0))
+            self.assertTrue(np.all(d >= e - 1e-9))
+            self.assertTrue(np.all(d <= np.sqrt(2)*e + 1e-9))
+            # with multiple sources, the distance is that to the nearest source
+            self.assertTrue(np.allclose(d, np.min([mesh.geodesic_distances([k]) for k in srcs],
+                                                  axis=0)))
+            # the same sources may be given as a boolean mask
+            mask = np.zeros(mesh.vertex_count, dtype=bool)
+            mask[srcs] = True
+            self.assertTrue(np.array_equal(d, mesh.geodesic_distances(mask)))
+            # the heat method approximates the true distances (less so at the corners of the grid)
+            h = mesh.geodesic_distances(srcs, method='heat')
+            self.assertLess(np.mean(np.abs(h - e)), 0.4)
+            if 0 not in srcs: self.assertLess(np.max(np.abs(h - e) / np.maximum(e, 1)), 0.25)
+            # distances beyond a limit are infinite
+            dl = mesh.geodesic_distances(srcs, limit=5)
+            self.assertTrue(np.array_equal(np.isinf(dl), d > 5))
+            self.assertTrue(np.allclose(dl[d <= 5], d[d <= 5]))
+
+    def test_isolines(self):
+        '''
+        test_isolines() ensures that the isolines of fields on a grid mesh lie on the level sets of
+          the fields, that several levels may be requested at once, that the addresses use the
+          mesh's vertex labels, and that the lines are sorted from shortest to longest.
+        '''
+        logging.info('neuropythy: Testing isolines...')
+        mesh = grid_mesh(21)
+        # a submesh, so that the vertex labels are not the vertex indices
+        sub = mesh.submesh(np.where(mesh.coordinates[0] >= 3)[0])
+        self.assertFalse(np.array_equal(sub.labels, np.arange(sub.vertex_count)))
+        (x, y) = sub.coordinates
+        prop = x + 0.5*y
+        vals = [5.3, 9.7, 14.1]
+        lns = ny.geometry.isolines(sub, prop, vals)
+        self.assertEqual(len(lns), len(vals))
+        for (val, ln) in zip(vals, lns):
+            # a linear field has one straight isoline per value, exactly on its level set
+            self.assertEqual(len(ln), 1)
+            self.assertTrue(np.allclose(ln[0][0] + 0.5*ln[0][1], val))
+            # the lines for one value are the same as those for several values
+            self.assertTrue(np.array_equal(ln[0], ny.geometry.isolines(sub, prop, val)[0]))
+            addr = ny.geometry.isolines(sub, prop, val, yield_addresses=True)[0]
+            self.assertTrue(np.isin(addr['faces'], sub.labels).all())
+            self.assertTrue(np.allclose(sub.unaddress(addr), ln[0]))
+        # two circular isolines of different lengths; these are closed and sorted by length
+        (x, y) = mesh.coordinates
+        prop = np.minimum(np.sqrt((x - 14.5)**2 + (y - 13.5)**2) * 0.5,
+                          np.sqrt((x - 6)**2 + (y - 6)**2))
+        lns = mesh.isolines(prop, 2.7)
+        self.assertEqual(len(lns), 2)
+        self.assertLess(lns[0].shape[1], lns[1].shape[1])
+        for (ln, c, r) in zip(lns, [(6, 6), (14.5, 13.5)], [2.7, 5.4]):
+            self.assertTrue(np.allclose(ln[:,0], ln[:,-1]))
+            d = np.sqrt(np.sum((ln - np.reshape(c, (2,1)))**2, axis=0))
+            self.assertTrue(np.all(np.abs(d - r) < 0.25))
+
+    def test_smooth(self):
+        '''
+        test_smooth() ensures that the sparse solvers of mesh.smooth() agree with the L-BFGS solver,
+          including at the endpoints of the smoothness parameter.
+        '''
+        logging.info('neuropythy: Testing mesh smoothing...')
+        mesh = grid_mesh(10)
+        dat = mesh.coordinates[0] + np.random.RandomState(0).randn(100)
+        for smoothness in [0.0, 0.5, 1.0]:
+            ref = mesh.smooth(dat, smoothness=smoothness, outliers=[5,44,45], solver='lbfgs')
+            for solver in ['direct', 'cg']:
+                sm = mesh.smooth(dat, smoothness=smoothness, outliers=[5,44,45], solver=solver)
+                self.assertTrue(np.isfinite(sm).all())
+                self.assertTrue(np.allclose(sm, ref, atol=0.001))
+        # multiple columns are smoothed independently
+        dat = np.transpose([dat, 2*dat])
+        sm = mesh.smooth(dat, smoothness=0.5)
+        self.assertTrue(np.allclose(sm[:,1], 2*sm[:,0]))
+
+    def test_voxel_traversal(self):
+        '''
+        test_voxel_traversal() ensures that the voxel traversal used to interpolate from vertices to
+          voxels along white-to-pial lines matches a dense sampling of the lines.
+        '''
+        from neuropythy.mri.core import _voxel_traversal
+        logging.info('neuropythy: Testing voxel traversal...')
+        rng = np.random.RandomState(0)
+        x0 = rng.rand(3, 50) * 10
+        x1 = x0 + rng.randn(3, 50) * 2
+        # include a segment that lies on a voxel boundary and one of length 0
+        (x0[:,0], x1[:,0]) = ([1.0, 2.5, 3.5], [4.0, 2.5, 3.5])
+        x1[:,1] = x0[:,1]
+        (ijk, lns, fracs) = _voxel_traversal(x0, x1)
+        self.assertEqual(ijk.shape, (3, len(lns)))
+        self.assertEqual(len(fracs), len(lns))
+        self.assertTrue((fracs >= 0).all())
+        self.assertTrue(np.allclose(np.bincount(lns, weights=fracs, minlength=50), 1))
+        # compare the fractions to the occupancy of each voxel by 10,000 evenly spaced samples
+        ts = (np.arange(10000) + 0.5) / 10000
+        for l in range(50):
+            pts = np.floor(x0[:,l,None] + ts * (x1[:,l] - x0[:,l])[:,None]).astype(int)
+            (vox, cnts) = np.unique(pts, axis=1, return_counts=True)
+            expected = {tuple(v):c/10000.0 for (v,c) in zip(vox.T, cnts)}
+            found = {}
+            for (v,f) in zip(ijk[:, lns == l].T, fracs[lns == l]):
+                found[tuple(v)] = found.get(tuple(v), 0) + f
+            found = {k:v for (k,v) in six.iteritems(found) if v > 0}
+            self.assertEqual(set(found.keys()), set(expected.keys()))
+            for k in six.iterkeys(expected): self.assertAlmostEqual(found[k], expected[k], 3)
+        # empty input yields empty output
+        (ijk, lns, fracs) = _voxel_traversal(np.zeros((3,0)), np.zeros((3,0)))
+        self.assertEqual((ijk.shape, lns.shape, fracs.shape), ((3,0), (0,), (0,)))
+
+    def test_vertex_to_voxel_cache(self):
+        '''
+        test_vertex_to_voxel_cache() ensures that vertex-to-voxel interpolation matrices are saved
+          to and reloaded from the directory config['vertex_to_voxel_cache_path'], and that they
+          are keyed by the interpolation method and the affine transformation.
+        '''
+        import tempfile, shutil, scipy.sparse as sps
+        from neuropythy.mri.core import _cached_vertex_to_voxel_interpolation
+        logging.info('neuropythy: Testing the vertex-to-voxel interpolation cache...')
+        class hemi(object):
+            (white_surface, pial_surface) = (sphere_mesh(50, 10.0), sphere_mesh(50, 12.0))
+        gray = (np.arange(20), np.arange(20) % 3, np.arange(20) % 7)
+        (shape, aff) = ((20, 20, 20), np.eye(4))
+        calls = []
+        def f(hemi, gray_indices, image_shape, affine):
+            calls.append(affine)
+            return sps.random(len(gray_indices[0]), 50, density=0.1, random_state=len(calls))
+        tmpdir = tempfile.mkdtemp()
+        try:
+            ny.config['vertex_to_voxel_cache_path'] = tmpdir
+            m1 = _cached_vertex_to_voxel_interpolation('linear', f, hemi, gray, shape, aff)
+            self.assertEqual(len(os.listdir(tmpdir)), 1)
+            # the second request is loaded from the cache
+            m2 = _cached_vertex_to_voxel_interpolation('linear', f, hemi, gray, shape, aff)
+            self.assertEqual(len(calls), 1)
+            self.assertTrue(sps.isspmatrix_csr(m2))
+            self.assertEqual((m1 != m2).nnz, 0)
+            # a different method or affine is a different cache entry
+            _cached_vertex_to_voxel_interpolation('lines', f, hemi, gray, shape, aff)
+            aff2 = np.array(aff)
+            aff2[0,3] = 1
+            _cached_vertex_to_voxel_interpolation('linear', f, hemi, gray, shape, aff2)
+            self.assertEqual(len(calls), 3)
+            self.assertEqual(len(os.listdir(tmpdir)), 3)
+        finally:
+            ny.config['vertex_to_voxel_cache_path'] = None
+            shutil.rmtree(tmpdir)
+
+    def test_lru_cache(self):
+        '''
+        test_lru_cache() ensures that the LRUCache type evicts the least-recently used items when it
+          exceeds its limits on entries and bytes and that it counts its hits, misses, and evictions.
+        '''
+        from neuropythy.util import (LRUCache, estimate_nbytes)
+        logging.info('neuropythy: Testing LRU caches...')
+        # eviction by count: reading an item marks it as recently used, peeking does not
+        c = LRUCache(3)
+        for k in 'abc': c[k] = k.upper()
+        self.assertEqual(c['a'], 'A')
+        self.assertEqual(c.peek('b'), 'B')
+        c['d'] = 'D'
+        self.assertEqual(c.keys(), ['c', 'a', 'd'])
+        self.assertIsNone(c.get('b'))
+        self.assertEqual(c.get('b', 0), 0)
+        self.assertEqual(c.stats(), {'hits': 1, 'misses': 2, 'evictions': 1,
+                                     'entries': 3, 'bytes': 0})
+        # eviction by bytes; an item that alone exceeds the limit is kept until the next insert
+        c = LRUCache(max_bytes=100, sizeof=len)
+        c['a'] = 'x' * 40
+        c['b'] = 'x' * 40
+        c['c'] = 'x' * 30
+        self.assertEqual((c.keys(), c.nbytes), (['b', 'c'], 70))
+        c['d'] = 'x' * 200
+        self.assertEqual((c.keys(), c.nbytes), (['d'], 200))
+        c['e'] = 'x'
+        self.assertEqual((c.keys(), c.nbytes), (['e'], 1))
+        self.assertEqual(c.stats()['evictions'], 4)
+        # replacing, popping, and resizing items keep the byte count current
+        c['e'] = 'x' * 10
+        self.assertEqual(c.nbytes, 10)
+        self.assertEqual(c.pop('e'), 'x' * 10)
+        self.assertEqual((len(c), c.nbytes), (0, 0))
+        lst = [0] * 10
+        c['f'] = lst
+        c['g'] = [0] * 50
+        lst.extend([0] * 80)
+        c.resize('f')
+        self.assertEqual((c.keys(), c.nbytes), (['f'], 90))
+        # clearing does not count as evictions
+        evs = c.stats()['evictions']
+        c.clear()
+        self.assertEqual(c.stats()['evictions'], evs)
+        self.assertEqual((len(c), c.nbytes), (0, 0))
+        # byte estimates count data shared by several arrays or containers once
+        a = np.zeros(1000)
+        self.assertEqual(estimate_nbytes(a), 8000)
+        self.assertGreaterEqual(estimate_nbytes([a, a[10:], {'x': a}]), 8000)
+        self.assertLess(estimate_nbytes([a, a[10:], {'x': a}]), 9000)
+
     def test_path(self):
         '''
         test_path() ensures that the neuropythy.geometry.path and .path_trace data structures are
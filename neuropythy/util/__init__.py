@@ -13,6 +13,7 @@ from .core     import (ObjectWithMetaData, normalize, denormalize,
                        sine, cosine, tangent, cotangent, secant, cosecant,
                        arcsine, arccosine, arctangent,
                        library_path, address_data, is_address, AutoDict, auto_dict,
+                       array_digest, LRUCache, estimate_nbytes,
                        curve_spline, curve_intersection, close_curves, is_curve_spline,
                        to_curve_spline, CurveSpline,
                        DataStruct, data_struct, tmpdir, dirpath_to_list)
@@ -3,7 +3,7 @@
 # This file implements the command-line tools that are available as part of neuropythy as well as
 # a number of other random utilities.
 
-import types, inspect, atexit, shutil, tempfile, importlib, pimms, os, six
+import types, inspect, atexit, shutil, tempfile, importlib, hashlib, threading, pimms, os, sys, six
 import collections                       as colls
 import numpy                             as np
 import scipy.sparse                      as sps
@@ -377,6 +377,209 @@ def auto_dict(ival=None, miss=None):
     else: d.on_miss = miss
     return d
 
+def array_digest(*args):
+    '''
+    array_digest(a, b, ...) yields a hexadecimal string digest (SHA-1) of the contents of the given
+      arguments, which may be numpy arrays, scipy sparse matrices, strings, numbers, or tuples/lists
+      of these. The digest depends on the dtype, shape, and values of every array, so it may be used
+      as a cache key for data that is computed from the arrays.
+    '''
+    h = hashlib.sha1()
+    def _update(x):
+        if x is None: h.update(b'None;')
+        elif pimms.is_str(x): h.update(('str:%s;' % x).encode('utf-8'))
+        elif sps.issparse(x):
+            x = x.tocsr()
+            h.update(('sparse:%s;' % (x.shape,)).encode('utf-8'))
+            for u in (x.data, x.indices, x.indptr): _update(u)
+        elif isinstance(x, (tuple, list)):
+            h.update(('seq:%d;' % len(x)).encode('utf-8'))
+            for u in x: _update(u)
+        else:
+            x = np.ascontiguousarray(x)
+            h.update(('array:%s:%s;' % (x.dtype.str, x.shape)).encode('utf-8'))
+            if x.dtype.hasobject: h.update(repr(x.tolist()).encode('utf-8'))
+            else:                 h.update(x.tobytes())
+    for a in args: _update(a)
+    return h.hexdigest()
+
+class LRUCache(object):
+    '''
+    LRUCache(max_entries) yields a dictionary-like cache object that holds at most max_entries
+      items; when an item is added to a full cache, the least-recently used items are evicted.
+    LRUCache(max_entries, max_bytes, sizeof) additionally limits the sum of sizeof(value) over all
+      cached values to max_bytes. Either limit may be None, indicating no limit.
+
+    Cache objects count their hits, misses, and evictions; these counts, along with the current
+    number of entries and bytes, are returned as a dict by cache.stats(). LRUCache objects are
+    thread-safe.
+    '''
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = colls.OrderedDict()
+        self._sizes = {}
+        self._nbytes = 0
+        self._lock = threading.RLock()
+    def __repr__(self):
+        return 'LRUCache(<%d entries>, <%d bytes>)' % (len(self), self.nbytes)
+    def __len__(self):
+        return len(self._data)
+    def __iter__(self):
+        with self._lock: return iter(list(self._data.keys()))
+    def __contains__(self, k):
+        return k in self._data
+    def keys(self):
+        return list(iter(self))
+    @property
+    def nbytes(self):
+        '''
+        cache.nbytes is the sum of the sizes of all values currently held by the cache; this is
+          always 0 if the cache has no sizeof function.
+        '''
+        return self._nbytes
+    def _touch(self, k):
+        v = self._data.pop(k)
+        self._data[k] = v
+        return v
+    def __getitem__(self, k):
+        with self._lock:
+            if k not in self._data:
+                self.misses += 1
+                raise KeyError(k)
+            self.hits += 1
+            return self._touch(k)
+    def get(self, k, default=None):
+        '''
+        cache.get(k) yields the value associated with key k, or None if k is not in the cache; the
+          lookup counts as a hit or a miss.
+        cache.get(k, default) yields default instead of None on a miss.
+        '''
+        try:             return self[k]
+        except KeyError: return default
+    def peek(self, k, default=None):
+        '''
+        cache.peek(k) is like cache.get(k) except that it neither counts as a hit or miss nor marks
+          the item as recently used.
+        '''
+        return self._data.get(k, default)
+    def __setitem__(self, k, v):
+        with self._lock:
+            if k in self._data: self._discard(k)
+            sz = 0 if self.sizeof is None else self.sizeof(v)
+            self._data[k] = v
+            self._sizes[k] = sz
+            self._nbytes += sz
+            self.evict(keep=k)
+    def _discard(self, k):
+        v = self._data.pop(k)
+        self._nbytes -= self._sizes.pop(k, 0)
+        return v
+    def __delitem__(self, k):
+        with self._lock: self._discard(k)
+    def pop(self, k, *args):
+        '''
+        cache.pop(k) removes the key k from the cache and yields its value; if the key is not in
+          the cache, an error is raised unless a default value is also given: cache.pop(k, default).
+        '''
+        with self._lock:
+            if k in self._data: return self._discard(k)
+            elif len(args) > 0: return args[0]
+            else: raise KeyError(k)
+    def clear(self):
+        '''
+        cache.clear() removes all items from the cache; this does not count as evictions.
+        '''
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self._nbytes = 0
+    def resize(self, k):
+        '''
+        cache.resize(k) recalculates the size of the value associated with key k; this should be
+          called when a cached value grows, for example because it has realized lazy data. Any
+          resulting overflow of the cache's limits causes other items to be evicted.
+        '''
+        with self._lock:
+            if k not in self._data or self.sizeof is None: return
+            sz = self.sizeof(self._data[k])
+            self._nbytes += sz - self._sizes[k]
+            self._sizes[k] = sz
+            self.evict(keep=k)
+    def evict(self, keep=None):
+        '''
+        cache.evict() evicts the least-recently used items from the cache until its limits on the
+          number of entries and bytes are satisfied, and yields the number of evicted items.
+        cache.evict(keep=k) never evicts the key k.
+        '''
+        n = 0
+        with self._lock:
+            for k in list(self._data.keys()):
+                full = ((self.max_entries is not None and len(self._data) > self.max_entries) or
+                        (self.max_bytes is not None and self._nbytes > self.max_bytes))
+                if not full: break
+                if k == keep: continue
+                self._discard(k)
+                n += 1
+            self.evictions += n
+        return n
+    def stats(self):
+        '''
+        cache.stats() yields a dict of the hits, misses, evictions, entries, and bytes of the given
+          cache.
+        '''
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self), 'bytes': self.nbytes}
+
+def estimate_nbytes(obj, sample_size=256):
+    '''
+    estimate_nbytes(obj) yields an estimate of the number of bytes of memory used by the data in the
+      given object, which may be a numpy array, a scipy sparse matrix, a nibabel image, a pimms
+      immutable object, a (lazy) map, a sequence or set, or any combination of these. Only data that
+      has already been realized is counted: the unrealized values of immutable objects and lazy maps
+      are skipped. Data reachable from obj by more than one path is counted once, and memory-mapped
+      arrays are not counted.
+
+    The optional argument sample_size (default: 256) specifies the number of elements of a sequence
+    or set that are inspected; the sizes of larger sequences and sets are extrapolated from these.
+    '''
+    seen = set([])
+    (stack, total) = ([(obj, 1.0)], 0.0)
+    while len(stack) > 0:
+        (x, w) = stack.pop()
+        if x is None or id(x) in seen: continue
+        seen.add(id(x))
+        if isinstance(x, np.ndarray):
+            if isinstance(x, np.memmap): continue
+            elif isinstance(x.base, np.ndarray): stack.append((x.base, w))
+            else: total += w * x.nbytes
+        elif sps.issparse(x):
+            stack.extend([(getattr(x, k), w) for k in ('data','indices','indptr','row','col')
+                          if hasattr(x, k)])
+        elif is_image(x):
+            stack.extend([(getattr(x, k, None), w) for k in ('_dataobj', '_fdata_cache')])
+        elif pimms.is_lazy_map(x):
+            stack.extend([(x[k], w) for k in six.iterkeys(x) if not x.is_lazy(k)])
+        elif pimms.is_imm(x):
+            stack.extend([(v, w) for v in six.itervalues(object.__getattribute__(x, '__dict__'))])
+        elif pimms.is_map(x) or isinstance(x, (list, tuple, set, frozenset)):
+            total += w * sys.getsizeof(x)
+            xs = list(six.itervalues(x)) if pimms.is_map(x) else x
+            n = len(xs)
+            if n > sample_size:
+                xs = [u for (u,_) in zip(xs, range(sample_size))]
+                w = w * n / float(sample_size)
+            stack.extend([(u, w) for u in xs])
+        elif isinstance(x, (types.FunctionType, types.MethodType, types.ModuleType, type)):
+            continue
+        else:
+            total += w * sys.getsizeof(x)
+    return int(total)
+
 def simplex_summation_matrix(simplices, weight=None, inverse=False):
     '''
     simplex_summation_matrix(mtx) yields a scipy sparse array matrix that, when dotted with a
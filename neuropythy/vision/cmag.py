@@ -213,8 +213,7 @@ def rtmag_potential(hemi, retinotopy=Ellipsis, mask=Ellipsis, weight=Ellipsis,
         # to derive these values; for this we start with the parameters themselves:
         (x,y) = [op.identity[np.arange(k, 2*n, 2)] for k in (0,1)]
         # okay, we need to setup a bunch of least-squares solutions, one for each vertex:
-        nneis = np.asarray([len(nn) for nn in neis])
-        maxneis = np.max(nneis)
+        nneis = neis.counts
         thts = op.atan2(y, x)
         eccs = op.compose(op.piecewise(op.identity, ((-1e-9, 1e-9), 1)),
                           op.sqrt(x**2 + y**2))
@@ -222,7 +221,7 @@ def rtmag_potential(hemi, retinotopy=Ellipsis, mask=Ellipsis, weight=Ellipsis,
         sins = y/eccs
         # organize neighbors:
         # neis becomes a list of rows of 1st neighbor, second neighbor etc. with -1 indicating none
-        neis = np.transpose([nei + (-1,)*(maxneis - len(nei)) for nei in neis])
+        neis = neis.to_matrix(-1).T
         qnei = (neis > -1) # mark where there are actually neighbors
         neis[~qnei] = 0 # we want the -1s (now 0s) to behave okay when passed to a potential index
         # okay, walk through the neighbors setting up the least squares
@@ -326,10 +325,10 @@ def disk_vmag(hemi, retinotopy='any', to=None, **kw):
     vxy  = mdat['visual_coordinates'].T
     sxy  = msh.coordinates.T
     neis = msh.tess.indexed_neighborhoods
-    nnei = np.asarray(list(map(len, neis)))
+    nnei = neis.counts
     emax = np.max(nnei)
     whs  = [np.where(nnei > k)[0] for k in range(emax)]
-    neis = np.asarray([u + (-1,)*(emax - len(u)) for u in neis])
+    neis = neis.to_matrix(-1)
     dist = np.full((n, emax), np.nan)
     for (k,wh) in enumerate(whs):
         nei = neis[wh,k]
@@ -12,7 +12,7 @@ import os, gzip, types, six, pimms
 
 from ..           import geometry as geo
 from ..           import mri      as mri
-from ..java       import (java_link, serialize_numpy,
+from ..java       import (java_link, serialize_numpy, from_java_doubles,
                                      to_java_doubles, to_java_ints, to_java_array)
 from ..util       import (to_affine, library_path, is_tuple, is_list)
 from ..io         import importer
@@ -137,12 +137,26 @@ class SchiraModel(RetinotopyModel):
         return pimms.persist(params, depth=None)
 
     @pimms.value
-    def _java_object(parameters):
+    def _java_objects(parameters):
         '''
-        mdl._java_object is the java representation of the SchiraModel object mdl.
+        mdl._java_objects is a mutable dictionary, keyed by py4j gateway, of the java
+          representations of the SchiraModel object mdl that have been constructed so far; see
+          mdl._java_object.
         '''
+        return {}
+    @property
+    def _java_object(self):
+        '''
+        mdl._java_object is the java representation of the SchiraModel object mdl in the JVM of the
+          calling thread (see java_link()). A java object can only be used with arrays from its own
+          JVM, so when several JVMs are in use (see java_executor()), each gets its own object.
+        '''
+        gw = java_link()
+        jobj = self._java_objects.get(gw)
+        if jobj is not None: return jobj
         # Okay, let's construct the object...
-        return java_link().jvm.nben.neuroscience.SchiraModel(
+        parameters = self.parameters
+        jobj = gw.jvm.nben.neuroscience.SchiraModel(
             parameters['A'],
             parameters['B'],
             parameters['lam'],
@@ -158,6 +172,8 @@ class SchiraModel(RetinotopyModel):
             parameters['scale'][1],
             parameters['shear'][0][1],
             parameters['shear'][1][0])
+        self._java_objects[gw] = jobj
+        return jobj
 
     def angle_to_cortex(self, theta, rho):
         iterTheta = hasattr(theta, '__iter__')
@@ -175,7 +191,7 @@ class SchiraModel(RetinotopyModel):
                                                    to_java_doubles(rho))
         else:
             return self._java_object.angleToCortex(theta, rho)
-        return np.asarray([[c for c in r] for r in jarr])
+        return from_java_doubles(jarr)
     def cortex_to_angle(self, x, y):
         iterX = hasattr(x, '__iter__')
         iterY = hasattr(y, '__iter__')
@@ -192,7 +208,7 @@ class SchiraModel(RetinotopyModel):
                                                    to_java_doubles(y))
         else:
             return self._java_object.cortexToAngle(x, y)
-        dat = np.asarray([[c for c in r] for r in jarr])
+        dat = from_java_doubles(jarr)
         a = dat[:,2]
         a = np.round(np.abs(a))
         a[a > 3] = 0
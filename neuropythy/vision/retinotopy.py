@@ -1237,40 +1237,29 @@ def calc_anchors(preregistration_map, model, model_hemi,
 
 @pimms.calc('registered_map')
 def calc_registration(preregistration_map, anchors,
-                      max_steps=2000, max_step_size=0.05, method='random'):
+                      max_steps=2000, max_step_size=0.05, method='random', multiresolution=None):
     '''
     calc_registration is a calculator that creates the registration coordinates.
     '''
     # if max steps is a tuple (max, stride) then a trajectory is saved into
-    # the registered_map meta-data
+    # the registered_map meta-data; the snapshots are taken during a single registration
     pmap = preregistration_map
-    if is_tuple(max_steps) or is_list(max_steps):
-        (max_steps, stride) = max_steps
-        traj = [preregistration_map.coordinates]
-        x = preregistration_map.coordinates
-        for s in np.arange(0, max_steps, stride):
-            x = mesh_register(
-                preregistration_map,
-                [['edge',      'harmonic',      'scale', 1.0],
-                 ['angle',     'infinite-well', 'scale', 1.0],
-                 ['perimeter', 'harmonic'],
-                 anchors],
-                initial_coordinates=x,
-                method=method,
-                max_steps=stride,
-                max_step_size=max_step_size)
-            traj.append(x)
-        pmap = pmap.with_meta(trajectory=np.asarray(traj))
-    else:
-        x = mesh_register(
-            preregistration_map,
-            [['edge',      'harmonic',      'scale', 1.0],
-             ['angle',     'infinite-well', 'scale', 1.0],
-             ['perimeter', 'harmonic'],
-             anchors],
-            method=method,
-            max_steps=max_steps,
-            max_step_size=max_step_size)
+    stride = None
+    if is_tuple(max_steps) or is_list(max_steps): (max_steps, stride) = max_steps
+    x = mesh_register(
+        preregistration_map,
+        [['edge',      'harmonic',      'scale', 1.0],
+         ['angle',     'infinite-well', 'scale', 1.0],
+         ['perimeter', 'harmonic'],
+         anchors],
+        method=method,
+        max_steps=max_steps,
+        max_step_size=max_step_size,
+        snapshot_stride=stride,
+        multiresolution=multiresolution)
+    if stride is not None:
+        (x, traj) = x
+        pmap = pmap.with_meta(trajectory=traj)
     return pmap.copy(coordinates=x)
 @pimms.calc('registered_mesh', 'registration_prediction', 'prediction', 'predicted_mesh')
 def calc_prediction(registered_map, preregistration_mesh, native_mesh, model):
@@ -1360,6 +1349,7 @@ def register_retinotopy(hemi,
                         resample=Ellipsis,
                         radius=np.pi/3,
                         max_steps=2000, max_step_size=0.05, method='random',
+                        multiresolution=None,
                         yield_imap=False):
     '''
     register_retinotopy(hemi) registers the given hemisphere object, hemi, to a model of V1, V2,
@@ -1485,6 +1475,10 @@ def register_retinotopy(hemi,
         move in a single step of the minimization.
       * method (default 'random') is the method argument passed to mesh_register. This should be
         'random', 'pure', or 'nimble'. Generally, 'random' is recommended.
+      * multiresolution (default: None) is the multiresolution argument passed to mesh_register;
+        if given as a list of (factor, steps) tuples, the registration is first solved on coarser
+        versions of the map (e.g., [(64, 2000), (8, 1000)]), after which a smaller max_steps
+        suffices to refine it on the full map.
       * yield_imap (default: False) specifies whether the return value should be the new
         Mesh object or a pimms imap (i.e., a persistent mapping of the result of a pimms
         calculation) containing the meta-data that was used during the registration
@@ -1512,7 +1506,8 @@ def register_retinotopy(hemi,
         radius_weight=radius_weight, field_sign_weight=field_sign_weight,
         invert_rh_field_sign=invert_rh_field_sign,
         scale=scale, sigma=sigma, select=select, prior=prior, resample=resample, radius=radius,
-        max_steps=max_steps, max_step_size=max_step_size, method=method)
+        max_steps=max_steps, max_step_size=max_step_size, method=method,
+        multiresolution=multiresolution)
     return m if yield_imap else m['predicted_mesh']
 
 # Tools for registration-free retinotopy prediction:
@@ -1866,8 +1861,7 @@ def visual_isolines(hemi, retinotopy='any', visual_area=Ellipsis, mask=None, sur
     mesh = to_mesh((hemi, surface))
     # when we calculate the isolines we use this function which also adds in the polar angles and
     # eccentricities of the addressed lines
-    def calc_isolines(hemi, dat, ln, mask=None):
-        addrs = isolines(hemi, dat, ln, mask=mask, yield_addresses=True)
+    def calc_isolines(hemi, addrs):
         (angs,eccs) = [[hemi.interpolate(addr, retino[nm]) for addr in addrs]
                        for nm in ('polar_angle', 'eccentricity')]
         vxys = [np.asarray([e*np.cos(t), e*np.sin(t)])
@@ -1922,8 +1916,12 @@ def visual_isolines(hemi, retinotopy='any', visual_area=Ellipsis, mask=None, sur
                                [polar_angle_range, eccentricity_range]):
         # first, figure out the lines themselves
         if pimms.is_int(lns): lns = np.percentile(dat[mask], np.linspace(0, 100, 2*lns + 1)[1::2])
-        # now grab them from the hemisphere...
-        r[p] = pimms.lazy_map({ln:curry(calc_isolines, hemi, dat, ln, mask=mask) for ln in lns})
+        # now grab them from the hemisphere; all the lines are found at once when first needed
+        addrs = pimms.lazy_map({p: curry(isolines, hemi, dat, lns,
+                                         mask=mask, yield_addresses=True)})
+        r[p] = pimms.lazy_map({ln:curry(lambda addrs,p,k: calc_isolines(hemi, addrs[p][k]),
+                                        addrs, p, k)
+                               for (k,ln) in enumerate(lns)})
     return pyr.pmap(r)
 
 def clean_retinotopy_potential(hemi, retinotopy=Ellipsis, mask=Ellipsis, weight=Ellipsis,
@@ -2239,8 +2237,11 @@ def clean_retinotopy(hemi, retinotopy=Ellipsis, mask=Ellipsis, weight=Ellipsis,
                 r  = np.random.exponential(ec*jitter_scale)
                 X = X + np.transpose([r*np.cos(th), r*np.sin(th)])
             if average is not None and ii % average_mod == average_phase:
-                X = np.array([X[k] if len(nn) == 0 else np.mean(X[list(nn)],0)
-                              for (k,nn) in enumerate(submesh.tess.indexed_neighborhoods)])
+                nei = submesh.tess.indexed_neighborhoods
+                (X, cnt) = (np.asarray(X), np.reshape(nei.counts, (-1,) + (1,)*(np.ndim(X)-1)))
+                Xsum = np.zeros(X.shape)
+                np.add.at(Xsum, nei.rows, X[nei.data])
+                X = np.where(cnt == 0, X, Xsum / np.maximum(cnt, 1))
             rr = f.minimize(X, method=mtd, options=dict(maxiter=steps, disp=False))
             X = rr.x
         X = np.reshape(X, X0.shape)
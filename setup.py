@@ -108,7 +108,8 @@ setup(
                       'pyrsistent>=0.11',
                       'pint>=0.7',
                       'pimms>=0.3.5',
-                      'py4j>=0.10'],
+                      'py4j>=0.10',
+                      'futures>=3.0; python_version<"3.0"'],
     extras_require={
         'HCP':        ['s3fs>=0.1.5', 'h5py>=2.8.0'],
         'graphics2D': ['matplotlib>=1.5.3'],